@@ -17,10 +17,12 @@
 
 # standard libraries
 import argparse
-import ast
 import bisect
+import concurrent.futures
+import contextlib
 import copy
 import datetime
+import io
 import math
 import music21
 import numpy
@@ -98,39 +100,36 @@ class Harmonic_Rhythm(Enum):
     BAR2 = 3
     BAR4 = 4
 
-def get_chord(initial_offset, offset_chord, prev_sho_cho):
+def get_offset_key(offset):
     """
-    given offset and offset_chord dictionary, return short chord (e.g. Am or C) at offset
+    given an offset, return it as an offset_chord dictionary key
+    e.g. numpy.float64(4.0) from numpy.arange returns 4.0, a Fraction offset (e.g. after a triplet) is kept exact
+    :param offset: e.g. 4.0
+    :return: offset key e.g. 4.0
+    """
+    if isinstance(offset, numpy.floating):
+        return float(offset)
+    return offset
+
+def get_chord(initial_offset, offset_chord, prev_sho_cho, chord_offsets=None):
+    """
+    given offset and offset_chord dictionary, return short chord (e.g. Am or C) at offset,
+    i.e. the chord at the greatest offset_chord offset <= offset
     :param initial_offset: e.g. 3.0
-    :param chords_offset : e.g. {'F': 0.0, 'F': 1.0, 'G': 2.0, 'E': 3.0, 'F': 4.0, 'G': 5.0, 'A': 6.0} etc
-    :param: prev_sho_cho: previous short chord
+    :param offset_chord : e.g. {0.0: 'F', 1.0: 'F', 2.0: 'G', 3.0: 'E', 4.0: 'F', 5.0: 'G', 6.0: 'A'} etc
+    :param: prev_sho_cho: previous short chord, returned if offset is before the first offset_chord offset
+    :param chord_offsets: sorted offset_chord offsets e.g. [0.0, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+                          build once with sorted(offset_chord) when getting many chords
     :return: short_chord e.g. 'E'
     """
+    if chord_offsets is None:
+        chord_offsets = sorted(offset_chord)
 
-    # harmonic rhythm = 2nd key - 1st key
-    harmonic_rhythm = list(offset_chord.keys())[1] - next(iter(offset_chord))
+    i = bisect.bisect_right(chord_offsets, initial_offset) - 1
+    if i < 0:
+        return prev_sho_cho
 
-    offset = initial_offset
-    negative_offset = False
-    while True:
-        val = offset_chord.get(offset)
-        if val != None:
-            break
-        offset = offset - 0.125
-        if offset < 0.0:
-            negative_offset = True
-            break
-
-    if not negative_offset:
-        try:
-            short_chord = offset_chord[offset]
-        except KeyError:
-            print('exit: KeyError. initial_offset, offset, offset_chord', initial_offset, offset, offset_chord)
-            sys.exit()
-    else:
-        short_chord = prev_sho_cho
-
-    return short_chord
+    return offset_chord[chord_offsets[i]]
 
 def get_chord_from_pitch_to_chord_by_rank_v1(number, v):
     """
@@ -177,13 +176,16 @@ def get_chord_from_pitch_to_chord_by_rank(number, v):
     Rank behaviour:
       number = 1   → least frequent chord
       number = 100 → most frequent chord
+    :param number
+    :param v: RankedChords, or a chords dictionary e.g. {'C': 61, 'G7':25, 'Em':17, ...}
+    :return: short_chord e.g. 'G'
     """
 
-    # Sort chords by frequency DESCENDING
-    # (most frequent first)
-    sorted_v = dict(sorted(v.items(), key=operator.itemgetter(1), reverse=True))
+    # Chords by frequency DESCENDING (most frequent first), see RankedChords
+    if not isinstance(v, RankedChords):
+        v = RankedChords(v)
 
-    sorted_v_len = len(sorted_v)
+    sorted_v_len = len(v.rank_items)
 
     # --- NEW RANK LOGIC (REVERSED) ---
     # number = 1   → choose from the end         (least frequent)
@@ -201,24 +203,14 @@ def get_chord_from_pitch_to_chord_by_rank(number, v):
     if iter_num < 0: iter_num = 0
     if iter_num >= sorted_v_len: iter_num = sorted_v_len - 1
 
-    # --- FIND THE CHORD AT iter_num ---
-    # while preserving your "choose shortest chord on frequency ties" rule
-    iter_idx = 0
+    # --- THE CHORD AT iter_num ---
+    # with the "choose shortest chord on frequency ties" rule already applied in rank_choices
     ch = None
-    f = None
-
-    for ch1, f1 in sorted_v.items():
-        if iter_idx == iter_num:
-            ch = ch1
-            f = f1
-        elif iter_idx > iter_num:
-            # same frequency → choose shortest chord label
-            if f1 == f and len(ch1) < len(ch):
-                ch = ch1
-        iter_idx += 1
+    if sorted_v_len > 0:
+        ch = v.rank_choices[iter_num]
 
     print("number, sorted_v_len, iter_num, ch, sorted_v",
-          number, sorted_v_len, iter_num, ch, sorted_v)
+          number, sorted_v_len, iter_num, ch, dict(v.rank_items))
 
     return ch
 
@@ -266,17 +258,17 @@ def get_chord_from_pitch_to_chord_by_nth_outcome(number, v):
     """
     given a pitch_to_chord v and a nth_outcome number return the short chord (e.g. Am or C) for the nth_outcome number
     :param number 
-    :param v: a pitch_to_chord : e.g. {'C': 61, 'G7':25, 'Em':17, ...}
+    :param v: RankedChords, or a chords dictionary e.g. {'C': 61, 'G7':25, 'Em':17, ...}
     :return: short_chord e.g. 'G'
     """
     print('get_chord_from_pitch_to_chord_by_nth_outcome(number, v)', number, v)
 
-    # Build a stable sorted list of (chord, count) ordered by:
-    #  1) frequency desc, 2) chord name length asc (prefer simple names), 3) name lexicographic
-    items = list(v.items())
-    items.sort(key=lambda it: (-it[1], len(it[0]), it[0]))
+    # Chords ordered by:
+    #  1) frequency desc, 2) chord name length asc (prefer simple names), 3) name lexicographic, see RankedChords
+    if not isinstance(v, RankedChords):
+        v = RankedChords(v)
 
-    sorted_v_len = len(items)
+    sorted_v_len = len(v.nth_outcome_items)
     print('sorted_v_len', sorted_v_len)
 
     if sorted_v_len == 0:
@@ -294,21 +286,19 @@ def get_chord_from_pitch_to_chord_by_nth_outcome(number, v):
     else:
         iter_num = number % sorted_v_len
 
-    ch, cnt = items[iter_num]
+    ch, cnt = v.nth_outcome_items[iter_num]
     # If there are other chords with the same count, prefer one without slash/extended if available
-    same_count_candidates = [c for c in items if c[1] == cnt]
-    # prefer candidate without '/' and with shortest name
-    same_count_candidates.sort(key=lambda it: (('/' in it[0]), len(it[0]), it[0]))
-    ch_preferred = same_count_candidates[0][0]
+    # i.e. the candidate without '/' and with shortest name, see RankedChords
+    ch_preferred = v.nth_outcome_choices[iter_num]
 
-    print('iter_num, ch, ch_preferred, sorted_items', iter_num, ch, ch_preferred, dict(items))
+    print('iter_num, ch, ch_preferred, sorted_items', iter_num, ch, ch_preferred, dict(v.nth_outcome_items))
     return ch_preferred
 
 def get_chord_for_pitch_class(pitch_class, pitch_to_chord, output_filename, chord_choice, number):
     """
     given pitch_class and pitch_to_chord dictionary, return short chord (e.g. Am or C) at offset
-    :param pitch_class: e.g. 1000 0000 0000
-    :param pitch_to_chord : e.g. {'1000 0000 0000': {'C': 2, 'Am7': 1, 'Am': 1}, '0010 0000 0000': {'F': 2, 'G': 1}, '1010 0000 0001': {'G': 1}, '0000 1000 0000': {'C': 1, 'Am': 1}, '0000 1100 0000': {'F': 1}, '1000 0000 0001': {'G': 1}, '1010 1100 0000': {'C': 1}, '0010 1100 0000': {'G': 1}, '1010 1101 0000': {'C': 1}, '0000 0100 0100': {'F': 1}, '0010 1000 0000': {'G': 1}}
+    :param pitch_class: pitch class mask e.g. 0b100000000000 (1000 0000 0000)
+    :param pitch_to_chord : PitchToChord e.g. {'1000 0000 0000': {'C': 2, 'Am7': 1, 'Am': 1}, '0010 0000 0000': {'F': 2, 'G': 1}, '1010 0000 0001': {'G': 1}, '0000 1000 0000': {'C': 1, 'Am': 1}, '0000 1100 0000': {'F': 1}, '1000 0000 0001': {'G': 1}, '1010 1100 0000': {'C': 1}, '0010 1100 0000': {'G': 1}, '1010 1101 0000': {'C': 1}, '0000 0100 0100': {'F': 1}, '0010 1000 0000': {'G': 1}}
     :param output_filename (used in printed warnings)
     :param chord_choice
     :param number 
@@ -327,14 +317,13 @@ def get_chord_for_pitch_class(pitch_class, pitch_to_chord, output_filename, chor
 
     short_chord = 'C'
     # if no chord pitch_class then short_chord = 'NC
-    if pitch_class == NO_CHORD_DISPLAY_PITCH_CLASSES:
+    if pitch_class == NO_CHORD_PITCH_CLASS_MASK:
         short_chord = 'NC'
     else:
         #     using pitch_class get value from pitch_to_chord
-        try:
-            v = pitch_to_chord[pitch_class]
-        except KeyError as error:
-            print('WARNING Invalid pitch_class so get_nearest_chord_from_pitch_to_chord', pitch_class, 'in', output_filename)
+        v = pitch_to_chord.get_chords(pitch_class)
+        if v is None:
+            print('WARNING Invalid pitch_class so get_nearest_chord_from_pitch_to_chord', mask_to_pitch_class(pitch_class), 'in', output_filename)
             v = get_nearest_chord_for_pitch_class(pitch_class, pitch_to_chord, output_filename)
         if v != None:
             if chord_choice is Chord_Choice.RANK:
@@ -362,42 +351,13 @@ def get_chord_for_pitch_class(pitch_class, pitch_to_chord, output_filename, chor
                 print('infer ch is', ch)
 
             short_chord = ch    
-            try:
-                test_chord = harmony.ChordSymbol(ch)
-            except music21.Music21Exception:
+            if parse_chord_symbol(ch) is None:
                 print('WARNING Invalid chord symbol', ch)
                 short_chord = 'NC'
             # input('Press Enter to continue...')
 
     return short_chord
 
-def get_first_note(a_stream):
-    """
-    :param a_stream:
-    :return: the first note in the stream or None
-    """
-    first_note = None
-
-    for n in a_stream.flatten():
-        if type(n) == music21.note.Note:
-            if first_note == None:
-                first_note = n
-
-    return first_note
-
-def get_last_note(a_stream):
-    """
-    :param a_stream:
-    :return: the last note in the stream or None
-    """
-    last_note = None
-
-    for n in a_stream.flatten():
-        if type(n) == music21.note.Note:
-            last_note = n
-
-    return last_note
-
 def stream_has_a_note(a_stream):
     """
     return True if stream has a note
@@ -418,13 +378,7 @@ def has_chord_symbols(a_stream):
     :param a_stream:
     :return: True if stream has a chord_symbol
     """
-    stream_has_chord_symbol = False
-
-    stream_copy = copy.deepcopy(a_stream)
-
-    for n in stream_copy.flatten():
-        if type(n) == music21.harmony.ChordSymbol:
-            stream_has_chord_symbol = True
+    stream_has_chord_symbol = get_score_profile(a_stream).has_chord_symbols
 
     if stream_has_chord_symbol:
             print(a_stream, 'has chord symbols')
@@ -433,6 +387,113 @@ def has_chord_symbols(a_stream):
 
     return stream_has_chord_symbol
 
+class ScoreProfile:
+    """
+    what the checks before analysis need to know about a score, gathered in one walk through a_stream.flatten():
+    sections, first time signature, key signature and instrument, first and last notes, chord symbol presence,
+    and the duration weighted pitch class histogram for the key. The accidental count and key are worked out on first use.
+    e.g. get_score_profile(a_song).has_chord_symbols
+    """
+
+    def __init__(self, a_stream):
+        """
+        :param a_stream: score, only read
+        """
+        self.stream = a_stream
+        self.offset_section = {}  # offset to section mapping e.g. {0.0: 'intro 1'}, after the note or rest before each section name
+        self.time_signature = None  # first TimeSignature
+        self.key_signature = None  # first KeySignature, or no sharps or flats if none
+        self.instrument = None  # first Instrument
+        self.other_instruments = []  # later Instruments
+        self.first_note = None  # first Note
+        self.last_note = None  # last Note
+        self.has_chord_symbols = False  # True if there is a ChordSymbol (not NoChord)
+        # pitch class histogram of the notes (and chords), each scaled by its duration, as analyze('key') counts them
+        self.pitch_class_histogram = [0] * 12
+        self.has_pitches = False
+        self.accidental_count = None  # see get_accidental_count
+        self.key = None  # see get_key
+
+        the_offset = 0.0
+        for n in a_stream.flatten():
+            if type(n) == music21.note.Note or type(n) == music21.note.Rest:
+                the_offset = n.offset + n.duration.quarterLength
+                if type(n) == music21.note.Note:
+                    if self.first_note is None:
+                        self.first_note = n
+                    self.last_note = n
+            elif type(n) == music21.expressions.RehearsalMark:
+                if is_section(n.content):
+                    self.offset_section[the_offset] = n.content
+            elif type(n) == music21.harmony.ChordSymbol:
+                self.has_chord_symbols = True
+            elif isinstance(n, music21.meter.TimeSignature):
+                if self.time_signature is None:
+                    self.time_signature = n
+            elif isinstance(n, music21.key.KeySignature):
+                if self.key_signature is None:
+                    self.key_signature = n
+            elif isinstance(n, music21.instrument.Instrument):
+                if self.instrument is None:
+                    self.instrument = n
+                else:
+                    self.other_instruments.append(n)
+
+            if isinstance(n, music21.note.NotRest):
+                length = n.quarterLength
+                for p in n.pitches:
+                    self.pitch_class_histogram[p.pitchClass] += length
+                    self.has_pitches = True
+
+        if self.key_signature is None:
+            self.key_signature = key.KeySignature(0)
+
+    def get_accidental_count(self):
+        """
+        :return: number of accidentals in the score, see get_accidental_count
+        """
+        if self.accidental_count is None:
+            self.accidental_count = get_accidental_count(self.stream)
+        return self.accidental_count
+
+    def get_key(self):
+        """
+        :return: key of the score as a_stream.analyze('key') would find it, from the pitch class histogram,
+                 analyzed by music21 only if too close to call
+        """
+        if self.key is None:
+            key_name = None
+            if self.has_pitches:
+                key_name = get_key_finder('key').get_key_names(numpy.array([self.pitch_class_histogram], dtype=float))[0]
+            if key_name is None:
+                self.key = self.stream.analyze('key')
+            else:
+                tonic, mode = key_name.split(' ')
+                self.key = key.Key(tonic, mode)
+        return self.key
+
+    def get_first_last_note_names(self):
+        """
+        :return: (first_note, last_note) as strings like 'C4', 'G4', or None, None if no notes
+        """
+        if self.first_note is None:
+            return None, None
+        return self.first_note.nameWithOctave, self.last_note.nameWithOctave
+
+
+score_profiles = {}  # (stream, ScoreProfile) by id(stream), see get_score_profile
+
+
+def get_score_profile(a_stream):
+    """
+    :param a_stream: score, not changed after this is called
+    :return: ScoreProfile of a_stream, built on first use
+    """
+    if id(a_stream) not in score_profiles or score_profiles[id(a_stream)][0] is not a_stream:
+        score_profiles[id(a_stream)] = (a_stream, ScoreProfile(a_stream))
+    return score_profiles[id(a_stream)][1]
+
+
 class SongSectionValues:
     """
     A class that stores SongSectionValues
@@ -460,6 +521,7 @@ class SongSectionValues:
     # offset_section = {}  # dictionary to hold offset to section mapping e.g. {0.0: 'intro 1'}
     offsets = None
     OUTPUT_PATH = 'output' + os.sep
+    output_files = [] # list of the files written by the writers e.g. ['output/music-BAR1.musicxml']
 
     section_letter = {} # dictionary to hold section to letter mapping e.g. {'verse': 'A', 'chorus': 'B'}
 
@@ -471,13 +533,13 @@ class SongSectionValues:
 
     song_key = None
 
-    # offset_chord Dictionaries
-    song_offset_chord_1_beat = '{'
-    song_offset_chord_2_beat = '{'
-    song_offset_chord_1_bar = '{'
-    song_offset_chord_2_bar = '{'
-    song_offset_chord_4_bar = '{'
-    song_offset_placeholder_chords = '{'
+    # offset_chord Dictionaries e.g. {0.0: 'C', 4.0: 'Am'} (song_offset_placeholder_chords e.g. {0.0: '1000 1001 0000'})
+    song_offset_chord_1_beat = {}
+    song_offset_chord_2_beat = {}
+    song_offset_chord_1_bar = {}
+    song_offset_chord_2_bar = {}
+    song_offset_chord_4_bar = {}
+    song_offset_placeholder_chords = {}
 
     songTimeSig = None
 
@@ -501,18 +563,18 @@ class SongSectionValues:
         """
         print('write_placeholder_chords_infer(self, output_filename, creativity)', output_filename, creativity)
 
-        score = stream.Score()
-        p0 = stream.Part()
-        p0.insert(0, self.the_instrument)
+        elements = []  # melody and chord symbols in order, see write_elements
 
         prev_sho_cho = 'NC'
 
-        # Get the first offset and pitch class
-        next_chord_offset, next_pitch_class = next(iter(SongSectionValues.song_offset_placeholder_chords.items()))
+        # Get the first offset and pitch class, then step through the placeholder chords one at a time
+        chord_offsets, chord_pitch_classes = self.get_placeholder_chords()
+        chord_index = 0
+        next_chord_offset, next_pitch_class = chord_offsets[chord_index], chord_pitch_classes[chord_index]
         print('next_chord_offset', next_chord_offset)
-        print('next_pitch_class', next_pitch_class)
+        print('next_pitch_class', mask_to_pitch_class(next_pitch_class))
 
-        last_chord_offset = list(SongSectionValues.song_offset_placeholder_chords)[-1]
+        last_chord_offset = chord_offsets[-1]
         print('last_chord_offset', last_chord_offset)
 
         # Iterate through the song stream
@@ -524,7 +586,7 @@ class SongSectionValues:
                 elif issubclass(n.__class__, music21.expressions.RehearsalMark) and len(SongSectionValues.offset_section) == 1:
                     pass
                 else:
-                    p0.append(n)
+                    elements.append(n)
             else:
                 # Only process if next_chord_offset is not None
                 if next_chord_offset is not None and n.offset >= next_chord_offset:
@@ -536,50 +598,41 @@ class SongSectionValues:
                         sho_cho = 'NC'
                     
                     # Append the chord
-                    if sho_cho == 'NC':
-                        p0.append(NoChord())
-                    else:
-                        try:
-                            p0.append(ChordSymbol(sho_cho))
-                        except:
-                            p0.append(NoChord())
+                    try:
+                        elements.append(get_chord_symbol(sho_cho))
+                    except:
+                        elements.append(NoChord())
                     
                     prev_sho_cho = sho_cho
 
                     # Update next_chord_offset and next_pitch_class if not at the last chord offset
-                    if next_chord_offset != last_chord_offset:
-                        temp = iter(SongSectionValues.song_offset_placeholder_chords)
-                        for k in temp:
-                            if k == next_chord_offset:
-                                next_chord_offset = next(temp, None)
-                                break
-                        if next_chord_offset is not None:
-                            next_pitch_class = SongSectionValues.song_offset_placeholder_chords[next_chord_offset]
-                            print('the next_chord_offset', next_chord_offset)
-                            print('the next_pitch_class', next_pitch_class)
+                    if chord_index < len(chord_offsets) - 1:
+                        chord_index += 1
+                        next_chord_offset, next_pitch_class = chord_offsets[chord_index], chord_pitch_classes[chord_index]
+                        print('the next_chord_offset', next_chord_offset)
+                        print('the next_pitch_class', mask_to_pitch_class(next_pitch_class))
                     else:
                         # If at the last chord offset, set next_chord_offset to None
                         next_chord_offset = None
 
                 # Append the note/rest
-                p0.append(n)
+                elements.append(n)
 
         # Write the output stream
-        score.insert(0, metadata.Metadata())
         filename = Path(output_filename)
-        score.metadata.title = filename.with_suffix('')
-        score.metadata.composer = 'VeeHarmGen ' + __version__ + '\n' + output_filename + '\n'
-
-        score.insert(0, p0)
-
-        first_note, last_note = get_first_last_note_names(score)
-        #output_filename = update_filename_with_range(output_filename, first_note, last_note)
-
-        score.write(OUTPUT_FORMAT, fp=self.OUTPUT_PATH + output_filename)
+        self.write_elements(elements, str(filename.with_suffix('')), output_filename)
 
         print('output =', self.OUTPUT_PATH + output_filename)
         return None
 
+    def get_placeholder_chords(self):
+        """
+        :return: the placeholder chords as parallel lists of offsets and pitch class masks, in song order,
+                 so the writers can step through them by index e.g. [0.0, 4.0], [0b100010010000, 0b001000100100]
+        """
+        return list(SongSectionValues.song_offset_placeholder_chords.keys()), \
+               list(SongSectionValues.song_offset_placeholder_chords.values())
+
     def get_first_note(self):
         """
         :return: last first in stream1
@@ -600,13 +653,54 @@ class SongSectionValues:
         :param end_note_offset: song offsets < this included in stream
         :return: stream
         """
-        sub_stream = stream.Stream()
-        for n in self.stream1.flatten():
-            if type(n) == music21.note.Note or type(n) == music21.note.Rest:
-                if (n.offset >= start_note_offset) and (n.offset < end_note_offset):
-                    sub_stream.append(n)
+        return self.get_note_index().get_stream(start_note_offset, end_note_offset)
+
+    def get_note_index(self):
+        """
+        :return: NoteIndex of stream1 (from its events), rebuilt only when notes or rests have been added since it was built
+        """
+        if self.note_index is None or self.note_index.length != len(self.events):
+            self.note_index = NoteIndex(self.events)
+        return self.note_index
 
-        return sub_stream
+    def get_window_chords(self, window_starts, offset_increments):
+        """
+        analyse the short chord of each window of stream1 (as shorter_stream.analyze(self.analyze_choice) would)
+        for every harmonic rhythm at once: one pitch class histogram per window, all from one cumulative histogram of stream1,
+        and one key profile correlation for all the windows
+        :param window_starts: start offsets of the windows of each harmonic rhythm e.g. {Harmonic_Rhythm.BAR1: numpy.arange(0.0, 16.0, 4.0)}
+        :param offset_increments: window length of each harmonic rhythm e.g. {Harmonic_Rhythm.BAR1: 4.0}
+        :return: short chords of the windows of each harmonic rhythm e.g. {Harmonic_Rhythm.BAR1: ['C ', 'Am ', None, 'G ']},
+                 None where the window has no note
+        """
+        all_window_starts = []
+        all_window_ends = []
+        for harmonic_rhythm in window_starts:
+            for start_note_offset in window_starts[harmonic_rhythm]:
+                all_window_starts.append(start_note_offset)
+                all_window_ends.append(start_note_offset + offset_increments[harmonic_rhythm])
+        histograms, has_note = self.get_note_index().get_pitch_class_histograms(all_window_starts, all_window_ends)
+        key_names = iter(get_key_finder(self.analyze_choice).get_key_names(histograms[has_note]))
+
+        all_window_chords = []
+        for i in range(len(all_window_starts)):
+            if has_note[i]:
+                key_name = next(key_names)
+                if key_name is None:
+                    # too close to call from the histogram, let music21 decide
+                    shorter_stream = self.get_stream(all_window_starts[i], all_window_ends[i])
+                    key_name = shorter_stream.analyze(self.analyze_choice).name
+                all_window_chords.append(short_chord(key_name))
+            else:
+                all_window_chords.append(None)
+
+        window_chords = {}
+        i = 0
+        for harmonic_rhythm in window_starts:
+            window_chords[harmonic_rhythm] = all_window_chords[i:i + len(window_starts[harmonic_rhythm])]
+            i = i + len(window_starts[harmonic_rhythm])
+
+        return window_chords
 
     def increment_sections(self):
         SongSectionValues.number_of_song_sections += 1
@@ -625,7 +719,7 @@ class SongSectionValues:
 
         # set instance variable unique to each instance
         self.dur_prev = 0
-        self.note_prev = None
+        self.note_prev = None  # MelodyEvent of the previous note
 
         self.DURATION_SET = []
         self.DUR_PREV_DIFF = 0
@@ -637,12 +731,29 @@ class SongSectionValues:
 
         # self.stream_raw = stream.Stream()   # original stream NR see .song_stream
         self.stream1 = stream.Stream()      # only notes and rests not chord symbols
+        self.events = []                    # MelodyEvent of each note and rest in stream1, what the analysis reads
+        self.note_index = None              # NoteIndex of events, see get_note_index
+        self.name = None                    # section name, see set_section
         self.TONES_ON_KEY = True
         self.TONE_PREV_INTERVAL = 0
         self.TONE_RANGE_BOTTOM = 'B9'
         self.TONE_RANGE_TOP = 'C0'
         self.TONE_SCALE_SET = []
 
+        # what update() compares each note with, worked out once rather than per note
+        self.duration_fractions = set()  # Fraction of each DURATION_SET entry
+        self.tone_scale_ps = set()  # pitch space in octave 4 of each TONE_SCALE_SET entry
+        self.tone_range_bottom_ps = pitch.Pitch(self.TONE_RANGE_BOTTOM).ps
+        self.tone_range_top_ps = pitch.Pitch(self.TONE_RANGE_TOP).ps
+        # pitch names of the major or minor scale of song_key e.g. {'C', 'D', 'E', 'F', 'G', 'A', 'B'}
+        self.scale_pitch_names = set()
+        if song_key is not None:
+            if song_key.mode == 'major':
+                sc = scale.MajorScale(song_key.tonic.name)
+            else:
+                sc = scale.MinorScale(song_key.tonic.name)
+            self.scale_pitch_names = {p.name for p in sc.pitches}
+
         # when looping over several analysis classes need to initialise more variables
 
         SongSectionValues.current_song_length_offset = 0.0
@@ -664,12 +775,12 @@ class SongSectionValues:
         SongSectionValues.song_chords_4_bar = ''
 
         # offset_chord Dictionaries
-        SongSectionValues.song_offset_chord_1_beat = '{'
-        SongSectionValues.song_offset_chord_2_beat = '{'
-        SongSectionValues.song_offset_chord_1_bar = '{'
-        SongSectionValues.song_offset_chord_2_bar = '{'
-        SongSectionValues.song_offset_chord_4_bar = '{'
-        SongSectionValues.song_offset_placeholder_chords = '{'
+        SongSectionValues.song_offset_chord_1_beat = {}
+        SongSectionValues.song_offset_chord_2_beat = {}
+        SongSectionValues.song_offset_chord_1_bar = {}
+        SongSectionValues.song_offset_chord_2_bar = {}
+        SongSectionValues.song_offset_chord_4_bar = {}
+        SongSectionValues.song_offset_placeholder_chords = {}
 
         # SongSectionValues.songTimeSig = None
 
@@ -681,7 +792,8 @@ class SongSectionValues:
         SongSectionValues.the_instrument = music21.instrument.Instrument(instrumentName='Piano')
         # SongSectionValues.TIME_SIG_WANTED = '3/4'
 
-        SongSectionValues.offset_section = get_offset_section(song_stream)
+        SongSectionValues.offset_section = dict(get_score_profile(song_stream).offset_section)
+        print('offset_section', SongSectionValues.offset_section)
 
         print('# -----------------------------------------------------------------------')
 
@@ -745,9 +857,8 @@ class SongSectionValues:
         # song.show('text')
 
         offset_end = 0.0
-        stream_copy = copy.deepcopy(a_stream)
 
-        for n in stream_copy.flatten():
+        for n in a_stream.flatten():
             # print('type(n) ', type(n) )
             if type(n) == music21.clef.TrebleClef:
                 print('music21.clef.TrebleClef')
@@ -841,6 +952,7 @@ class SongSectionValues:
         """
         # append note
         self.stream1.append(n)
+        self.events.append(MelodyEvent.from_note(n, self.name))
 
     def update(self, n, first_note_of_section):
         """
@@ -868,11 +980,15 @@ class SongSectionValues:
             first_note_of_section = False
             # append note
             self.stream1.append(n)
+            event = MelodyEvent.from_note(n, self.name)
+            self.events.append(event)
 
         else: # notes other than first note
 
             # append note
             self.stream1.append(n)
+            event = MelodyEvent.from_note(n, self.name)
+            self.events.append(event)
 
             # update DUR_PREV_DIFF, TONE_PREV_INTERVAL
 
@@ -883,79 +999,64 @@ class SongSectionValues:
             # if this_dur_Prev_diff is bigger, update DUR_PREV_DIFF
             bigger = False
             if self.dur_prev != 0:  # do not work out for first note
-                if self.dur_prev < n.duration.quarterLength:  # previous note is shorter e.g. dur_prev = 1.0 <  n = 2.0
-                    this_dur_Prev_diff = (float(n.duration.quarterLength)) / (float(Fraction(self.dur_prev)))
+                if self.dur_prev < event.duration:  # previous note is shorter e.g. dur_prev = 1.0 <  n = 2.0
+                    this_dur_Prev_diff = (float(event.duration)) / (float(Fraction(self.dur_prev)))
                     # this_dur_Prev_diff =  e.g. (n = 2.0) / dur_prev = 1.0
                     if this_dur_Prev_diff > self.DUR_PREV_DIFF: bigger = True
-                if self.dur_prev > n.duration.quarterLength:  # previous note is longer e.g. dur_prev = 4.0 <  n = 2.0
+                if self.dur_prev > event.duration:  # previous note is longer e.g. dur_prev = 4.0 <  n = 2.0
                     this_dur_Prev_diff = (float(Fraction(self.dur_prev)) / float(
-                        n.duration.quarterLength))  # this_dur_Prev_diff =  e.g. (n = 2.0) * dur_prev = 4.0
+                        event.duration))  # this_dur_Prev_diff =  e.g. (n = 2.0) * dur_prev = 4.0
                     if this_dur_Prev_diff > self.DUR_PREV_DIFF: bigger = True
             if bigger: self.DUR_PREV_DIFF = this_dur_Prev_diff
 
             # update TONE_PREV_INTERVAL: calc semitone_interval_with_prev_note for
-            aInterval = interval.Interval(self.note_prev, n)
-            AIntSemi = abs(aInterval.semitones)
+            # (as abs(interval.Interval(note_prev, n).semitones), an int when whole)
+            AIntSemi = abs(event.ps - self.note_prev.ps)
+            if AIntSemi == int(AIntSemi): AIntSemi = int(AIntSemi)
             if AIntSemi > self.TONE_PREV_INTERVAL: self.TONE_PREV_INTERVAL = AIntSemi
 
         # any note update:
         # DURATION_SET, DUR_RATIONAL, DUR_TUPLET, DUR_LEAST, DUR_LONGEST, TONES_ON_KEY, TONE_RANGE_BOTTOM, TONE_RANGE_TOP
         # dur_prev
-        duration_found = False
-        for dur_from_set in self.DURATION_SET:
-            if Fraction(n.duration.quarterLength) == Fraction(dur_from_set):
-                duration_found = True
-        if not duration_found:
-            bisect.insort(self.DURATION_SET, str(n.duration.quarterLength))
+        # DURATION_SET holds each duration once (compared as a Fraction), see duration_fractions
+        if Fraction(event.duration) not in self.duration_fractions:
+            bisect.insort(self.DURATION_SET, str(event.duration))
+            self.duration_fractions.add(Fraction(str(event.duration)))
 
         # if triplet: DUR_TUPLET = True
-        if ((n.duration.quarterLength == c1_6) or (n.duration.quarterLength == c1_3) or (n.duration.quarterLength == c2_3)):
+        if ((event.duration == c1_6) or (event.duration == c1_3) or (event.duration == c2_3)):
             self.DUR_TUPLET = True
             self.DUR_RATIONAL = False
         # if note.dur < DUR_LEAST: DUR_LEAST = note.dur
-        if n.duration.quarterLength < self.DUR_LEAST: self.DUR_LEAST = n.duration.quarterLength
+        if event.duration < self.DUR_LEAST: self.DUR_LEAST = event.duration
         # if note.dur > DUR_LONGEST: DUR_LONGEST = note.dur
-        if n.duration.quarterLength > self.DUR_LONGEST: self.DUR_LONGEST = n.duration.quarterLength
+        if event.duration > self.DUR_LONGEST: self.DUR_LONGEST = event.duration
 
-        # if note not scale note: TONES_ON_KEY = True
-        if self.song_key.mode == 'major':
-            sc = scale.MajorScale(self.song_key.tonic.name)
-        else:
-            sc = scale.MinorScale(self.song_key.tonic.name)
-        scale_degree = sc.getScaleDegreeFromPitch(n)
-        if scale_degree == None:
+        # if note not scale note: TONES_ON_KEY = False
+        # (as sc.getScaleDegreeFromPitch(n) == None for the major or minor scale of song_key, see scale_pitch_names)
+        if n.name not in self.scale_pitch_names:
             self.TONES_ON_KEY = False
 
         # if note.nameWithOctave < TONE_RANGE_BOTTOM: TONE_RANGE_BOTTOM = note.nameWithOctave
-        # if n.nameWithOctave < self.TONE_RANGE_BOTTOM: self.TONE_RANGE_BOTTOM = n.nameWithOctave
         # if note.nameWithOctave > TONE_RANGE_TOP: TONE_RANGE_TOP = note.nameWithOctave
-        # Following gave False with next line: A5 > G5, B5 > G5, C6 > G5 (assume bug with music21)
-        # if n.nameWithOctave > note.Note(max_note.nameWithOctave):
-        #     self.TONE_RANGE_TOP = n.nameWithOctave
-
-        new_note = note.Note()
-        new_note.nameWithOctave = n.nameWithOctave
-        min_note = note.Note()
-        min_note.nameWithOctave = self.TONE_RANGE_BOTTOM
-        max_note = note.Note()
-        max_note.nameWithOctave = self.TONE_RANGE_TOP
-
-        if note.Note(n.nameWithOctave) < note.Note(min_note.nameWithOctave):
+        # compared by pitch space (as note.Note(n.nameWithOctave) < note.Note(self.TONE_RANGE_BOTTOM) compares them)
+        if event.ps < self.tone_range_bottom_ps:
             self.TONE_RANGE_BOTTOM = n.nameWithOctave
+            self.tone_range_bottom_ps = event.ps
 
-        if note.Note(n.nameWithOctave) > note.Note(max_note.nameWithOctave):
+        if event.ps > self.tone_range_top_ps:
             self.TONE_RANGE_TOP = n.nameWithOctave
+            self.tone_range_top_ps = event.ps
 
-        # TONE_SCALE_SET
-        tone_found = False
-        for tone_from_set in self.TONE_SCALE_SET:
-            if pitch.Pitch(n.name).ps == pitch.Pitch(tone_from_set).ps:
-                tone_found = True
-        if not tone_found:
+        # TONE_SCALE_SET holds each note name once, compared by the pitch space of the name in octave 4
+        # (as pitch.Pitch(n.name).ps), so enharmonics e.g. C# and D- are one tone
+        tone_ps = event.ps - 12 * (n.pitch.implicitOctave - 4)
+        if tone_ps not in self.tone_scale_ps:
             bisect.insort(self.TONE_SCALE_SET, str(n.name))
+            self.tone_scale_ps.add(tone_ps)
 
-        self.dur_prev = n.duration.quarterLength  # update self.dur_prev
-        self.note_prev = n
+        self.dur_prev = event.duration  # update self.dur_prev
+        self.note_prev = event
 
     def print_placeholder_chords(self):
         """
@@ -963,10 +1064,11 @@ class SongSectionValues:
 
         get first and last note
         for each chord symbol stream item
-            get_pitch_classes_in_stream of the chord
-            append the offset and pitch_classes to the song_offset_placeholder_chords
+            get the pitch class mask of the notes of the chord
+            append the offset and pitch class mask to the song_offset_placeholder_chords
 
-        e.g. song_offset_placeholder_chords  =  {0.0: '1000 0000 0000', 12.0: '0000 1100 0000', 24.0: '1000 0000 0001', 36.0: '1000 0000 0000'}
+        e.g. song_offset_placeholder_chords  =  {0.0: 0b100000000000, 12.0: 0b000011000000, 24.0: 0b100000000001, 36.0: 0b100000000000}
+        printed as {0.0: '1000 0000 0000', 12.0: '0000 1100 0000', 24.0: '1000 0000 0001', 36.0: '1000 0000 0000'}
 
         :return: void
         """
@@ -974,13 +1076,13 @@ class SongSectionValues:
         print('print_placeholder_chords(self)')
 
         # print('song_key.name', song_key.name)
-        first_note = self.get_first_note()
+        first_note = self.events[0]
         first_note_offset = first_note.offset
 
         print('first note offset', first_note.offset)
-        last_note = self.get_last_note()
+        last_note = self.events[-1]
         last_note_offset = last_note.offset
-        last_note_duration_quarterLength = last_note.duration.quarterLength
+        last_note_duration_quarterLength = last_note.duration
         end_of_last_note_offset = last_note_offset + last_note_duration_quarterLength
         current_section_start_note_offset = SongSectionValues.current_song_length_offset
 
@@ -994,7 +1096,6 @@ class SongSectionValues:
         start_note_offset = 0.0
         last_note_duration = 0.0
         tune_sig_to_chord = {}
-        first_chord = True
         #
 
         print('has_chord_symbols(self.song_stream)', has_chord_symbols(self.song_stream))
@@ -1041,37 +1142,20 @@ class SongSectionValues:
                 if next_note_is_chord_offset:
                     next_note_is_chord_offset = False
                     end_note_offset = n.offset
-                    shorter_stream = self.get_stream(start_note_offset, end_note_offset)
+                    key = self.get_note_index().get_pitch_class_mask(start_note_offset, end_note_offset)
 
-                    if stream_has_a_note(shorter_stream) :
+                    if key != NO_CHORD_PITCH_CLASS_MASK: # has a note
                         # print('ANALYZE_CHOICE =', analyze_choice)
                         if map_chord != 'N.C.' and map_chord != 'NC':
                             # different_pitch_classes = get_different_pitch_classes_in_stream(shorter_stream)
 
-                            key_chord = get_pitch_classes_in_stream(shorter_stream)
-                            key = (display_pitch_classes(key_chord))
+                            print('pitch_classes_display', mask_to_pitch_class(key))
 
-                            # convert key_chord to sho_cho
-                            if first_chord:
-                                SongSectionValues.song_offset_placeholder_chords = SongSectionValues.song_offset_placeholder_chords + str(
-                                    start_note_offset) + ": '" + key + "'"
-                                first_chord = False
-                            else:  # subsequent chords
-                                SongSectionValues.song_offset_placeholder_chords = SongSectionValues.song_offset_placeholder_chords + ", " + str(
-                                    start_note_offset) + ": '" + key + "'"
+                            SongSectionValues.song_offset_placeholder_chords[start_note_offset] = key
 
                         else: # no chord
-                            # append offset and no chord to song_offset_placeholder_chords
-                            if first_chord:
-                                SongSectionValues.song_offset_placeholder_chords = SongSectionValues.song_offset_placeholder_chords + str(
-                                    start_note_offset) + ": '" + NO_CHORD_DISPLAY_PITCH_CLASSES + "'"
-                                    # start_note_offset) + ": '" + str(NO_CHORD_DISPLAY_PITCH_CLASSES).replace(" ", "") + "'"
-
-                                first_chord = False
-                            else:  # subsequent chords
-                                SongSectionValues.song_offset_placeholder_chords = SongSectionValues.song_offset_placeholder_chords + ", " + str(
-                                    start_note_offset) + ": '" + NO_CHORD_DISPLAY_PITCH_CLASSES + "'"
-                                    # start_note_offset) + ": '" + str(NO_CHORD_DISPLAY_PITCH_CLASSES).replace(" ", "") + "'"
+                            # add offset and no chord to song_offset_placeholder_chords
+                            SongSectionValues.song_offset_placeholder_chords[start_note_offset] = NO_CHORD_PITCH_CLASS_MASK
 
                         map_chord = chord_2
                         start_note_offset = end_note_offset
@@ -1082,32 +1166,29 @@ class SongSectionValues:
 
         if map_chord != 'N.C.' and map_chord != 'NC':
             end_note_offset = start_note_offset + last_note_duration
-            shorter_stream = self.get_stream(start_note_offset, end_note_offset)
-            if stream_has_a_note(shorter_stream) :
+            key = self.get_note_index().get_pitch_class_mask(start_note_offset, end_note_offset)
+            if key != NO_CHORD_PITCH_CLASS_MASK: # has a note
                 # key_chord = shorter_stream.analyze(self.analyze_choice)
-                key_chord = get_pitch_classes_in_stream(shorter_stream)
-                key = (display_pitch_classes(key_chord))
+                print('pitch_classes_display', mask_to_pitch_class(key))
 
                 # convert key_chord to sho_cho
                 # sho_cho = short_chord(key_chord.name)
-                SongSectionValues.song_offset_placeholder_chords = SongSectionValues.song_offset_placeholder_chords + ", " + str(
-                    start_note_offset) + ": '" + key + "'"
+                SongSectionValues.song_offset_placeholder_chords[start_note_offset] = key
 
         else:  # no chord
-            SongSectionValues.song_offset_placeholder_chords = SongSectionValues.song_offset_placeholder_chords + ", " + str(
-                start_note_offset) + ": '" + NO_CHORD_DISPLAY_PITCH_CLASSES + "'"
+            SongSectionValues.song_offset_placeholder_chords[start_note_offset] = NO_CHORD_PITCH_CLASS_MASK
 
         # print('tune_sig_to_chord with frequency=', tune_sig_to_chord)
-        print('SongSectionValues.song_offset_placeholder_chords', SongSectionValues.song_offset_placeholder_chords)
+        print('SongSectionValues.song_offset_placeholder_chords', {offset: mask_to_pitch_class(mask) for offset, mask in SongSectionValues.song_offset_placeholder_chords.items()})
         # input('Press Enter to continue...')
 
     def print(self):
         """
         get first and last note
         calc harmonic rhythm, offset_increment
+        analyse the short chord of every offset_increment of every harmonic rhythm in one pass (get_window_chords)
         for each harmonic rhythm
             for each offset_increment
-                analyse the short chord from the song key of the short stream
                 append the offset and short chord to the song_offset_chord
 
         :return: void
@@ -1119,16 +1200,23 @@ class SongSectionValues:
 
         # song_key = self.stream1.analyze('key')
         # print('ANALYZE_CHOICE =', analyze_choice)
-        song_key = self.stream1.analyze(self.analyze_choice)
+        # key from the pitch class histogram of the events of stream1, as self.stream1.analyze(self.analyze_choice) would find it
+        note_index = self.get_note_index()
+        section_key_name = None
+        if note_index.cumulative_note_counts[-1] > 0:
+            section_key_name = get_key_finder(self.analyze_choice).get_key_names(note_index.cumulative_histograms[-1:])[0]
+        if section_key_name is None:
+            # too close to call from the histogram, let music21 decide
+            section_key_name = self.stream1.analyze(self.analyze_choice).name
 
         # print('song_key.name', song_key.name)
-        first_note = self.get_first_note()
+        first_note = self.events[0]
         first_note_offset = first_note.offset
 
         # print('first note offset', first_note.offset)
-        last_note = self.get_last_note()
+        last_note = self.events[-1]
         last_note_offset = last_note.offset
-        last_note_duration_quarterLength = last_note.duration.quarterLength
+        last_note_duration_quarterLength = last_note.duration
         current_section_start_note_offset = SongSectionValues.current_song_length_offset
 
         # print('last_note_offset', last_note_offset,'last_note_duration_quarterLength',last_note_duration_quarterLength)
@@ -1140,18 +1228,19 @@ class SongSectionValues:
         # print('Possible Harmonic rhythms ------------------------------------------------------------------------------')
         # print('song_key.name', song_key.name)
         # print('Possible Harmonic rhythms.  Chord changes every: -------------------------------------------------------')
-        print('# section key', song_key.name)
+        print('# section key', section_key_name)
         print('Harmonic rhythms. Chord may change every: 1 beat, 2 beats, 1 bar, 2 bars or 4 bars.')
 
 
+        # the window length (offset_increment) each harmonic rhythm is analysed over
+        offset_increments = {}
+        section_length = last_note_offset + last_note_duration_quarterLength - current_section_start_note_offset
+
         # chord each beat
         print('1 beat ...')
-        chord_each_beat = ''
         chord_count_init = 1.0
         chord_count = 1.0
         chord_count_inc = 1.0
-        first_chord = True
-        sho_cho = 'NC '
         offset_increment = beat_count / SongSectionValues.songTimeSig.numerator
         if SongSectionValues.songTimeSig.ratioString == '6/8':
             print('Time Signature', SongSectionValues.songTimeSig)
@@ -1175,25 +1264,66 @@ class SongSectionValues:
         if SongSectionValues.offsets != None:
             offset_increment = SongSectionValues.offsets[Harmonic_Rhythm.BEAT1.value]
         print('1 beat: offset_increment', offset_increment)
+        offset_increments[Harmonic_Rhythm.BEAT1] = offset_increment
+
+        # chords_half_a_bar for even beats (different for odd beats in a bar)
+        print('2 beats ...')
+        offset_increment = beat_count / 2
+        # for 9/8 offset_increment = 1.5
+        if SongSectionValues.songTimeSig.ratioString == '9/4' or SongSectionValues.songTimeSig.ratioString == '9/8':
+            print('Time Signature', SongSectionValues.songTimeSig)
+            offset_increment = beat_count / 3
+        if SongSectionValues.offsets != None:
+            offset_increment = SongSectionValues.offsets[Harmonic_Rhythm.BEAT2.value]
+        print('2_beat offset_increment', offset_increment)
+        offset_increments[Harmonic_Rhythm.BEAT2] = offset_increment
+
+        # chords_1_per_bar
+        print('1 bar ...')
+        offset_increment = beat_count
+        if SongSectionValues.offsets != None:
+            offset_increment = SongSectionValues.offsets[Harmonic_Rhythm.BAR1.value]
+        print('offset_increment', offset_increment)
+        offset_increments[Harmonic_Rhythm.BAR1] = offset_increment
+
+        # chord every 2 measures (if there are < 2 measures use 1 bar)
+        print('2 bars ...')
+        if section_length >= (beat_count * 2):
+            offset_increment = beat_count * 2
+            if SongSectionValues.offsets != None:
+                offset_increment = SongSectionValues.offsets[Harmonic_Rhythm.BAR2.value]
+            print('offset_increment', offset_increment)
+            offset_increments[Harmonic_Rhythm.BAR2] = offset_increment
+
+        # chord every 4 measures (if there are < 4 measures use 1 or 2 bars)
+        print('4 bars ...')
+        if section_length >= (beat_count * 4):
+            offset_increment = beat_count * 4
+            if SongSectionValues.offsets != None:
+                offset_increment = SongSectionValues.offsets[Harmonic_Rhythm.BAR4.value]
+            print('offset_increment', offset_increment)
+            offset_increments[Harmonic_Rhythm.BAR4] = offset_increment
 
-        for start_note_offset in numpy.arange(current_section_start_note_offset, (last_note_offset + last_note_duration_quarterLength), offset_increment):
+        # analyse the windows of every harmonic rhythm in one pass
+        window_starts = {}
+        for harmonic_rhythm, offset_increment in offset_increments.items():
+            window_starts[harmonic_rhythm] = numpy.arange(current_section_start_note_offset, (last_note_offset + last_note_duration_quarterLength),
+                                                          offset_increment)
+        window_chords = self.get_window_chords(window_starts, offset_increments)
+
+        # chord each beat
+        chord_each_beat = ''
+        sho_cho = 'NC '
+        for start_note_offset, window_chord in zip(window_starts[Harmonic_Rhythm.BEAT1], window_chords[Harmonic_Rhythm.BEAT1]):
             # print('start_note_offset', start_note_offset, 'end_note_offset', (start_note_offset + offset_increment))
-            shorter_stream = self.get_stream(start_note_offset, (start_note_offset + offset_increment) )
-            # self.show_text_in_stream(shorter_stream)
-            if stream_has_a_note(shorter_stream):
-                # print('ANALYZE_CHOICE =', analyze_choice)
-                song_key = shorter_stream.analyze(self.analyze_choice)
-                song_key_name = short_chord(song_key.name)
-                sho_cho = short_chord(song_key.name)
+            if window_chord is not None:
+                song_key_name = window_chord
+                sho_cho = window_chord
             else:
                 song_key_name = sho_cho
             # print('Chord = ', song_key.name)
             chord_each_beat = chord_each_beat + song_key_name
-            if first_chord:
-                SongSectionValues.song_offset_chord_1_beat = SongSectionValues.song_offset_chord_1_beat + str(start_note_offset) + ": '" + str(sho_cho).replace(" ", "") + "'"
-                first_chord = False
-            else:
-                SongSectionValues.song_offset_chord_1_beat = SongSectionValues.song_offset_chord_1_beat + ", " + str(start_note_offset) + ": '" + str(sho_cho).replace(" ", "") + "'"
+            SongSectionValues.song_offset_chord_1_beat[get_offset_key(start_note_offset)] = str(sho_cho).replace(" ", "")
 
             if chord_count == beat_count:
                 chord_each_beat = chord_each_beat + '|'
@@ -1204,33 +1334,16 @@ class SongSectionValues:
         SongSectionValues.song_chords_1_beat = SongSectionValues.song_chords_1_beat + chord_each_beat
         # print('1 beat  |' + chord_each_beat)
 
-        SongSectionValues.song_offset_chord_1_beat = SongSectionValues.song_offset_chord_1_beat + ','
-
         # chords_half_a_bar for even beats (different for odd beats in a bar)
-        print('2 beats ...')
-        offset_increment = beat_count / 2
-        # for 9/8 offset_increment = 1.5
-        if SongSectionValues.songTimeSig.ratioString == '9/4' or SongSectionValues.songTimeSig.ratioString == '9/8':
-            print('Time Signature', SongSectionValues.songTimeSig)
-            offset_increment = beat_count / 3
-        if SongSectionValues.offsets != None:
-            offset_increment = SongSectionValues.offsets[Harmonic_Rhythm.BEAT2.value]
-        print('2_beat offset_increment', offset_increment)
         chords_half_a_bar = ''
-        first_chord = True
         second_chord = False
         sho_cho = 'NC '
 
-        for start_note_offset in numpy.arange(current_section_start_note_offset, (last_note_offset + last_note_duration_quarterLength),
-                                                  offset_increment):
+        for start_note_offset, window_chord in zip(window_starts[Harmonic_Rhythm.BEAT2], window_chords[Harmonic_Rhythm.BEAT2]):
             # print('start_note_offset', start_note_offset, 'end_note_offset', (start_note_offset + offset_increment))
-            shorter_stream = self.get_stream(start_note_offset, (start_note_offset + offset_increment) )
-            # self.show_text_in_stream(shorter_stream)
-            if stream_has_a_note(shorter_stream):
-                # print('ANALYZE_CHOICE =', analyze_choice)
-                song_key = shorter_stream.analyze(self.analyze_choice)
-                song_key_name = short_chord(song_key.name)
-                sho_cho = short_chord(song_key.name)
+            if window_chord is not None:
+                song_key_name = window_chord
+                sho_cho = window_chord
             else:
                 song_key_name = sho_cho
             # print('Chord = ', song_key.name)
@@ -1257,68 +1370,41 @@ class SongSectionValues:
             else:
                 second_chord = True
 
-            if first_chord:
-                SongSectionValues.song_offset_chord_2_beat = SongSectionValues.song_offset_chord_2_beat + str(start_note_offset) + ": '" + str(sho_cho).replace(" ", "") + "'"
-                first_chord = False
-            else: # subsequent chords
-                SongSectionValues.song_offset_chord_2_beat = SongSectionValues.song_offset_chord_2_beat + ", " + str(start_note_offset) + ": '" + str(sho_cho).replace(" ", "") + "'"
+            SongSectionValues.song_offset_chord_2_beat[get_offset_key(start_note_offset)] = str(sho_cho).replace(" ", "")
 
         SongSectionValues.song_chords_2_beat = SongSectionValues.song_chords_2_beat + chords_half_a_bar
         # print('2 beats |' + chords_half_a_bar)
-        SongSectionValues.song_offset_chord_2_beat = SongSectionValues.song_offset_chord_2_beat + ','
 
 
         # chords_1_per_bar
-        print('1 bar ...')
-        offset_increment = beat_count
-        if SongSectionValues.offsets != None:
-            offset_increment = SongSectionValues.offsets[Harmonic_Rhythm.BAR1.value]
-        print('offset_increment', offset_increment)
         chords_1_per_bar = ''
-        first_chord = True
         sho_cho = 'NC '
 
-        for start_note_offset in numpy.arange(current_section_start_note_offset, (last_note_offset + last_note_duration_quarterLength),
-                                                  offset_increment):
+        for start_note_offset, window_chord in zip(window_starts[Harmonic_Rhythm.BAR1], window_chords[Harmonic_Rhythm.BAR1]):
             # print('start_note_offset', start_note_offset, 'end_note_offset', (start_note_offset + offset_increment))
-            shorter_stream = self.get_stream(start_note_offset, (start_note_offset + offset_increment) )
-            # self.show_text_in_stream(shorter_stream)
-            if stream_has_a_note(shorter_stream):
-                # print('ANALYZE_CHOICE =', analyze_choice)
-                song_key = shorter_stream.analyze(self.analyze_choice)
-                sho_cho = short_chord(song_key.name)
+            if window_chord is not None:
+                sho_cho = window_chord
             else:
                 sho_cho = 'NC '
             chords_1_per_bar = chords_1_per_bar + sho_cho + '|'
 
 
-            if first_chord:
-                SongSectionValues.song_offset_chord_1_bar = SongSectionValues.song_offset_chord_1_bar + str(start_note_offset) + ": '" + str(sho_cho).replace(" ", "") + "'"
-                first_chord = False
-            else: # subsequent chords
-                SongSectionValues.song_offset_chord_1_bar = SongSectionValues.song_offset_chord_1_bar + ", " + str(start_note_offset) + ": '" + str(sho_cho).replace(" ", "") + "'"
+            SongSectionValues.song_offset_chord_1_bar[get_offset_key(start_note_offset)] = str(sho_cho).replace(" ", "")
 
         SongSectionValues.song_chords_1_bar = SongSectionValues.song_chords_1_bar + chords_1_per_bar
         # print('1 bar   |' + chords_1_per_bar)
-        SongSectionValues.song_offset_chord_1_bar = SongSectionValues.song_offset_chord_1_bar + ','
 
 
         # chord every 2 measures
-        print('2 bars ...')
 
         # if there are < 2 measures then
-        if (last_note_offset + last_note_duration_quarterLength - current_section_start_note_offset) < (beat_count * 2):
+        if section_length < (beat_count * 2):
             SongSectionValues.song_chords_2_bar = SongSectionValues.song_chords_2_bar + chords_1_per_bar
-            SongSectionValues.song_offset_chord_2_bar = SongSectionValues.song_offset_chord_2_bar + str(
-                current_section_start_note_offset) + ": '" + str(sho_cho).replace(" ", "") + "'"
-            SongSectionValues.song_offset_chord_2_bar = SongSectionValues.song_offset_chord_2_bar + ','
+            SongSectionValues.song_offset_chord_2_bar[get_offset_key(current_section_start_note_offset)] = str(sho_cho).replace(" ", "")
 
         else:
             # chords_2_bars_each
-            offset_increment = beat_count * 2
-            if SongSectionValues.offsets != None:
-                offset_increment = SongSectionValues.offsets[Harmonic_Rhythm.BAR2.value]
-            print('offset_increment', offset_increment)
+            offset_increment = offset_increments[Harmonic_Rhythm.BAR2]
             chords_2_bars_each = ''
             num_slices = int((last_note_offset + last_note_duration_quarterLength - current_section_start_note_offset) / offset_increment)
             segment_last_note_offset = (last_note_offset + last_note_duration_quarterLength) - (
@@ -1326,18 +1412,12 @@ class SongSectionValues:
             segment_last_note_bar = int(segment_last_note_offset / beat_count)
             # print('last_note_offset',last_note_offset,'last_note_duration_quarterLength',last_note_duration_quarterLength,'offset_increment', offset_increment,'num_slices', num_slices,'segment_last_note_offset',segment_last_note_offset,'segment_last_note_bar',segment_last_note_bar)
             slice = 0
-            first_chord = True
             sho_cho = 'NC '
 
-            for start_note_offset in numpy.arange(current_section_start_note_offset, (last_note_offset + last_note_duration_quarterLength),
-                                                      offset_increment):
+            for start_note_offset, window_chord in zip(window_starts[Harmonic_Rhythm.BAR2], window_chords[Harmonic_Rhythm.BAR2]):
                 # print('start_note_offset', start_note_offset, 'end_note_offset', (start_note_offset + offset_increment))
-                shorter_stream = self.get_stream(start_note_offset, (start_note_offset + offset_increment) )
-                # self.show_text_in_stream(shorter_stream)
-                if stream_has_a_note(shorter_stream):
-                    # print('ANALYZE_CHOICE =', analyze_choice)
-                    song_key = shorter_stream.analyze(self.analyze_choice)
-                    sho_cho = short_chord(song_key.name)
+                if window_chord is not None:
+                    sho_cho = window_chord
                 else:
                     sho_cho = 'NC '
                 chords_2_bars_each = chords_2_bars_each + sho_cho
@@ -1347,51 +1427,27 @@ class SongSectionValues:
                 else:
                     chords_2_bars_each = chords_2_bars_each + '|'
                 slice = slice + 1
-                if first_chord:
-                    SongSectionValues.song_offset_chord_2_bar = SongSectionValues.song_offset_chord_2_bar + str(
-                        start_note_offset) + ": '" + str(sho_cho).replace(" ", "") + "'"
-                    first_chord = False
-                else:  # subsequent chords
-                    SongSectionValues.song_offset_chord_2_bar = SongSectionValues.song_offset_chord_2_bar + ", " + str(
-                        start_note_offset) + ": '" + str(sho_cho).replace(" ", "") + "'"
+                SongSectionValues.song_offset_chord_2_bar[get_offset_key(start_note_offset)] = str(sho_cho).replace(" ", "")
 
             SongSectionValues.song_chords_2_bar = SongSectionValues.song_chords_2_bar + chords_2_bars_each
             # print('2 bars  |' + chords_2_bars_each)
-            SongSectionValues.song_offset_chord_2_bar = SongSectionValues.song_offset_chord_2_bar + ','
 
         # chord every 4 measures
-        print('4 bars ...')
-        first_chord = True
 
         # < 2 measures use 1 bar
-        if (last_note_offset + last_note_duration_quarterLength - current_section_start_note_offset) < (beat_count * 2):
+        if section_length < (beat_count * 2):
             SongSectionValues.song_chords_4_bar = SongSectionValues.song_chords_4_bar + chords_1_per_bar
-            SongSectionValues.song_offset_chord_4_bar = SongSectionValues.song_offset_chord_4_bar + str(
-                current_section_start_note_offset) + ": '" + str(sho_cho).replace(" ", "") + "'"
-            SongSectionValues.song_offset_chord_4_bar = SongSectionValues.song_offset_chord_4_bar + ','
+            SongSectionValues.song_offset_chord_4_bar[get_offset_key(current_section_start_note_offset)] = str(sho_cho).replace(" ", "")
 
         # >=2 and < 4 measures: use 2 bars
-        if ((last_note_offset + last_note_duration_quarterLength - current_section_start_note_offset) >= (beat_count * 2)) and (
-            (last_note_offset + last_note_duration_quarterLength - current_section_start_note_offset) < (beat_count * 4)):
+        if (section_length >= (beat_count * 2)) and (section_length < (beat_count * 4)):
             SongSectionValues.song_chords_4_bar = SongSectionValues.song_chords_4_bar + chords_2_bars_each
-            if first_chord:
-                SongSectionValues.song_offset_chord_4_bar = SongSectionValues.song_offset_chord_4_bar + str(
-                    current_section_start_note_offset + start_note_offset) + ": '" + str(sho_cho).replace(" ",
-                                                                                                          "") + "'"
-                SongSectionValues.song_offset_chord_4_bar = SongSectionValues.song_offset_chord_4_bar + ','
-
-                first_chord = False
-            else:  # subsequent chords
-                SongSectionValues.song_offset_chord_4_bar = SongSectionValues.song_offset_chord_4_bar + ", " + str(
-                    current_section_start_note_offset + start_note_offset) + ": '" + str(sho_cho).replace(" ", "") + "'"
+            SongSectionValues.song_offset_chord_4_bar[get_offset_key(current_section_start_note_offset + start_note_offset)] = str(sho_cho).replace(" ", "")
 
         # if there are >= 4 measures then calc
-        if ( last_note_offset + last_note_duration_quarterLength - current_section_start_note_offset) >= (beat_count * 4):
+        if section_length >= (beat_count * 4):
             # calc chord every 4 measures
-            offset_increment = beat_count * 4
-            if SongSectionValues.offsets != None:
-                offset_increment = SongSectionValues.offsets[Harmonic_Rhythm.BAR4.value]
-            print('offset_increment', offset_increment)
+            offset_increment = offset_increments[Harmonic_Rhythm.BAR4]
 
             chords_4_bars_each = ''
             num_slices = int((last_note_offset + last_note_duration_quarterLength - current_section_start_note_offset) / offset_increment)
@@ -1399,18 +1455,12 @@ class SongSectionValues:
             segment_last_note_bar = int(segment_last_note_offset / beat_count)
             # print('last_note_offset',last_note_offset,'last_note_duration_quarterLength',last_note_duration_quarterLength,'offset_increment', offset_increment,'num_slices', num_slices,'segment_last_note_offset',segment_last_note_offset,'segment_last_note_bar',segment_last_note_bar)
             slice = 0
-            # first_chord = True
             sho_cho = 'NC '
 
-            for start_note_offset in numpy.arange(current_section_start_note_offset, (last_note_offset + last_note_duration_quarterLength),
-                                                  offset_increment):
+            for start_note_offset, window_chord in zip(window_starts[Harmonic_Rhythm.BAR4], window_chords[Harmonic_Rhythm.BAR4]):
                 # print('start_note_offset', start_note_offset, 'end_note_offset', (start_note_offset + offset_increment))
-                shorter_stream = self.get_stream(start_note_offset, (start_note_offset + offset_increment))
-                # self.show_text_in_stream(shorter_stream)
-                if stream_has_a_note(shorter_stream):
-                    # print('ANALYZE_CHOICE =', analyze_choice)
-                    song_key = shorter_stream.analyze(self.analyze_choice)
-                    sho_cho = short_chord(song_key.name)
+                if window_chord is not None:
+                    sho_cho = window_chord
                 else:
                     sho_cho = 'NC '
                 chords_4_bars_each = chords_4_bars_each + sho_cho
@@ -1427,17 +1477,10 @@ class SongSectionValues:
                             chords_4_bars_each = chords_4_bars_each + '|' + sho_cho
                         chords_4_bars_each = chords_4_bars_each + '|'
                 slice = slice + 1
-                if first_chord:
-                    SongSectionValues.song_offset_chord_4_bar = SongSectionValues.song_offset_chord_4_bar + str(
-                        start_note_offset) + ": '" + str(sho_cho).replace(" ", "") + "'"
-                    first_chord = False
-                else:  # subsequent chords
-                    SongSectionValues.song_offset_chord_4_bar = SongSectionValues.song_offset_chord_4_bar + ", " + str(
-                        start_note_offset) + ": '" + str(sho_cho).replace(" ", "") + "'"
+                SongSectionValues.song_offset_chord_4_bar[get_offset_key(start_note_offset)] = str(sho_cho).replace(" ", "")
 
             SongSectionValues.song_chords_4_bar = SongSectionValues.song_chords_4_bar + chords_4_bars_each
             # print('4 bars  |' + chords_4_bars_each)
-            SongSectionValues.song_offset_chord_4_bar = SongSectionValues.song_offset_chord_4_bar + ','
 
         # update current_song_length_offset
         SongSectionValues.current_song_length_offset = last_note_offset + last_note_duration_quarterLength
@@ -1445,13 +1488,13 @@ class SongSectionValues:
     def print_class_variable(self):
         print('# -----------------------------------------------------------------------')
         print('')
-        if SongSectionValues.song_offset_chord_1_beat != '{}':
+        if SongSectionValues.song_offset_chord_1_beat:
             print('song_offset_chord_1_beat =',SongSectionValues.song_offset_chord_1_beat)
             print('song_offset_chord_2_beat =',SongSectionValues.song_offset_chord_2_beat)
             print('song_offset_chord_1_bar  = ',SongSectionValues.song_offset_chord_1_bar)
             print('song_offset_chord_2_bar  = ',SongSectionValues.song_offset_chord_2_bar)
             print('song_offset_chord_4_bar  = ',SongSectionValues.song_offset_chord_4_bar)
-        if SongSectionValues.song_offset_placeholder_chords != '{}':
+        if SongSectionValues.song_offset_placeholder_chords:
             # print('song_offset_placeholder_chords  = ',SongSectionValues.song_offset_placeholder_chords)
             pass
 
@@ -1477,7 +1520,7 @@ class SongSectionValues:
             if not note:
                 copy to output stream
             else:
-                sho_cho = get_chord(n.offset, offset_chord)
+                sho_cho = get_chord(n.offset, offset_chord, prev_sho_cho, chord_offsets)
                 if sho_cho != prev_sho_cho:
                     append sho_cho
                 append note
@@ -1487,12 +1530,11 @@ class SongSectionValues:
         print('write_chords(self, input_filename, offset_chord, output_filename):', input_filename, offset_chord, output_filename)
         # print('SongSectionValues.offset_section',SongSectionValues.offset_section)
 
-        score_to_write = stream.Score()
-        p0 = stream.Part()
-        p0.insert(0, self.the_instrument)
+        elements = []  # melody and chord symbols in order, see write_elements
 
         prev_sho_cho = 'NC'
         the_offset = 0.0
+        chord_offsets = sorted(offset_chord)
 
         # for each element
         for n in SongSectionValues.song_stream.flatten():
@@ -1512,41 +1554,23 @@ class SongSectionValues:
                     # print('len(SongSectionValues.offset_section)', len(SongSectionValues.offset_section))
                     pass
                 else:
-                    p0.append(n)
+                    elements.append(n)
             # else is note or rest
             else:
                 # get chord for note
                 # sho_cho = get_chord(float(int(n.offset)), offset_chord)
-                sho_cho = get_chord(n.offset, offset_chord, prev_sho_cho )
+                sho_cho = get_chord(n.offset, offset_chord, prev_sho_cho, chord_offsets)
                 # if new chord or beginning of a section
                 if sho_cho != prev_sho_cho or (n.offset in SongSectionValues.offset_section):
                     # append chord
-                    if sho_cho == 'NC':
-                        p0.append(NoChord())
-                    else:
-                        p0.append(ChordSymbol(sho_cho))
+                    elements.append(get_chord_symbol(sho_cho))
                     prev_sho_cho = sho_cho
                 # append note/rest
-                p0.append(n)
-
-        score_to_write.insert(0, p0)
-        # self.show_text_in_stream(score_to_write)
-        # score_to_write.show('text')
-
-        # metadata
-        score_to_write.insert(0, metadata.Metadata())
-        filename = Path(input_filename)
-        score_to_write.metadata.title = filename.with_suffix('')
-        score_to_write.metadata.composer = 'VeeHarmGen ' + __version__ + '\n' + output_filename + '\n'
-
-        first_note, last_note = get_first_last_note_names(score_to_write)
-        #output_filename = update_filename_with_range(output_filename, first_note, last_note)
-
-        # self.show_text_in_stream(score_to_write)
-        # score_to_write.show('text')
+                elements.append(n)
 
         # write output stream
-        score_to_write.write(OUTPUT_FORMAT, fp=self.OUTPUT_PATH + output_filename)
+        filename = Path(input_filename)
+        self.write_elements(elements, str(filename.with_suffix('')), output_filename)
 
         print('output =',self.OUTPUT_PATH + output_filename)
         pass
@@ -1565,18 +1589,18 @@ class SongSectionValues:
         """
         print('write_placeholder_chords(self, pitch_to_chord, output_filename, chord_choice, number)', pitch_to_chord, output_filename, chord_choice, number)
 
-        score = stream.Score()
-        p0 = stream.Part()
-        p0.insert(0, self.the_instrument)
+        elements = []  # melody and chord symbols in order, see write_elements
 
         prev_sho_cho = 'NC'
 
-        # Get the first offset and pitch class
-        next_chord_offset, next_pitch_class = next(iter(SongSectionValues.song_offset_placeholder_chords.items()))
+        # Get the first offset and pitch class, then step through the placeholder chords one at a time
+        chord_offsets, chord_pitch_classes = self.get_placeholder_chords()
+        chord_index = 0
+        next_chord_offset, next_pitch_class = chord_offsets[chord_index], chord_pitch_classes[chord_index]
         print('next_chord_offset', next_chord_offset)
-        print('next_pitch_class', next_pitch_class)
+        print('next_pitch_class', mask_to_pitch_class(next_pitch_class))
 
-        last_chord_offset = list(SongSectionValues.song_offset_placeholder_chords)[-1]
+        last_chord_offset = chord_offsets[-1]
         print('last_chord_offset', last_chord_offset)
 
         # Iterate through the song stream
@@ -1588,52 +1612,60 @@ class SongSectionValues:
                 elif issubclass(n.__class__, music21.expressions.RehearsalMark) and len(SongSectionValues.offset_section) == 1:
                     pass
                 else:
-                    p0.append(n)
+                    elements.append(n)
             else:
                 # Only process if next_chord_offset is not None
                 if next_chord_offset is not None and n.offset >= next_chord_offset:
                     print('n.offset >= next_chord_offset', n.offset, next_chord_offset)
                     sho_cho = get_chord_for_pitch_class(next_pitch_class, pitch_to_chord, output_filename, chord_choice, number)
                     # Append the chord
-                    if sho_cho == 'NC':
-                        p0.append(NoChord())
-                    else:
-                        p0.append(ChordSymbol(sho_cho))
+                    elements.append(get_chord_symbol(sho_cho))
                     prev_sho_cho = sho_cho
 
                     # Update next_chord_offset and next_pitch_class if not at the last chord offset
-                    if next_chord_offset != last_chord_offset:
-                        temp = iter(SongSectionValues.song_offset_placeholder_chords)
-                        for k in temp:
-                            if k == next_chord_offset:
-                                next_chord_offset = next(temp, None)
-                                break
-                        next_pitch_class = SongSectionValues.song_offset_placeholder_chords[next_chord_offset]
+                    if chord_index < len(chord_offsets) - 1:
+                        chord_index += 1
+                        next_chord_offset, next_pitch_class = chord_offsets[chord_index], chord_pitch_classes[chord_index]
                         print('the next_chord_offset', next_chord_offset)
-                        print('the next_pitch_class', next_pitch_class)
+                        print('the next_pitch_class', mask_to_pitch_class(next_pitch_class))
                     else:
                         # If at the last chord offset, set next_chord_offset to None
                         next_chord_offset = None
 
                 # Append the note/rest
-                p0.append(n)
+                elements.append(n)
 
         # Write the output stream
-        score.insert(0, metadata.Metadata())
         filename = Path(output_filename)
-        score.metadata.title = filename.with_suffix('')
-        score.metadata.composer = 'VeeHarmGen ' + __version__ + '\n' + output_filename + '\n'
-
-        score.insert(0, p0)
-
-        first_note, last_note = get_first_last_note_names(score)
-        #output_filename = update_filename_with_range(output_filename, first_note, last_note)
-
-        score.write(OUTPUT_FORMAT, fp=self.OUTPUT_PATH + output_filename)
+        self.write_elements(elements, str(filename.with_suffix('')), output_filename)
 
         print('output =', self.OUTPUT_PATH + output_filename)
         return None
 
+    def write_elements(self, elements, title, output_filename):
+        """
+        write a melody with chord symbols to output_filename in the output folder with write_melody_musicxml,
+        or with music21 if the melody has notation write_melody_musicxml does not write
+        :param elements: the notes, rests, chord symbols etc. in order e.g. [NoChord, Note, ChordSymbol, Note]
+        :param title: e.g. Cairo
+        :param output_filename: e.g. Cairo-BAR1.musicxml
+        :return: void
+        """
+        composer = 'VeeHarmGen ' + __version__ + '\n' + output_filename + '\n'
+        if not write_melody_musicxml(elements, self.OUTPUT_PATH + output_filename, title, composer,
+                                     self.the_instrument.instrumentName, OUTPUT_FORMAT):
+            score = stream.Score()
+            p0 = stream.Part()
+            p0.insert(0, self.the_instrument)
+            for element in elements:
+                p0.append(element)
+            score.insert(0, metadata.Metadata())
+            score.metadata.title = title
+            score.metadata.composer = composer
+            score.insert(0, p0)
+            score.write(OUTPUT_FORMAT, fp=self.OUTPUT_PATH + output_filename)
+        SongSectionValues.output_files.append(self.OUTPUT_PATH + output_filename)
+
     # end of SongSectionValues class
 
 def has_section(a_song):
@@ -1645,12 +1677,10 @@ def has_section(a_song):
     print('Looking for a section...')
     result = False
 
-    # for each element in stream
-    for n in a_song.flatten():
-        if type(n) == music21.expressions.RehearsalMark:
-            if is_section(n.content):
-                print('has_section',n.content)
-                result = True
+    # for each section found in the ScoreProfile
+    for section in get_score_profile(a_song).offset_section.values():
+        print('has_section', section)
+        result = True
 
     return result
 
@@ -1818,22 +1848,19 @@ def chord_is_minor(val):
 
 def display_pitches_in_pitch_class(pitch_class):
     """
-    Given a pitch class in binary format (e.g. "1000 0000 0000"),
+    Given a pitch class mask (e.g. 0b100000000000 for "1000 0000 0000"),
     return a list of pitch names that are represented.
     
-    :param pitch_class: binary string e.g. "1000 0000 0000"
+    :param pitch_class: pitch class mask, see pitch_class_to_mask
     :return: list of pitch names e.g. ['C', 'C#', 'D', ...]
     """
     pitch_names = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
     
-    # Remove spaces from pitch_class
-    binary_string = pitch_class.replace(' ', '')
-    
-    # Get the pitches where bit is '1'
+    # Get the pitches where bit is set, C is the most significant bit
     pitches = []
-    for i, bit in enumerate(binary_string):
-        if bit == '1':
-            pitches.append(pitch_names[i % 12])
+    for i in range(12):
+        if pitch_class & (1 << (11 - i)):
+            pitches.append(pitch_names[i])
     
     return pitches
 
@@ -2055,7 +2082,7 @@ def choose_chord_weighted(melody_notes, creativity):
 
 def get_chord_from_pitch_to_chord_by_infer(number, pitch_class):
     """
-    Infer a chord name from a pitch_class using template-based matching.
+    Infer a chord name from a pitch_class mask using template-based matching.
     number acts as creativity (0..100).
     Returns chord short name string or None.
     """
@@ -2304,8 +2331,8 @@ def chord_is_interval_range_from_prev(val, prev_value, int_low, int_high):
     if prev_value == 'NC' or val == 'NC':
         result = True
     else:
-        h = harmony.ChordSymbol(val)
-        prev_h = harmony.ChordSymbol(prev_value)
+        h = parse_chord_symbol(val)
+        prev_h = parse_chord_symbol(prev_value)
 
         n = music21.note.Note()
         n.nameWithOctave = str(h.root())
@@ -2984,29 +3011,6 @@ def add_RehearsalMark(input_song):
     output_song.insert(0, p0)
     return output_song
 
-def get_offset_section(input_song):
-    """
-    :param input_song:
-    :return: offset_section dictionary to hold offset to section mapping e.g. {0.0: 'intro 1'}
-    """
-    print('get_offset_section(input_song)', input_song)
-
-    offset_section = {}
-    the_offset = 0.0
-
-    for n in input_song.flatten():
-        if type(n) == music21.expressions.RehearsalMark:
-            if is_section(n.content):
-                # print('the_offset, RehearsalMark =', the_offset, n.content)
-                offset_section[the_offset] = n.content
-        # if note or rest then set the_offset
-        if type(n) == music21.note.Note or type(n) == music21.note.Rest:
-                the_offset = n.offset + n.duration.quarterLength
-
-    print('offset_section', offset_section)
-
-    return offset_section
-
 def normalise_song(input_song, input_filename):
     """
     normalise means: set instrument to piano, set key signature to C / Am
@@ -3055,7 +3059,8 @@ def get_accidental_count(a_song):
     acc_count = 0
     acc_disp_status_count = 0
 
-    a_song.makeAccidentals(inPlace=True)
+    # makeAccidentals changes the notes, so count on a copy and leave a_song untouched
+    a_song = a_song.makeAccidentals(inPlace=False)
 
     for n in a_song.flatten():
         # if note update acc_count
@@ -3104,51 +3109,6 @@ def get_key_signature(a_stream):
     return first_KS
 
 
-def get_first_time_sig(a_stream):
-    """
-    :param a_stream: of music
-    :return: the first time signature
-    """
-    # may have to get first part
-    # myPart[music21.meter.TimeSignature][0]
-
-    return a_stream[music21.meter.TimeSignature][0]
-
-    pass
-
-
-def get_first_key_signature(a_stream):
-    """
-    :param a_stream:
-    :return: first key signature or if None return a key.KeySignature with zero sharps (C)
-    """
-    ks = key.KeySignature(0)
-    try:
-        ks = a_stream[music21.key.KeySignature][0]
-    except IndexError as error:
-        ks = key.KeySignature(0)
-
-    return ks
-
-
-def get_first_instrument(a_stream):
-    """
-    :param a_stream:
-    :return: the first instrument in the stream
-    """
-    first_inst = None
-    # for each element
-    for n in a_stream.flatten():
-        # if not note:
-        if type(n) != music21.note.Note and type(n) != music21.note.Rest:
-            if issubclass(n.__class__, music21.instrument.Instrument):
-                if first_inst == None:
-                    first_inst = n
-                else:
-                    print('other inst',n)
-
-    return first_inst
-
 def get_first_last_note_names(stream_obj):
     """
     Given a music21 Stream, return (first_note, last_note)
@@ -3181,28 +3141,30 @@ def get_transpose_information(stream_title, a_stream):
     """
     print('')
     print('--- key information for', stream_title,' ----------------------------------------------------------------')
-    # copy stream
-    stream_copy = copy.deepcopy(a_stream)
-    first_key_sig = get_first_key_signature(stream_copy)
+    # only read, from the ScoreProfile of a_stream
+    profile = get_score_profile(a_stream)
+    first_key_sig = profile.key_signature
     print('first key signature',first_key_sig)
     print([str(p) for p in first_key_sig.alteredPitches])
     print('key (mode=major)', first_key_sig.asKey())
     print('key (mode=minor)', first_key_sig.asKey(mode='minor'))
-    accidental_count = get_accidental_count(stream_copy)
+    accidental_count = profile.get_accidental_count()
     print('accidental_count',accidental_count)
 
     print('')
-    first_time_sig = get_first_time_sig(stream_copy)
+    first_time_sig = profile.time_signature
     print('first time sig',first_time_sig)
-    first_inst = get_first_instrument(stream_copy)
+    for other_inst in profile.other_instruments:
+        print('other inst',other_inst)
+    first_inst = profile.instrument
     print('first instrument',first_inst)
-    first_note = get_first_note(stream_copy)
+    first_note = profile.first_note
     print('first note',first_note)
-    last_note = get_last_note(stream_copy)
+    last_note = profile.last_note
     print('last note',last_note)
 
     print('')
-    k = stream_copy.analyze('key')
+    k = profile.get_key()
     print('analyzed key & mode', k)
 
     # if minor find interval to A
@@ -3303,21 +3265,6 @@ def generate_from_placeholder_chords_v1(a_song, song_key, instrument, mxlfile_ba
 
     song_section_values.print_placeholder_chords()
 
-    # at end of song strip final comma and add }
-    SongSectionValues.song_offset_placeholder_chords = remove_suffix(SongSectionValues.song_offset_placeholder_chords, ',') + '}'
-
-    # convert string to dictionary using ast.literal_eval() method
-    # ast.literal_eval: Safely evaluate an expression node or a string containing a Python literal or container display.
-    # The string or node provided may only consist of the following Python literal structures:
-    # strings, bytes, numbers, tuples, lists, dicts, sets, booleans, None, bytes and sets.
-    try:
-        SongSectionValues.song_offset_placeholder_chords = ast.literal_eval(
-            SongSectionValues.song_offset_placeholder_chords)
-    except BaseException as err:
-        print(f"Unexpected {err=}, {type(err)=}")
-        print('exit: Error ast.literal_eval song_offset_placeholder_chords',
-              SongSectionValues.song_offset_placeholder_chords)
-        sys.exit()
 
     # print('after strip final comma and add } and convert to dict')
     # print('SongSectionValues.song_offset_placeholder_chords', SongSectionValues.song_offset_placeholder_chords)
@@ -3353,13 +3300,13 @@ def generate_from_placeholder_chords_v1(a_song, song_key, instrument, mxlfile_ba
                     os.path.splitext(pitch_to_chord_file)[0]).replace('-_-ptc', '') + '-' + str(chord_choice)[:3] + '-' + str(number) + f'.{OUTPUT_FORMAT}'
             print('output_filename', output_filename)
             # input('Press Enter to continue...')
-            pitch_to_chord = load_json(input_pitch_to_chord_fully_qualified)
+            pitch_to_chord = load_style(input_pitch_to_chord_fully_qualified)
             # print('pitch_to_chord', pitch_to_chord)
             song_section_values.write_placeholder_chords(pitch_to_chord, output_filename, chord_choice, number)
             print('')
     return None
 
-def generate_from_placeholder_chords(a_song, song_key, instrument, mxlfile_basename, chord_choice, number, style ):
+def generate_from_placeholder_chords(a_song, song_key, instrument, mxlfile_basename, chord_choice, number, style, variants=None, jobs=1):
     """
     given a_song with a melody and placeholder chords,
     populate song_offset_placeholder_chords with offset and pitch classes in melody key e.g.
@@ -3374,9 +3321,16 @@ def generate_from_placeholder_chords(a_song, song_key, instrument, mxlfile_basen
     :param chord_choice:
     :param number:
     :param style 
+    :param variants: optional list of (chord_choice, number, instrument) to write for each style, see sweep_spec
+                     e.g. [(Chord_Choice.RANK, 90, 'Clarinet'), (Chord_Choice.RANK, 80, 'Flute')]
+                     default is [(chord_choice, number, instrument)]
+    :param jobs: number of styles to write at once in worker processes
     """
 
-    print('generate_from_placeholder_chords', a_song, song_key, instrument, mxlfile_basename,  chord_choice, number, style)
+    print('generate_from_placeholder_chords', a_song, song_key, instrument, mxlfile_basename,  chord_choice, number, style, variants, jobs)
+
+    if variants is None:
+        variants = [(chord_choice, number, instrument)]
     
     found_time_signature = False
     first_TimeSig = True
@@ -3407,35 +3361,28 @@ def generate_from_placeholder_chords(a_song, song_key, instrument, mxlfile_basen
 
     song_section_values.print_placeholder_chords()
 
-    # at end of song strip final comma and add }
-    SongSectionValues.song_offset_placeholder_chords = remove_suffix(SongSectionValues.song_offset_placeholder_chords, ',') + '}'
-
-    # convert string to dictionary using ast.literal_eval() method
-    try:
-        SongSectionValues.song_offset_placeholder_chords = ast.literal_eval(
-            SongSectionValues.song_offset_placeholder_chords)
-    except BaseException as err:
-        print(f"Unexpected {err=}, {type(err)=}")
-        print('exit: Error ast.literal_eval song_offset_placeholder_chords',
-              SongSectionValues.song_offset_placeholder_chords)
-        sys.exit()
 
     # version tag
     version_tag = "v01"
 
     # If chord_choice is INFER, generate chords directly without style files
-    if chord_choice == Chord_Choice.INFER:
-        print('Chord_Choice is INFER - generating chords via inference')
-        
-        # Create a pseudo pitch_to_chord dictionary for inference
-        # For INFER mode, we don't need pre-computed data, just use the inference engine
-        output_filename = os.path.splitext(mxlfile_basename)[0]
-        output_filename = output_filename + '-' + style + '-' + str(chord_choice.value)[:3] + '-' + str(number) + f'-{version_tag}.{OUTPUT_FORMAT}'
-        print('output_filename', output_filename)
-        
-        # Write chords using inference
-        song_section_values.write_placeholder_chords_infer(output_filename, number)
-        print('')
+    for variant_chord_choice, variant_number, variant_instrument in variants:
+        if variant_chord_choice == Chord_Choice.INFER:
+            print('Chord_Choice is INFER - generating chords via inference')
+
+            # Create a pseudo pitch_to_chord dictionary for inference
+            # For INFER mode, we don't need pre-computed data, just use the inference engine
+            output_filename = os.path.splitext(mxlfile_basename)[0]
+            output_filename = output_filename + '-' + style + '-' + str(variant_chord_choice.value)[:3] + '-' + str(variant_number) + f'-{version_tag}.{OUTPUT_FORMAT}'
+            print('output_filename', output_filename)
+
+            # Write chords using inference
+            song_section_values.set_instrument(variant_instrument)
+            song_section_values.write_placeholder_chords_infer(output_filename, variant_number)
+            print('')
+
+    variants = [variant for variant in variants if variant[0] != Chord_Choice.INFER]
+    if variants == []:
         return None
 
     # for non-INFER modes: load style files
@@ -3453,33 +3400,143 @@ def generate_from_placeholder_chords(a_song, song_key, instrument, mxlfile_basen
     # version tag
     version_tag = "v01"
 
-    for pitch_to_chord_file in pitch_to_chord_files:
-        if style in pitch_to_chord_file:
-            input_pitch_to_chord_fully_qualified = INPUT_STYLE_PATH + pitch_to_chord_file
-            print('Processing', input_pitch_to_chord_fully_qualified)
-            output_filename = os.path.splitext(mxlfile_basename)[0]
-            output_filename = output_filename + '-' + str(
-                    os.path.splitext(pitch_to_chord_file)[0]).replace('-_-ptc', '') + '-' + str(chord_choice.value)[:3] + '-' + str(number) + f'-{version_tag}.{OUTPUT_FORMAT}'
-            print('output_filename', output_filename)
-            pitch_to_chord = load_json(input_pitch_to_chord_fully_qualified)
-            song_section_values.write_placeholder_chords(pitch_to_chord, output_filename, chord_choice, number)
-            print('')
+    pitch_to_chord_files = [f for f in pitch_to_chord_files if style in f]
+    if jobs == 1 or len(pitch_to_chord_files) < 2:
+        for pitch_to_chord_file in pitch_to_chord_files:
+            write_style(song_section_values, pitch_to_chord_file, mxlfile_basename, variants, version_tag)
+    else:
+        # each style is independent given the melody and placeholder chords, so write them in a pool of worker processes
+        print('writing', len(pitch_to_chord_files), 'styles with', jobs, 'jobs')
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=init_writer,
+                                                    initargs=(get_writer_state(song_section_values),)) as executor:
+            for output_files, log in executor.map(write_style_logged, pitch_to_chord_files,
+                                                  [mxlfile_basename] * len(pitch_to_chord_files),
+                                                  [variants] * len(pitch_to_chord_files),
+                                                  [version_tag] * len(pitch_to_chord_files)):
+                print(log, end='')
+                SongSectionValues.output_files.extend(output_files)
     return None
 
 
+def write_style(song_section_values, pitch_to_chord_file, mxlfile_basename, variants, version_tag):
+    """
+    generate chords in the placeholders of song_section_values from a style and write each variant to the output folder
+    :param song_section_values: SongSectionValues with the melody and placeholder chords
+    :param pitch_to_chord_file: style file in INPUT_STYLE_PATH e.g. jazz-_-ptc.json
+    :param mxlfile_basename: e.g. Cairo.mxl
+    :param variants: list of (chord_choice, number, instrument) e.g. [(Chord_Choice.RANK, 90, 'Clarinet')]
+    :param version_tag: e.g. v01
+    :return: void
+    """
+    input_pitch_to_chord_fully_qualified = INPUT_STYLE_PATH + pitch_to_chord_file
+    print('Processing', input_pitch_to_chord_fully_qualified)
+    pitch_to_chord = load_style(input_pitch_to_chord_fully_qualified)
+    for variant_chord_choice, variant_number, variant_instrument in variants:
+        output_filename = os.path.splitext(mxlfile_basename)[0]
+        output_filename = output_filename + '-' + str(
+                os.path.splitext(pitch_to_chord_file)[0]).replace('-_-ptc', '') + '-' + str(variant_chord_choice.value)[:3] + '-' + str(variant_number) + f'-{version_tag}.{OUTPUT_FORMAT}'
+        print('output_filename', output_filename)
+        song_section_values.set_instrument(variant_instrument)
+        song_section_values.write_placeholder_chords(pitch_to_chord, output_filename, variant_chord_choice, variant_number)
+        print('')
+
+
+def get_writer_state(song_section_values):
+    """
+    :param song_section_values: SongSectionValues with the melody and placeholder chords
+    :return: what a writer worker process needs to write_style or write_chords, see init_writer
+    """
+    return {'song_section_values': song_section_values,
+            'output_format': OUTPUT_FORMAT,
+            'OUTPUT_PATH': SongSectionValues.OUTPUT_PATH,
+            'the_instrument': SongSectionValues.the_instrument,
+            'offset_section': SongSectionValues.offset_section,
+            'song_offset_placeholder_chords': SongSectionValues.song_offset_placeholder_chords,
+            'song_stream': SongSectionValues.song_stream,
+            'chord_symbols': chord_symbols}
+
+
+def init_writer(state):
+    """
+    set the melody and placeholder chords of a writer worker process once, rather than for each output file
+    :param state: from get_writer_state
+    :return: void
+    """
+    global OUTPUT_FORMAT, writer_song_section_values
+    OUTPUT_FORMAT = state['output_format']
+    SongSectionValues.OUTPUT_PATH = state['OUTPUT_PATH']
+    SongSectionValues.the_instrument = state['the_instrument']
+    SongSectionValues.offset_section = state['offset_section']
+    SongSectionValues.song_offset_placeholder_chords = state['song_offset_placeholder_chords']
+    SongSectionValues.song_stream = state['song_stream']
+    writer_song_section_values = state['song_section_values']
+    chord_symbols.update(state['chord_symbols'])
+
+
+def write_style_logged(pitch_to_chord_file, mxlfile_basename, variants, version_tag):
+    """
+    write_style in a worker process, with its printed output kept to be printed in order by generate_from_placeholder_chords
+    :return: (the files written, printed output)
+    """
+    SongSectionValues.output_files = []
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        write_style(writer_song_section_values, pitch_to_chord_file, mxlfile_basename, variants, version_tag)
+        save_chord_symbols()
+    return SongSectionValues.output_files, log.getvalue()
+
+
+def write_chords_logged(input_filename, offset_chord, output_filename):
+    """
+    SongSectionValues.write_chords in a worker process, with its printed output kept to be printed in order by harmonise
+    :return: (the files written, printed output)
+    """
+    SongSectionValues.output_files = []
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        writer_song_section_values.write_chords(input_filename, offset_chord, output_filename)
+    return SongSectionValues.output_files, log.getvalue()
+
+
     
-def positive_int(value):
+def sweep_spec(value):
     """
-    Validates if the argument is an integer greater than or equal to 1.
+    Validates a --sweep value of the form CHORD_CHOICE:NUMBERS[:INSTRUMENTS] where
+    NUMBERS is a comma separated list of numbers or inclusive ranges e.g. 90,80,70 or 0-3 or 100-95,90
+    and INSTRUMENTS is a comma separated list of instruments used in turn for each number e.g. Clarinet,Flute
+    :param value: e.g. 'rank:90,80:Clarinet,Flute'
+    :return: list of (chord_choice, number, instrument) e.g. [(Chord_Choice.RANK, 90, 'Clarinet'), (Chord_Choice.RANK, 80, 'Flute')]
+             where instrument is None if INSTRUMENTS is not given
     """
+    fields = value.split(':')
+    if len(fields) not in (2, 3):
+        raise argparse.ArgumentTypeError(f"'{value}' is not of the form CHORD_CHOICE:NUMBERS[:INSTRUMENTS] e.g. rank:90,80,70 or nth_outcome:0-3:Clarinet,Flute")
     try:
-        ivalue = int(value)
+        chord_choice = Chord_Choice(fields[0])
     except ValueError:
-        raise argparse.ArgumentTypeError(f"'{value}' is not a valid integer.")
-    
-    if ivalue < 1:
-        raise argparse.ArgumentTypeError(f"'{value}' must be a positive integer (>= 1).")
-    return ivalue
+        raise argparse.ArgumentTypeError(f"'{fields[0]}' is not a chord_choice, choose from " + ', '.join(str(c) for c in Chord_Choice))
+
+    numbers = []
+    for number_range in fields[1].split(','):
+        try:
+            if '-' in number_range:
+                first, last = [int(n) for n in number_range.split('-')]
+                step = 1 if last >= first else -1
+                numbers.extend(range(first, last + step, step))
+            else:
+                numbers.append(int(number_range))
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"'{number_range}' is not a number or a range of numbers e.g. 90 or 0-3")
+    for number in numbers:
+        if number < 0 or number > 100:
+            raise argparse.ArgumentTypeError(f"'{number}' in '{value}' must be in the range 0-100.")
+        if chord_choice == Chord_Choice.RANK and number < 1:
+            raise argparse.ArgumentTypeError(f"'{value}' is rank but has a number < 1 (1=least frequent, 100=most frequent).")
+
+    instruments = [None]
+    if len(fields) == 3:
+        instruments = fields[2].split(',')
+    return [(chord_choice, number, instruments[i % len(instruments)]) for i, number in enumerate(numbers)]
 
 # TASK: Write a Python function that reads a MusicXML file, extracts musical data,
 # and returns a structured representation useful for melody generation.
@@ -3500,7 +3557,7 @@ def get_pitch_class_for_bar_in_musicxml(bar_number: int, full_path_musicxml_file
     The pitch class is a binary string such as '1000 1001 0001' representing notes C, E, G, B."""
     # Parse the MusicXML file and get the specified measure
     try:
-        score = music21.converter.parse(full_path_musicxml_filename)
+        score = parse_score(full_path_musicxml_filename)
     except Exception as e:
         print(f"Error parsing MusicXML file: {e}")
         return ""
@@ -3582,23 +3639,10 @@ def update_filename_with_range(filename, first_note, last_note):
     # Reassemble filename
     return new_stem + ext
 
-def main():
+def get_argument_parser():
     """
-    parse command line arguments
-    read mxl
-    normalise stream
-    write normalised stream
-
-    for each stream element
-        if time sig: read time sig
-        if text: read section name
-            if not first section:
-                song_section_values.print()
-            init SongSectionValues
-        if note: read note: song_section_values.update()
-    song_section_values.print()
+    :return: the argparse.ArgumentParser for the VeeHarmGen command line arguments
     """
-
     # Specify command line arguments.
     parser = argparse.ArgumentParser()
     parser.add_argument('-m', '--mxlfile',
@@ -3656,6 +3700,12 @@ def main():
                         default='Piano',
                         type=str)                               
 
+    parser.add_argument('-j', '--jobs',
+                        help='number of output files to write at once e.g. one per core: each style when the input music has placeholder chords, '
+                             'else each harmonic rhythm. Default is 1',
+                        default=1,
+                        type=positive_int)
+
     parser.add_argument('-n', '--number',
                         help='number used with the chord_choice e.g. '
                         'if chord_choice is rank then number 100 is the most frequent and  1 is least frequent in the nearest-rank ordered list of possible chords. [100-75] recommended rank number;   '
@@ -3674,6 +3724,16 @@ def main():
                         default='ptc',
                         type=str)
 
+    parser.add_argument('--sweep',
+                        help='with placeholder chords, write every variant in one run instead of one run per -c -n -i. '
+                             'Each SWEEP is CHORD_CHOICE:NUMBERS[:INSTRUMENTS] where NUMBERS is a comma separated list of numbers or ranges '
+                             'and INSTRUMENTS is a comma separated list of instruments used in turn for each number (default -i) '
+                             'e.g. --sweep rank:90,80,70:Clarinet,Flute,Guitar nth_outcome:0-3',
+                        metavar='SWEEP',
+                        default=None,
+                        nargs='+',
+                        type=sweep_spec)
+
     parser.add_argument('-t', '--transpose',
                         help='transpose input file down or up t semitones (to override default "analyze" transpose to C / a minor)',
                         default=None,
@@ -3682,8 +3742,47 @@ def main():
     parser.add_argument('-v', '--version', action='version',
                         version='%(prog)s {version}'.format(version=__version__))
 
+    return parser
+
+
+def main():
+    """
+    parse command line arguments
+    read mxl
+    normalise stream
+    write normalised stream
+
+    for each stream element
+        if time sig: read time sig
+        if text: read section name
+            if not first section:
+                song_section_values.print()
+            init SongSectionValues
+        if note: read note: song_section_values.update()
+    song_section_values.print()
+    """
     # Parse command line arguments.
-    args = parser.parse_args()
+    args = get_argument_parser().parse_args()
+
+    harmonise(args)
+
+
+def harmonise(args, raw_song=None):
+    """
+    harmonise the melody in args.mxlfile, or lookup a bar or pitch class, as per the command line arguments.
+    May be called repeatedly in one process e.g. by VeeHarmGen_server.py
+    :param args: the arguments parsed by get_argument_parser()
+    :param raw_song: optional music21 score already parsed from args.mxlfile, else args.mxlfile is parsed
+    :return: list of the files written to the output folder
+    """
+    SongSectionValues.output_files = []
+    score_profiles.clear()
+    melody_xml_templates.clear()
+    SongSectionValues.key_finder_offset_chords_1_beat = []
+    SongSectionValues.key_finder_offset_chords_2_beat = []
+    SongSectionValues.key_finder_offset_chords_1_bar = []
+    SongSectionValues.key_finder_offset_chords_2_bar = []
+    SongSectionValues.key_finder_offset_chords_4_bar = []
 
     # Print all arguments
     print("All argument values:")
@@ -3709,7 +3808,7 @@ def main():
     if args.bar_pitch_class is not None:
         if args.mxlfile is None:
             print("Error: --mxlfile argument is required.")
-            parser.print_help()
+            get_argument_parser().print_help()
             sys.exit(1)
         print("Input file fully qualified      :", args.mxlfile)
 
@@ -3717,16 +3816,21 @@ def main():
         # In a real implementation, you would extract the pitch class from the specified bar.
         print("Pitch classes for bar", args.bar_pitch_class, ":", pitch_class)
                 # Display pitches in the pitch class
-        pitches = display_pitches_in_pitch_class(pitch_class)
+        pitches = display_pitches_in_pitch_class(pitch_class_to_mask(pitch_class)) if pitch_class else []
         print(f'Pitches in pitch class: {pitches}')
-        sys.exit(0)
+        return SongSectionValues.output_files
 
     # Handle pitch_class lookup mode
     if args.pitch_class is not None:
         print(f'Pitch class lookup mode: {args.pitch_class}')
         
         # Display pitches in the pitch class
-        pitches = display_pitches_in_pitch_class(args.pitch_class)
+        try:
+            pitch_class_mask = pitch_class_to_mask(args.pitch_class)
+        except ValueError as e:
+            print(f'Error looking up pitch class: {e}')
+            sys.exit(1)
+        pitches = display_pitches_in_pitch_class(pitch_class_mask)
         print(f'Pitches in pitch class: {pitches}')
         
         pitch_to_chord_files = [f for f in os.listdir(INPUT_STYLE_PATH) if f.endswith('.json')]
@@ -3740,12 +3844,12 @@ def main():
                 input_pitch_to_chord_fully_qualified = INPUT_STYLE_PATH + pitch_to_chord_file
                 print(f'Loading: {input_pitch_to_chord_fully_qualified}')
                 
-                pitch_to_chord = load_json(input_pitch_to_chord_fully_qualified)
+                pitch_to_chord = load_style(input_pitch_to_chord_fully_qualified)
                 
                 try:
                     # chord chosen by rank (existing behaviour)
                     chord_rank = get_chord_for_pitch_class(
-                        args.pitch_class,
+                        pitch_class_mask,
                         pitch_to_chord,
                         pitch_to_chord_file,
                         Chord_Choice.RANK,
@@ -3753,7 +3857,7 @@ def main():
                     )
                     # also show chord for nth_outcome (example with number=0)
                     chord_nth0 = get_chord_for_pitch_class(
-                        args.pitch_class,
+                        pitch_class_mask,
                         pitch_to_chord,
                         pitch_to_chord_file,
                         Chord_Choice.NTH_OUTCOME,
@@ -3782,7 +3886,8 @@ def main():
                     print('No matching chords found for these pitches.')
                 # -------------------------------------------------
 
-                sys.exit(0)
+                save_chord_symbols()
+                return SongSectionValues.output_files
         
         if not found_match:
             print(f'No style file found containing: {args.style}')
@@ -3815,7 +3920,7 @@ def main():
     # SongSectionValues.offsets = args.offsets
     # If `offsets` was an old feature or not actually required, then modify the line:
     # to safely handle the case where it doesn’t exist:
-    SongSectionValues.offsets = getattr(args, "offsets", [0.0])
+    SongSectionValues.offsets = getattr(args, "offsets", None)
 
     if SongSectionValues.offsets != None:
         print('offsets : -o',SongSectionValues.offsets)
@@ -3826,7 +3931,8 @@ def main():
         print('Transpose : -t',SongSectionValues.transpose)
 
     # read mxl
-    raw_song = music21.converter.parse(args.mxlfile)
+    if raw_song is None:
+        raw_song = parse_score(args.mxlfile)
     # raw_song.show('text')
     # raw_song.show()
     # measureStack = raw_song.measures(0, 2)
@@ -3880,17 +3986,18 @@ def main():
         the_interval3 = get_transpose_information('post-transpose (no normalisation)', a_song)
 
     # Continue normally
-    song_key = a_song.analyze('key')
+    song_key = get_score_profile(a_song).get_key()
 
     # Only create transposed placeholder files if auto-transpose IS enabled ---
     if args.auto_transpose:
         print("Auto-transpose enabled → write mxlfile_normalised_name_path, song_without_chords midi.")
 
-        first_note, last_note = get_first_last_note_names(a_song)
+        first_note, last_note = get_score_profile(a_song).get_first_last_note_names()
         #mxlfile_normalised_name_path = update_filename_with_range(mxlfile_normalised_name_path, first_note, last_note)
 
         # write normalised stream
         a_song.write(OUTPUT_FORMAT, fp=mxlfile_normalised_name_path) # write normalised score to musicxml file
+        SongSectionValues.output_files.append(mxlfile_normalised_name_path)
 
         # write midi melody e.g. for using in JJazzLab
         midifile_normalised_name = os.path.splitext(mxlfile_basename)[0] + f'_transposed.mid'
@@ -3902,6 +4009,7 @@ def main():
         #midifile_normalised_name_path = update_filename_with_range(midifile_normalised_name_path, first_note, last_note)
 
         song_without_chords.write("midi", fp=midifile_normalised_name_path)
+        SongSectionValues.output_files.append(midifile_normalised_name_path)
 
     else:
         print("Auto-transpose disabled ? NOT creating placeholder .musicxml or .mid files.")
@@ -3933,11 +4041,19 @@ def main():
            
             print('')
 
-            generate_from_placeholder_chords(a_song, song_key, args.instrument, mxlfile_basename, args.chord_choice, args.number, args.style)
+            variants = None
+            if args.sweep is not None:
+                variants = [(sweep_chord_choice, sweep_number, sweep_instrument if sweep_instrument is not None else args.instrument)
+                            for sweep in args.sweep for sweep_chord_choice, sweep_number, sweep_instrument in sweep]
+                print('sweep variants', len(variants), variants)
+
+            generate_from_placeholder_chords(a_song, song_key, args.instrument, mxlfile_basename, args.chord_choice, args.number, args.style, variants, args.jobs)
 
         else: # not has_chord_symbols
 
             print('    not has_chord_symbols')
+            if args.sweep is not None:
+                print('Warning: --sweep is only used with input music that has placeholder chords, ignored.')
             print('    input music has no placeholder chords .............................................................')
 
             analysis_choice = 'Krumhansl'
@@ -4004,54 +4120,8 @@ def main():
                 print('In MuseScore, to create staff text choose a location by selecting a note or rest and then use the menu option Add > Text > Staff Text, or use the shortcut Ctrl+T.')
 
             else:
-                # at end of song strip final comma and add }
-                SongSectionValues.song_offset_chord_1_beat = remove_suffix(SongSectionValues.song_offset_chord_1_beat, ',') + '}'
-                SongSectionValues.song_offset_chord_2_beat = remove_suffix(SongSectionValues.song_offset_chord_2_beat, ',') + '}'
-                SongSectionValues.song_offset_chord_1_bar = remove_suffix(SongSectionValues.song_offset_chord_1_bar, ',') + '}'
-                SongSectionValues.song_offset_chord_2_bar = remove_suffix(SongSectionValues.song_offset_chord_2_bar, ',') + '}'
-                SongSectionValues.song_offset_chord_4_bar = remove_suffix(SongSectionValues.song_offset_chord_4_bar, ',') + '}'
-
                 song_section_values.print_class_variable()
 
-                # convert string to dictionary using ast.literal_eval() method
-                # ast.literal_eval: Safely evaluate an expression node or a string containing a Python literal or container display.
-                # The string or node provided may only consist of the following Python literal structures:
-                # strings, bytes, numbers, tuples, lists, dicts, sets, booleans, None, bytes and sets.
-                try:
-                    SongSectionValues.song_offset_chord_1_beat = ast.literal_eval(SongSectionValues.song_offset_chord_1_beat)
-                except BaseException as err:
-                    print(f"Unexpected {err=}, {type(err)=}")
-                    print('exit: Error song_offset_chord_1_beat', SongSectionValues.song_offset_chord_1_beat)
-                    sys.exit()
-
-                try:
-                    SongSectionValues.song_offset_chord_2_beat = ast.literal_eval(SongSectionValues.song_offset_chord_2_beat)
-                except BaseException as err:
-                    print(f"Unexpected {err=}, {type(err)=}")
-                    print('exit: Error song_offset_chord_2_beat', SongSectionValues.song_offset_chord_2_beat)
-                    sys.exit()
-
-                try:
-                    SongSectionValues.song_offset_chord_1_bar = ast.literal_eval(SongSectionValues.song_offset_chord_1_bar)
-                except BaseException as err:
-                    print(f"Unexpected {err=}, {type(err)=}")
-                    print('exit: Error song_offset_chord_1_bar', SongSectionValues.song_offset_chord_1_bar)
-                    sys.exit()
-
-                try:
-                    SongSectionValues.song_offset_chord_2_bar = ast.literal_eval(SongSectionValues.song_offset_chord_2_bar)
-                except BaseException as err:
-                    print(f"Unexpected {err=}, {type(err)=}")
-                    print('exit: Error song_offset_chord_2_bar', SongSectionValues.song_offset_chord_2_bar)
-                    sys.exit()
-
-                try:
-                    SongSectionValues.song_offset_chord_4_bar = ast.literal_eval(SongSectionValues.song_offset_chord_4_bar)
-                except BaseException as err:
-                    print(f"Unexpected {err=}, {type(err)=}")
-                    print('exit: Error song_offset_chord_4_bar', SongSectionValues.song_offset_chord_4_bar)
-                    sys.exit()
-
                 # append to lists of the key finder offset chord dictionaries
                 SongSectionValues.key_finder_offset_chords_1_beat.append(SongSectionValues.song_offset_chord_1_beat)
                 SongSectionValues.key_finder_offset_chords_2_beat.append(SongSectionValues.song_offset_chord_2_beat)
@@ -4068,6 +4138,8 @@ def main():
             print('produce chord output with placeholder chords 1 per bar ON_KEY_MOST')
             chord_output = Chord_Output.ON_KEY_MOST
 
+            offset_chords = []
+            output_filenames = []
             # harmonic_rhythm = Harmonic_Rhythm.BAR1
             for harmonic_rhythm in Harmonic_Rhythm:  # e.g. BEAT1, BEAT2, BAR1 etc
 
@@ -4081,7 +4153,21 @@ def main():
                 offset_chord = get_offset_chord(chord_output, harmonic_rhythm)
                 # print('offset_chord', offset_chord)
                 SongSectionValues.last_bass = 'C'
-                song_section_values.write_chords(mxlfile_basename, offset_chord, output_filename)
+                if args.jobs == 1:
+                    song_section_values.write_chords(mxlfile_basename, offset_chord, output_filename)
+                else:
+                    offset_chords.append(offset_chord)
+                    output_filenames.append(output_filename)
+
+            if args.jobs > 1:
+                # the chords of each harmonic rhythm are known, so build and write the scores in a pool of worker processes
+                print('writing', len(output_filenames), 'harmonic rhythms with', args.jobs, 'jobs')
+                with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs, initializer=init_writer,
+                                                            initargs=(get_writer_state(song_section_values),)) as executor:
+                    for output_files, log in executor.map(write_chords_logged, [mxlfile_basename] * len(output_filenames),
+                                                          offset_chords, output_filenames):
+                        print(log, end='')
+                        SongSectionValues.output_files.extend(output_files)
 
             print('')
             print('Now in Musescore, open output file', output_filename)
@@ -4092,6 +4178,9 @@ def main():
             print('     Enter chord symbol e.g. C  Exit chord symbol mode by pressing Esc.')
             print('')
 
+    save_chord_symbols()
+    return SongSectionValues.output_files
+
 if __name__ == '__main__':
 
     main()
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# VeeHarmGen_server.py
+#
+# Runs VeeHarmGen as a long-running local server, so music21, the style files and the parsed melodies
+# stay loaded between requests instead of being reloaded by every VeeHarmGen.py run.
+#
+# A request is a JSON object POSTed to http://127.0.0.1:8061/harmonise with fields named after the
+# VeeHarmGen.py long options e.g.
+#
+#     {"mxlfile": "input/music/Cairo.mxl"}
+#     {"mxlfile": "output/Cairo-BAR1.musicxml", "chord_choice": "rank", "number": 90, "style": "jazz", "instrument": "Clarinet"}
+#
+# The response is a JSON object e.g.
+#
+#     {"status": "ok", "output_files": ["output/Cairo-jazz-_-ptc-ran-90-v01.musicxml"], "seconds": 1.2}
+#
+# Optional request fields:
+#     "musicxml": uncompressed MusicXML text of the melody, used instead of reading mxlfile,
+#                 with "mxlfile" then only naming the output files e.g. "my_song.musicxml"
+#     "return_scores": true to also return the content of the output files (base64 for .mxl and .mid)
+#     "log": true to also return the VeeHarmGen print output
+#
+# A list field is passed as several values e.g. {"mxlfile": "output/Cairo-BAR1.musicxml", "sweep": ["rank:90,80", "nth_outcome:0-3"]}
+# and "jobs" writes the output files in that many worker processes e.g. {"mxlfile": "input/music/Cairo.mxl", "jobs": 4}
+#
+# GET http://127.0.0.1:8061/status returns the server version, request count and what is loaded.
+#
+# Start the server:
+#
+#     python VeeHarmGen_server.py
+#
+# Send a request to a running server and print the response:
+#
+#     python VeeHarmGen_server.py -r "{\"mxlfile\": \"input/music/music.mxl\"}"
+#
+# Requests are handled one at a time, as VeeHarmGen keeps the song being harmonised in class variables.
+#
+# free and open-source software, Paul Wardley Davies, see license.txt
+
+# usage: VeeHarmGen_server.py [-h] [-H HOST] [-p PORT] [-r REQUEST] [-v]
+#
+# optional arguments:
+#   -h, --help            show this help message and exit
+#   -H HOST, --host HOST  host to serve on, or of the server to send a request to. Default is 127.0.0.1
+#   -p PORT, --port PORT  port to serve on, or of the server to send a request to. Default is 8061
+#   -r REQUEST, --request REQUEST
+#                         send the JSON REQUEST to a running server, print the response and exit
+#   -v, --version         show program's version number and exit
+
+
+# standard libraries
+import argparse
+import base64
+import collections
+import contextlib
+import hashlib
+import http.server
+import io
+import json
+import music21
+import os
+import sys
+import time
+import traceback
+import urllib.error
+import urllib.request
+import VeeHarmGen
+import VeeHarmGen_utilities
+
+from VeeHarmGen_utilities import *
+
+SERVER_VERSION = '1.0.0'
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8061
+MAX_PARSED_SONGS = 8  # the least recently used parsed melody is dropped above this many
+
+# request field: VeeHarmGen.py option
+REQUEST_ARGUMENTS = {
+    'auto_transpose': '--auto-transpose',
+    'bar_pitch_class': '--bar-pitch-class',
+    'chord_choice': '--chord_choice',
+    'instrument': '--instrument',
+    'jobs': '--jobs',
+    'mxlfile': '--mxlfile',
+    'number': '--number',
+    'out_format': '--out-format',
+    'pitch_class': '--pitch_class',
+    'style': '--style',
+    'sweep': '--sweep',
+    'transpose': '--transpose',
+}
+REQUEST_OPTIONS = ['log', 'musicxml', 'return_scores']
+
+parsed_songs = collections.OrderedDict()  # (modification time or content hash, music21 score) by melody, least recently used first, see get_song
+server_state = {'started': time.time(), 'requests': 0}
+
+
+def get_argv(request):
+    """
+    convert a request into VeeHarmGen.py command line arguments
+    :param request: e.g. {'mxlfile': 'output/music-BAR1.musicxml', 'number': 90, 'auto_transpose': True}
+    :return: argv e.g. ['--mxlfile', 'output/music-BAR1.musicxml', '--number', '90', '--auto-transpose']
+    """
+    argv = []
+    for field, value in request.items():
+        if field in REQUEST_OPTIONS:
+            continue
+        if field not in REQUEST_ARGUMENTS:
+            raise ValueError('unknown request field ' + field + ', expected one of ' + ', '.join(list(REQUEST_ARGUMENTS) + REQUEST_OPTIONS))
+        if field == 'auto_transpose':
+            if value:
+                argv.append(REQUEST_ARGUMENTS[field])
+        elif isinstance(value, list):
+            # e.g. 'sweep': ['rank:90,80', 'nth_outcome:0-3']
+            argv.append(REQUEST_ARGUMENTS[field])
+            argv.extend(str(item) for item in value)
+        elif value is not None:
+            argv.append(REQUEST_ARGUMENTS[field])
+            argv.append(str(value))
+    return argv
+
+
+def get_song(mxlfile, musicxml=None):
+    """
+    parse a melody, reusing the score already parsed while the melody is unchanged.
+    The score is shared by every request for the melody, not copied, as harmonise only reads it
+    (transpose, normalise_song and add_RehearsalMark build new streams)
+    :param mxlfile: melody file e.g. input/music/music.mxl
+    :param musicxml: optional MusicXML text of the melody, used instead of reading mxlfile
+    :return: the parsed score, not to be modified
+    """
+    if musicxml is not None:
+        song_key = 'musicxml'
+        version = hashlib.sha1(musicxml.encode('utf-8')).hexdigest()
+    else:
+        song_key = os.path.abspath(mxlfile)
+        version = os.path.getmtime(mxlfile)
+    if song_key not in parsed_songs or parsed_songs[song_key][0] != version:
+        if musicxml is not None:
+            a_song = music21.converter.parseData(musicxml, format='musicxml')
+        else:
+            a_song = parse_score(mxlfile)
+        parsed_songs[song_key] = (version, a_song)
+        if len(parsed_songs) > MAX_PARSED_SONGS:
+            parsed_songs.popitem(last=False)
+    parsed_songs.move_to_end(song_key)
+    return parsed_songs[song_key][1]
+
+
+def get_scores(output_files):
+    """
+    :param output_files: list of files written e.g. ['output/music-BAR1.musicxml']
+    :return: list of the file contents e.g. [{'file': 'output/music-BAR1.musicxml', 'encoding': 'utf-8', 'content': '<?xml ...'}]
+    """
+    scores = []
+    for output_file in output_files:
+        with open(output_file, 'rb') as openfile:
+            content = openfile.read()
+        if output_file.endswith('.musicxml'):
+            scores.append({'file': output_file, 'encoding': 'utf-8', 'content': content.decode('utf-8')})
+        else:
+            scores.append({'file': output_file, 'encoding': 'base64', 'content': base64.b64encode(content).decode('ascii')})
+    return scores
+
+
+def harmonise_request(request):
+    """
+    run VeeHarmGen for one request
+    :param request: dict of request fields, see the top of this file
+    :return: (http status, response dict)
+    """
+    start = time.time()
+    server_state['requests'] += 1
+    log = io.StringIO()
+    response = {}
+    http_status = 200
+    try:
+        if not isinstance(request, dict):
+            raise ValueError('request must be a JSON object')
+        argv = get_argv(request)
+        with contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            args = VeeHarmGen.get_argument_parser().parse_args(argv)
+            raw_song = None
+            if args.bar_pitch_class is None and args.pitch_class is None:
+                raw_song = get_song(args.mxlfile, request.get('musicxml'))
+            output_files = VeeHarmGen.harmonise(args, raw_song)
+        response['status'] = 'ok'
+        response['output_files'] = output_files
+        if request.get('return_scores'):
+            response['scores'] = get_scores(output_files)
+    except SystemExit as e:
+        # argparse or VeeHarmGen exit on an error, the reason is in the log
+        http_status = 400
+        response['status'] = 'error'
+        response['error'] = 'exit ' + str(e.code) + ': ' + ' '.join(line.strip() for line in log.getvalue().strip().splitlines()[-2:])
+    except (ValueError, OSError) as e:
+        http_status = 400
+        response['status'] = 'error'
+        response['error'] = str(e)
+    except Exception as e:
+        http_status = 500
+        response['status'] = 'error'
+        response['error'] = traceback.format_exc()
+    response['seconds'] = round(time.time() - start, 3)
+    if isinstance(request, dict) and request.get('log'):
+        response['log'] = log.getvalue()
+    print('request', server_state['requests'], response['status'], response['seconds'], 's', response.get('output_files', response.get('error')))
+    return http_status, response
+
+
+def get_status():
+    """
+    :return: dict of the server version, uptime, request count and loaded styles and songs
+    """
+    return {
+        'status': 'ok',
+        'version': SERVER_VERSION,
+        'VeeHarmGen': VeeHarmGen.__version__,
+        'uptime_seconds': round(time.time() - server_state['started'], 3),
+        'requests': server_state['requests'],
+        'loaded_styles': sorted(VeeHarmGen_utilities.loaded_styles),
+        'parsed_songs': sorted(parsed_songs),
+    }
+
+
+class HarmonisationRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    handles GET /status and POST /harmonise
+    """
+
+    def send_json(self, http_status, response):
+        """
+        :param http_status: e.g. 200
+        :param response: dict sent as the JSON body
+        """
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(http_status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/status':
+            self.send_json(200, get_status())
+        else:
+            self.send_json(404, {'status': 'error', 'error': 'unknown path ' + self.path + ', expected /status'})
+
+    def do_POST(self):
+        if self.path != '/harmonise':
+            self.send_json(404, {'status': 'error', 'error': 'unknown path ' + self.path + ', expected /harmonise'})
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+        except ValueError as e:
+            self.send_json(400, {'status': 'error', 'error': 'request is not JSON: ' + str(e)})
+            return
+        http_status, response = harmonise_request(request)
+        self.send_json(http_status, response)
+
+
+def load_styles():
+    """
+    load every style file in INPUT_STYLE_PATH, so the first requests do not wait for them
+    """
+    pitch_to_chord_files = [f for f in os.listdir(INPUT_STYLE_PATH) if f.endswith('.json')]
+    for pitch_to_chord_file in pitch_to_chord_files:
+        load_style(INPUT_STYLE_PATH + pitch_to_chord_file)
+    print('loaded', len(pitch_to_chord_files), 'styles from', INPUT_STYLE_PATH)
+
+
+def send_request(host, port, request):
+    """
+    send a request to a running server
+    :param host: e.g. 127.0.0.1
+    :param port: e.g. 8061
+    :param request: JSON text of the request
+    :return: the response dict
+    """
+    url = 'http://' + host + ':' + str(port) + '/harmonise'
+    http_request = urllib.request.Request(url, data=request.encode('utf-8'), headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(http_request) as http_response:
+            return json.loads(http_response.read().decode('utf-8'))
+    except urllib.error.HTTPError as e:
+        return json.loads(e.read().decode('utf-8'))
+
+
+def main():
+    """
+    get command line arguments
+    if a request is given: send it to the running server and print the response
+    else: load the styles and serve requests until interrupted
+    """
+    # Specify command line arguments.
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-H', '--host',
+                        help='host to serve on, or of the server to send a request to. Default is ' + DEFAULT_HOST,
+                        default=DEFAULT_HOST,
+                        type=str)
+    parser.add_argument('-p', '--port',
+                        help='port to serve on, or of the server to send a request to. Default is ' + str(DEFAULT_PORT),
+                        default=DEFAULT_PORT,
+                        type=int)
+    parser.add_argument('-r', '--request',
+                        help='send the JSON REQUEST to a running server, print the response and exit '
+                             'e.g. "{\\"mxlfile\\": \\"input/music/music.mxl\\"}"',
+                        default=None,
+                        type=str)
+    parser.add_argument('-v', '--version', action='version',
+                        version='%(prog)s {version}'.format(version=SERVER_VERSION))
+
+    # Parse command line arguments.
+    args = parser.parse_args()
+
+    if args.request is not None:
+        try:
+            response = send_request(args.host, args.port, args.request)
+        except urllib.error.URLError as e:
+            print('exit: Error no server at', args.host, args.port, e.reason)
+            sys.exit(1)
+        print(json.dumps(response, indent=2))
+        if response.get('status') != 'ok':
+            sys.exit(1)
+        return
+
+    print('VeeHarmGen server v', SERVER_VERSION, 'VeeHarmGen v', VeeHarmGen.__version__)
+    load_styles()
+    server = http.server.HTTPServer((args.host, args.port), HarmonisationRequestHandler)
+    print('serving on http://' + args.host + ':' + str(args.port) + ' POST /harmonise GET /status, Ctrl+C to stop')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('')
+        print('stopped')
+    server.server_close()
+
+
+if __name__ == '__main__':
+
+    main()
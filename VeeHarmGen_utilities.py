@@ -6,20 +6,61 @@
 #
 # free and open-source software, Paul Wardley Davies, see license.txt
 
+import argparse
+import bisect
+import copy
+import gzip
+import hashlib
+import io
 import json
+import mmap
 import music21
+import numpy
+import operator
 import os
+import pickle
+import struct
 import sys
+import time
+import xml.etree.ElementTree
+import zipfile
 
+from collections.abc import Mapping
 from enum import Enum
+from fractions import Fraction
 from music21 import *
+from xml.sax.saxutils import escape
 
 INPUT_STYLE_PATH = 'input/style/'
 INPUT_STYLE_PITCH_TO_CHORD_PATH = 'input/style/pitch_to_chord/'
 NO_CHORD_DISPLAY_PITCH_CLASSES = '0000 0000 0000'
+NO_CHORD_PITCH_CLASS_MASK = 0 # pitch class mask of NO_CHORD_DISPLAY_PITCH_CLASSES, see pitch_class_to_mask
 PITCH_TO_CHORD_PRE_EXTENSION = '-_-ptc'
 JSON_EXTENSION = '.json'
 PITCH_TO_CHORD_FILENAME_ENDING = PITCH_TO_CHORD_PRE_EXTENSION + JSON_EXTENSION
+STYLE_CACHE_PATH = 'cache/style/'
+COMPILED_STYLE_EXTENSION = '.vhgs'
+COMPILED_STYLE_MAGIC = b'VHGSTY01'
+# magic, json modification time ns, json size, json sha1, number of masks, chords, chord names and chord name bytes
+COMPILED_STYLE_HEADER = struct.Struct('<8sqq20sIIII')
+CHORD_SYMBOL_CACHE_EXTENSION = '.chords.p.gz'
+SCORE_CACHE_PATH = 'cache/score/'
+SCORE_CACHE_EXTENSION = '.p.gz'
+SCORE_CACHE_MAX_BYTES = 256 * 1024 * 1024  # least recently used cached scores are removed above this total size
+SCORE_CACHE_MAX_AGE = 30 * 24 * 60 * 60  # cached scores unused for this many seconds are removed
+# correlations closer than this to the runner-up (or to a flat histogram) are left to music21 to decide
+KEY_FINDER_TOLERANCE = 1e-9
+MUSICXML_DIVISIONS = 10080  # divisions of a quarter note written by MelodyXMLWriter, as music21 writes
+MUSICXML_HARMONY_SLOT = '\x00'  # where a <harmony> may go in a melody template, see get_melody_xml_template
+MUSICXML_ACCIDENTALS = {-2: 'flat-flat', -1: 'flat', 0: 'natural', 1: 'sharp', 2: 'double-sharp'}  # by alter
+MUSICXML_BEAM_TYPES = {'start': 'begin', 'continue': 'continue', 'stop': 'end', 'right': 'forward hook', 'left': 'backward hook'}
+MXL_CONTAINER = '''<?xml version="1.0" encoding="UTF-8"?>
+<container>
+  <rootfiles>
+    <rootfile full-path="{}"/>
+  </rootfiles>
+</container>
+    '''  # META-INF/container.xml of an .mxl, as music21 writes
 # MIN_PITCH_CLASSES_PER_SLICE = 3
 
 class Chord_Choice(Enum):
@@ -30,6 +71,239 @@ class Chord_Choice(Enum):
     def __str__(self):
         return self.value
         
+class MelodyEvent:
+    """
+    a note or rest of a melody with just what the analysis uses, so the analysis reads plain attributes
+    instead of music21 objects; the music21 note or rest is kept in element for reading and writing streams
+    e.g. MelodyEvent.from_note(n, 'verse 1')
+    """
+    __slots__ = ('offset', 'duration', 'ps', 'pitch_class', 'tie', 'section', 'element')
+
+    def __init__(self, offset, duration, ps, pitch_class, tie, section, element):
+        """
+        :param offset: e.g. 4.0
+        :param duration: quarterLength e.g. 1.0 or Fraction(1, 3)
+        :param ps: pitch space (MIDI number) e.g. 60.0, None for a rest
+        :param pitch_class: e.g. 0 for C, -1 for a rest
+        :param tie: tie type e.g. 'start', or None
+        :param section: section name e.g. 'verse 1', or None
+        :param element: the music21 note or rest
+        """
+        self.offset = offset
+        self.duration = duration
+        self.ps = ps
+        self.pitch_class = pitch_class
+        self.tie = tie
+        self.section = section
+        self.element = element
+
+    @classmethod
+    def from_note(cls, n, section=None):
+        """
+        :param n: music21 note or rest, at its offset in the stream it was last added to
+        :param section: section name e.g. 'verse 1', or None
+        :return: MelodyEvent of n
+        """
+        if type(n) == music21.note.Note:
+            return cls(n.offset, n.duration.quarterLength, n.pitch.ps, n.pitch.pitchClass,
+                       n.tie.type if n.tie is not None else None, section, n)
+        return cls(n.offset, n.duration.quarterLength, None, -1, None, section, n)
+
+    def is_note(self):
+        """
+        :return: True for a note, False for a rest
+        """
+        return self.pitch_class >= 0
+
+
+def get_melody_events(a_stream):
+    """
+    :param a_stream: e.g. a stream of only notes and rests
+    :return: MelodyEvent of each note and rest in the order (and at the offsets) of a_stream.flatten()
+    """
+    return [MelodyEvent.from_note(n) for n in a_stream.flatten()
+            if type(n) == music21.note.Note or type(n) == music21.note.Rest]
+
+
+class NoteIndex:
+    """
+    offset ordered table of the notes and rests of a melody
+    built once, so a slice of the melody by offset is a bisect rather than a scan of the whole stream
+    e.g. note_index = NoteIndex(get_melody_events(stream1))
+         sub_stream = note_index.get_stream(4.0, 8.0)
+    """
+
+    def __init__(self, events):
+        """
+        index the notes and rests of a melody
+        :param events: MelodyEvent of each note and rest, in offset order e.g. get_melody_events(stream1)
+        """
+        self.offsets = [event.offset for event in events]  # offset of each indexed note / rest, non-decreasing
+        self.elements = [event.element for event in events]  # the note / rest at the same position in offsets
+        # pitch class of each note, -1 for a rest
+        self.pitch_classes = numpy.array([event.pitch_class for event in events], dtype=int)
+        # quarterLength of each note / rest
+        self.durations = numpy.array([float(event.duration) for event in events], dtype=float)
+        self.length = len(events)
+
+        # running totals so the pitch class histogram of any offset range is the difference of two rows:
+        # cumulative_histograms[i] is the duration weighted pitch class histogram of the first i notes / rests
+        is_note = self.pitch_classes >= 0
+        note_histograms = numpy.zeros((len(self.elements), 12))
+        note_histograms[numpy.flatnonzero(is_note), self.pitch_classes[is_note]] = self.durations[is_note]
+        self.cumulative_histograms = numpy.zeros((len(self.elements) + 1, 12))
+        numpy.cumsum(note_histograms, axis=0, out=self.cumulative_histograms[1:])
+        self.cumulative_note_counts = numpy.zeros(len(self.elements) + 1, dtype=int)
+        numpy.cumsum(is_note, out=self.cumulative_note_counts[1:])
+
+    def get_range(self, start_note_offset, end_note_offset):
+        """
+        :param start_note_offset: offsets >= this included
+        :param end_note_offset: offsets < this included
+        :return: first, last + 1 positions in offsets / elements
+        """
+        first = bisect.bisect_left(self.offsets, start_note_offset)
+        last = bisect.bisect_left(self.offsets, end_note_offset, first)
+        return first, last
+
+    def get_stream(self, start_note_offset, end_note_offset):
+        """
+        :param start_note_offset: offsets >= this included in stream
+        :param end_note_offset: offsets < this included in stream
+        :return: stream of the notes and rests in the offset range
+        """
+        sub_stream = stream.Stream()
+        first, last = self.get_range(start_note_offset, end_note_offset)
+        for n in self.elements[first:last]:
+            sub_stream.append(n)
+
+        return sub_stream
+
+    def get_pitch_class_mask(self, start_note_offset, end_note_offset):
+        """
+        :param start_note_offset: offsets >= this included
+        :param end_note_offset: offsets < this included
+        :return: pitch class mask of the notes in the offset range e.g. 0b100010010000, 0 if there are no notes
+        """
+        first, last = self.get_range(start_note_offset, end_note_offset)
+        mask = 0
+        for pitch_class in set(self.pitch_classes[first:last].tolist()):
+            if pitch_class >= 0:
+                mask |= 1 << (11 - pitch_class)
+
+        return mask
+
+    def get_pitch_class_histograms(self, window_starts, window_ends):
+        """
+        duration weighted pitch class histogram of the notes in each window, as music21 key analysis counts them
+        :param window_starts: for each window, offsets >= this included
+        :param window_ends: for each window, offsets < this included
+        :return: histograms e.g. array([[3.0, 0, 0, 0, 0, 0, 2.0, 0, 0, 0, 0, 0], ...]) one row per window,
+                 has_note e.g. array([True, ...]) False where the window has only rests (or nothing)
+        """
+        firsts = []
+        lasts = []
+        for start_note_offset, end_note_offset in zip(window_starts, window_ends):
+            first, last = self.get_range(start_note_offset, end_note_offset)
+            firsts.append(first)
+            lasts.append(last)
+        histograms = self.cumulative_histograms[lasts] - self.cumulative_histograms[firsts]
+        has_note = (self.cumulative_note_counts[lasts] - self.cumulative_note_counts[firsts]) > 0
+
+        return histograms, has_note
+
+
+class KeyFinder:
+    """
+    music21 key weight analysis (Krumhansl, Aarden, Bellman, Simple or Temperley) of many pitch class histograms at once:
+    each histogram is correlated with the 24 rotated major and minor key profiles in one matrix product
+    e.g. key_names = get_key_finder('Krumhansl').get_key_names(histograms)
+    """
+
+    def __init__(self, analyze_choice):
+        """
+        :param analyze_choice: music21 analysis method name e.g. 'Krumhansl'
+        """
+        analysis_class = music21.analysis.discrete.analysisClassFromMethodName(analyze_choice)
+        if analysis_class is None or not issubclass(analysis_class, music21.analysis.discrete.KeyWeightKeyAnalysis):
+            print('KeyFinder exit: not a key weight analysis', analyze_choice)
+            sys.exit()
+        analysis_object = analysis_class()
+
+        self.key_names = []  # key name of each profile e.g. 'C major' ... 'b minor'
+        centred_profiles = []
+        for mode, keys_valid in (('major', analysis_class.keysValidMajor), ('minor', analysis_class.keysValidMinor)):
+            weights = numpy.array(analysis_object.getWeights(mode), dtype=float)
+            for pitch_class in range(12):
+                # profile[j] = weights[(j - pitch_class) % 12]
+                profile = numpy.roll(weights, pitch_class)
+                centred_profiles.append(profile - (sum(weights) / len(weights)))
+                # spell the tonic as music21 does
+                tonic = pitch.Pitch(pitch_class)
+                if tonic.name not in keys_valid:
+                    tonic.getEnharmonic(inPlace=True)
+                self.key_names.append(key.Key(tonic, mode).name)
+        self.centred_profiles = numpy.array(centred_profiles)
+        self.profile_norms = numpy.sqrt((self.centred_profiles ** 2).sum(axis=1))
+
+    def get_key_names(self, histograms):
+        """
+        :param histograms: duration weighted pitch class histograms, one row per window
+        :return: key name per histogram e.g. ['G major', 'e minor', None, ...]
+                 None where the best key is too close to call (or the histogram is flat),
+                 for the caller to analyze with music21, so results match stream.analyze exactly
+        """
+        if len(histograms) == 0:
+            return []
+        centred = histograms - histograms.mean(axis=1, keepdims=True)
+        histogram_norms = numpy.sqrt((centred ** 2).sum(axis=1))
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            coefficients = (centred @ self.centred_profiles.T) / (histogram_norms[:, None] * self.profile_norms[None, :])
+        best = numpy.argmax(coefficients, axis=1)
+        rows = numpy.arange(len(histograms))
+        best_coefficients = coefficients[rows, best]
+        coefficients[rows, best] = -numpy.inf
+        second_coefficients = coefficients.max(axis=1)
+        flat = histogram_norms <= KEY_FINDER_TOLERANCE * numpy.abs(histograms).sum(axis=1)
+        too_close = (best_coefficients - second_coefficients) < KEY_FINDER_TOLERANCE
+
+        key_names = []
+        for i in range(len(histograms)):
+            if flat[i] or too_close[i]:
+                key_names.append(None)
+            else:
+                key_names.append(self.key_names[best[i]])
+
+        return key_names
+
+
+key_finders = {}  # KeyFinder by analyze_choice, see get_key_finder
+
+
+def get_key_finder(analyze_choice):
+    """
+    :param analyze_choice: music21 analysis method name e.g. 'Krumhansl'
+    :return: KeyFinder for analyze_choice, built on first use
+    """
+    if analyze_choice not in key_finders:
+        key_finders[analyze_choice] = KeyFinder(analyze_choice)
+    return key_finders[analyze_choice]
+
+
+def positive_int(value):
+    """
+    Validates if the argument is an integer greater than or equal to 1.
+    """
+    try:
+        ivalue = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{value}' is not a valid integer.")
+    
+    if ivalue < 1:
+        raise argparse.ArgumentTypeError(f"'{value}' must be a positive integer (>= 1).")
+    return ivalue
+
+
 def calculate_pitch_class_match(pc1, pc2):
     """
     given two pitch_classes
@@ -110,10 +384,186 @@ def display_pitch_classes(pitch_classes):
 
     return pitch_classes_display
 
+def pitch_class_to_mask(pitch_class):
+    """
+    :param pitch_class: e.g. 1000 1001 0000 (C E G)
+    :return: 12 bit integer with C as the most significant bit e.g. 0b100010010000
+    """
+    bits = pitch_class.replace(' ', '')
+    if len(bits) != 12 or bits.strip('01') != '':
+        raise ValueError(f"'{pitch_class}' is not a pitch class of 12 bits e.g. 1000 1001 0000")
+    return int(bits, 2)
+
+
+def mask_to_pitch_class(mask):
+    """
+    :param mask: 12 bit integer with C as the most significant bit e.g. 0b100010010000
+    :return: pitch_class for json and display e.g. 1000 1001 0000
+    """
+    bits = format(mask, '012b')
+    return bits[:4] + ' ' + bits[4:8] + ' ' + bits[8:]
+
+
+def calculate_pitch_class_mask_matches(mask1, mask2):
+    """
+    given two pitch class masks
+    calculate how many bits match comparing all pitch classes and
+    comparing only the 1's in mask2
+    :param mask1: e.g. 0b101010000001
+    :param mask2: e.g. 0b001001000001
+    :return: matching_bits, matching_pc2_one_bits e.g. 9, 2
+    """
+    return 12 - bin(mask1 ^ mask2).count('1'), bin(mask1 & mask2).count('1')
+
+
+# number of pitch classes in each of the 4096 12 bit masks
+PITCH_CLASS_MASK_COUNT = numpy.array([bin(mask).count('1') for mask in range(4096)])
+
+
+class RankedChords(dict):
+    """
+    chords dictionary of a pitch class e.g. {'C': 2, 'Am7': 1, 'Am': 1}
+    with the choices of get_chord_from_pitch_to_chord_by_rank and get_chord_from_pitch_to_chord_by_nth_outcome
+    worked out once, so choosing a chord for a number is index arithmetic
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # rank order: frequency descending, equal frequencies in dictionary order e.g. [('C', 2), ('Am7', 1), ('Am', 1)]
+        self.rank_items = sorted(self.items(), key=operator.itemgetter(1), reverse=True)
+        # chord chosen at each rank position: the shortest chord (the first if equal) from there to the end of its frequency
+        # e.g. ['C', 'Am', 'Am']
+        self.rank_choices = [None] * len(self.rank_items)
+        for i in range(len(self.rank_items) - 1, -1, -1):
+            ch, f = self.rank_items[i]
+            self.rank_choices[i] = ch
+            if i + 1 < len(self.rank_items) and self.rank_items[i + 1][1] == f and len(self.rank_choices[i + 1]) < len(ch):
+                self.rank_choices[i] = self.rank_choices[i + 1]
+
+        # nth_outcome order: frequency descending, then shorter name, then name e.g. [('C', 2), ('Am', 1), ('Am7', 1)]
+        self.nth_outcome_items = sorted(self.items(), key=lambda it: (-it[1], len(it[0]), it[0]))
+        # chord chosen at each nth_outcome position: for its frequency, without '/' if possible, then shortest, then name
+        # e.g. ['C', 'Am', 'Am']
+        preferred = {}
+        for ch, f in self.nth_outcome_items:
+            if f not in preferred or ('/' in ch, len(ch), ch) < ('/' in preferred[f], len(preferred[f]), preferred[f]):
+                preferred[f] = ch
+        self.nth_outcome_choices = [preferred[f] for ch, f in self.nth_outcome_items]
+
+
+class PitchToChord(Mapping):
+    """
+    read only pitch_to_chord dictionary of a style e.g. {'1000 1001 0000': {'C': 2, 'Am7': 1}, '0010 0000 0000': {'F': 2, 'G': 1}}
+    held as arrays, in the order of the style json, which may be memory mapped from a compiled style file, see compile_style:
+        masks          pitch class mask of each key e.g. [0b100010010000, 0b001000000000]
+        chord_starts   position in chord_ids / chord_counts of the first chord of each key, and of the end e.g. [0, 2, 4]
+        chord_ids      position in chord_names of each chord e.g. [0, 1, 2, 3]
+        chord_counts   frequency of each chord e.g. [2, 1, 2, 1]
+        chord_names    e.g. ['C', 'Am7', 'F', 'G']
+    A key's chords dictionary, with its rank and nth_outcome choices, is built on first use, and a table of the nearest mask for each of the 4096 possible masks
+    is built on first use, so get_nearest_chord_for_pitch_class is one lookup rather than a comparison with every key.
+    """
+
+    def __init__(self, masks, chord_starts, chord_ids, chord_counts, chord_names, name=''):
+        self.masks = masks
+        self.chord_starts = chord_starts
+        self.chord_ids = chord_ids
+        self.chord_counts = chord_counts
+        self.chord_names = chord_names
+        self.name = name
+        # position in masks of each of the 4096 possible masks, -1 if not in the style
+        self.positions = numpy.full(4096, -1)
+        self.positions[numpy.asarray(masks, dtype=int)] = numpy.arange(len(masks))
+        self.chords = {}  # chords dictionary by position, see get_chords
+        self.nearest_masks = None  # nearest pitch class mask in the style by pitch class mask, see get_nearest_mask
+
+    @classmethod
+    def from_json_object(cls, json_object, name=''):
+        """
+        :param json_object: pitch_to_chord e.g. {'1000 1001 0000': {'C': 2, 'Am7': 1}, '0010 0000 0000': {'F': 2, 'G': 1}}
+        :param name: e.g. input/style/pop-_-ptc.json
+        :return: PitchToChord
+        """
+        chord_ids_by_name = {}
+        masks = []
+        chord_starts = [0]
+        chord_ids = []
+        chord_counts = []
+        for k, v in json_object.items():
+            masks.append(pitch_class_to_mask(k))
+            for chord_name, count in v.items():
+                chord_ids.append(chord_ids_by_name.setdefault(chord_name, len(chord_ids_by_name)))
+                chord_counts.append(count)
+            chord_starts.append(len(chord_ids))
+        return cls(numpy.array(masks, dtype='<u2'), numpy.array(chord_starts, dtype='<u4'), numpy.array(chord_ids, dtype='<u4'),
+                   numpy.array(chord_counts, dtype='<u4'), list(chord_ids_by_name), name)
+
+    def __getitem__(self, pitch_class):
+        chords = self.get_chords(pitch_class_to_mask(pitch_class))
+        if chords is None:
+            raise KeyError(pitch_class)
+        return chords
+
+    def __iter__(self):
+        for mask in self.masks:
+            yield mask_to_pitch_class(int(mask))
+
+    def __len__(self):
+        return len(self.masks)
+
+    def __repr__(self):
+        return f'PitchToChord({self.name} {len(self)} pitch classes {len(self.chord_names)} chords)'
+
+    def get_chords(self, mask):
+        """
+        :param mask: pitch class mask e.g. 0b100010010000
+        :return: RankedChords of the mask e.g. {'C': 2, 'Am7': 1}, the same one each time, or None if not in the style
+        """
+        position = int(self.positions[mask])
+        if position < 0:
+            return None
+        if position not in self.chords:
+            start, end = int(self.chord_starts[position]), int(self.chord_starts[position + 1])
+            self.chords[position] = RankedChords((self.chord_names[chord_id], count) for chord_id, count in
+                                                 zip(self.chord_ids[start:end].tolist(), self.chord_counts[start:end].tolist()))
+        return self.chords[position]
+
+    def build_nearest_masks(self):
+        """
+        for every pitch class mask find the nearest mask in the style as get_nearest_chord_for_pitch_class would:
+        most matching 1's of the pitch class, then most matching bits, then highest first chord frequency,
+        with the first key in the style winning a tie
+        """
+        masks = self.masks.tolist()
+        frequencies = self.chord_counts[self.chord_starts[:-1]].tolist()
+        f_range = max(frequencies, default=0) + 1
+        queries = numpy.arange(4096)
+        best_scores = numpy.zeros(4096, dtype=numpy.int64)
+        best_masks = numpy.full(4096, -1)
+        for i, mask in enumerate(masks):
+            pc2_ones = PITCH_CLASS_MASK_COUNT[queries & mask]
+            matching_bits = 12 - PITCH_CLASS_MASK_COUNT[queries ^ mask]
+            # (pc2_ones, matching_bits, f) compared as one number, a key must beat the best so far to replace it
+            scores = (pc2_ones * 13 + matching_bits) * f_range + frequencies[i]
+            better = scores > best_scores
+            best_scores[better] = scores[better]
+            best_masks[better] = mask
+        self.nearest_masks = [int(mask) if mask >= 0 else None for mask in best_masks]
+
+    def get_nearest_mask(self, mask):
+        """
+        :param mask: pitch class mask e.g. 0b101010000001
+        :return: the nearest pitch class mask in the style e.g. 0b101010000000, or None if there is none
+        """
+        if self.nearest_masks is None:
+            self.build_nearest_masks()
+        return self.nearest_masks[mask]
+
+
 def get_nearest_chord_for_pitch_class(pitch_class, pitch_to_chord, output_filename):
     """
     given pitch_class and pitch_to_chord dictionary, return short chord (e.g. Am or C) at offset
-    :param pitch_class: e.g. 1010 1000 0001
+    :param pitch_class: pitch class mask e.g. 0b101010000001 (1010 1000 0001)
     :param pitch_to_chord : e.g. {1010 0000 0001': {'G': 1}, '0000 1100 0000': {'F': 1}, '1000 0000 0001': {'G': 1}, '1010 1100 0000': {'C': 1}, '0010 1100 0000': {'G': 1}, '1010 1101 0000': {'C': 1}, '0000 0100 0100': {'F': 1}, '0010 1000 0000': {'G': 1}}
     :param output_filename (used in printed warnings)
     :return: short_chord e.g. 'E'
@@ -128,6 +578,12 @@ def get_nearest_chord_for_pitch_class(pitch_class, pitch_to_chord, output_filena
 
     # print('get_nearest_chord_for_pitch_class(pitch_class, pitch_to_chord, output_filename)', pitch_class,
     #       pitch_to_chord, output_filename)
+    if isinstance(pitch_to_chord, PitchToChord):
+        nearest_mask = pitch_to_chord.get_nearest_mask(pitch_class)
+        if nearest_mask is None:
+            return None
+        return pitch_to_chord.get_chords(nearest_mask)
+
     last_matching_bits = 0
     last_matching_pc2_one_bits = 0
     last_f = 0
@@ -141,7 +597,9 @@ def get_nearest_chord_for_pitch_class(pitch_class, pitch_to_chord, output_filena
         # v2
         # matching_bits = calculate_pitch_class_match_pc2_1s_only(k,pitch_class )
         # v3
-        matching_bits, matching_pc2_one_bits = calculate_pitch_class_matches(k, pitch_class)
+        # matching_bits, matching_pc2_one_bits = calculate_pitch_class_matches(k, pitch_class)
+        # v4
+        matching_bits, matching_pc2_one_bits = calculate_pitch_class_mask_matches(pitch_class_to_mask(k), pitch_class)
         if matching_pc2_one_bits > last_matching_pc2_one_bits:
             print('k, chord, freq, matching_pc2_one_bits > last_matching_pc2_one_bits             ', k, ch, f, matching_pc2_one_bits, '>', last_matching_pc2_one_bits)
             last_matching_pc2_one_bits = matching_pc2_one_bits
@@ -212,6 +670,18 @@ def get_pitch_classes_in_stream(a_stream):
 
     return pitch_classes_string
 
+def get_pitch_class_mask_in_stream(a_stream):
+    """
+    for each note in the stream: set the bit of its pitch class
+    :param a_stream: e.g. the notes and rests between two placeholder chords
+    :return: pitch class mask with C as the most significant bit e.g. 0b100010010000 for C E G
+    """
+    mask = 0
+    for n in a_stream.flatten():
+        if type(n) == music21.note.Note:
+            mask |= 1 << (11 - n.pitch.pitchClass)
+    return mask
+
 def load_json(fully_qualified_filename):
     """
     load a json file and return the object
@@ -233,6 +703,756 @@ def load_json(fully_qualified_filename):
     # <class 'dict'>
     return json_object
 
+
+def compile_style(fully_qualified_filename, compiled_filename):
+    """
+    compile a pitch_to_chord style json file to a binary file that read_compiled_style memory maps:
+    a header with the json modification time, size and sha1,
+    then the PitchToChord arrays masks, chord_starts, chord_ids, chord_counts, chord name starts and the utf-8 chord names,
+    each padded to 8 bytes
+    :param fully_qualified_filename: e.g. input/style/jazz-_-ptc.json
+    :param compiled_filename: e.g. cache/style/jazz-_-ptc-3f2a9c1d0b7e.vhgs
+    :return: pitch_to_chord PitchToChord of the json
+    """
+    with open(fully_qualified_filename, 'rb') as openfile:
+        json_bytes = openfile.read()
+        json_stat = os.fstat(openfile.fileno())
+    pitch_to_chord = PitchToChord.from_json_object(json.loads(json_bytes.decode('utf-8')), fully_qualified_filename)
+
+    chord_names = [chord_name.encode('utf-8') for chord_name in pitch_to_chord.chord_names]
+    chord_name_starts = numpy.zeros(len(chord_names) + 1, dtype='<u4')
+    numpy.cumsum([len(chord_name) for chord_name in chord_names], out=chord_name_starts[1:])
+    header = COMPILED_STYLE_HEADER.pack(COMPILED_STYLE_MAGIC, json_stat.st_mtime_ns, json_stat.st_size, hashlib.sha1(json_bytes).digest(),
+                                        len(pitch_to_chord.masks), len(pitch_to_chord.chord_ids), len(chord_names), int(chord_name_starts[-1]))
+    blocks = [header, pitch_to_chord.masks.tobytes(), pitch_to_chord.chord_starts.tobytes(), pitch_to_chord.chord_ids.tobytes(),
+              pitch_to_chord.chord_counts.tobytes(), chord_name_starts.tobytes(), b''.join(chord_names)]
+
+    # write to a temporary file and rename, so a reader never sees a partly written file
+    try:
+        os.makedirs(os.path.dirname(compiled_filename), exist_ok=True)
+        temporary_filename = compiled_filename + '.' + str(os.getpid()) + '.tmp'
+        with open(temporary_filename, 'wb') as openfile:
+            for block in blocks:
+                openfile.write(block)
+                openfile.write(bytes(-len(block) % 8))
+        os.replace(temporary_filename, compiled_filename)
+        print('compiled', fully_qualified_filename, 'to', compiled_filename)
+    except OSError as e:
+        print('Warning: could not write compiled style', compiled_filename, e)
+
+    return pitch_to_chord
+
+
+def read_compiled_style(compiled_filename, fully_qualified_filename):
+    """
+    memory map a compiled style file written by compile_style, if it is of the current json
+    :param compiled_filename: e.g. cache/style/jazz-_-ptc-3f2a9c1d0b7e.vhgs
+    :param fully_qualified_filename: the json it was compiled from e.g. input/style/jazz-_-ptc.json
+    :return: pitch_to_chord PitchToChord with arrays in the memory map,
+             or None if the compiled style is missing, unreadable or of a different json
+    """
+    try:
+        with open(compiled_filename, 'rb') as openfile:
+            buffer = mmap.mmap(openfile.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, json_mtime_ns, json_size, json_sha1, mask_count, chord_count, chord_name_count, chord_name_bytes = \
+            COMPILED_STYLE_HEADER.unpack_from(buffer, 0)
+    except (OSError, ValueError, struct.error):
+        return None
+    if magic != COMPILED_STYLE_MAGIC:
+        return None
+
+    # the json is unchanged if its modification time and size are, else if its sha1 is
+    json_stat = os.stat(fully_qualified_filename)
+    if json_stat.st_mtime_ns != json_mtime_ns or json_stat.st_size != json_size:
+        with open(fully_qualified_filename, 'rb') as openfile:
+            if hashlib.sha1(openfile.read()).digest() != json_sha1:
+                return None
+
+    arrays = []
+    offset = COMPILED_STYLE_HEADER.size + (-COMPILED_STYLE_HEADER.size % 8)
+    for dtype, count in [('<u2', mask_count), ('<u4', mask_count + 1), ('<u4', chord_count), ('<u4', chord_count),
+                         ('<u4', chord_name_count + 1), ('u1', chord_name_bytes)]:
+        try:
+            array = numpy.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+        except ValueError:
+            return None
+        arrays.append(array)
+        offset += array.nbytes + (-array.nbytes % 8)
+    masks, chord_starts, chord_ids, chord_counts, chord_name_starts, chord_name_bytes = arrays
+
+    chord_names_bytes = chord_name_bytes.tobytes()
+    chord_name_starts = chord_name_starts.tolist()
+    chord_names = [chord_names_bytes[chord_name_starts[i]:chord_name_starts[i + 1]].decode('utf-8') for i in range(chord_name_count)]
+    return PitchToChord(masks, chord_starts, chord_ids, chord_counts, chord_names, fully_qualified_filename)
+
+
+def get_style_cache_filename(fully_qualified_filename):
+    """
+    :param fully_qualified_filename: the style json e.g. input/style/jazz-_-ptc.json
+    :return: the cached files of the style without extension e.g. cache/style/jazz-_-ptc-3f2a9c1d0b7e,
+             named by the sha1 of its full path too, so styles of the same name in different directories do not share them
+    """
+    path_sha1 = hashlib.sha1(os.path.abspath(fully_qualified_filename).encode('utf-8')).hexdigest()
+    return STYLE_CACHE_PATH + os.path.splitext(os.path.basename(fully_qualified_filename))[0] + '-' + path_sha1[:12]
+
+
+def get_compiled_style(fully_qualified_filename):
+    """
+    :param fully_qualified_filename: the style json e.g. input/style/jazz-_-ptc.json
+    :return: pitch_to_chord PitchToChord from the compiled style in STYLE_CACHE_PATH, (re)compiled first if the json has changed
+    """
+    compiled_filename = get_style_cache_filename(fully_qualified_filename) + COMPILED_STYLE_EXTENSION
+    pitch_to_chord = read_compiled_style(compiled_filename, fully_qualified_filename)
+    if pitch_to_chord is None:
+        pitch_to_chord = compile_style(fully_qualified_filename, compiled_filename)
+    return pitch_to_chord
+
+
+loaded_styles = {}  # (modification time, pitch_to_chord) by style file, see load_style
+
+
+def load_style(fully_qualified_filename):
+    """
+    load a pitch_to_chord style json file from its compiled style, see get_compiled_style,
+    reusing the copy already loaded while the file is unchanged e.g. when VeeHarmGen_server.py harmonises many melodies in one process
+    :param fully_qualified_filename: the style file to load e.g. input/style/jazz-_-ptc.json
+    :return: pitch_to_chord PitchToChord
+    """
+    mtime = os.path.getmtime(fully_qualified_filename)
+    if fully_qualified_filename not in loaded_styles or loaded_styles[fully_qualified_filename][0] != mtime:
+        loaded_styles[fully_qualified_filename] = (mtime, get_compiled_style(fully_qualified_filename))
+        read_chord_symbols(fully_qualified_filename)
+    return loaded_styles[fully_qualified_filename][1]
+
+
+chord_symbols = {}  # ChordSymbol parsed once, or None if not a valid chord symbol, by chord name, see parse_chord_symbol
+saved_chord_symbols = {}  # number of its chord names in chord_symbols when last read or saved, by style file, see save_chord_symbols
+
+
+def parse_chord_symbol(chord_name):
+    """
+    parse a chord name once per process, as music21 chord figure parsing is slow and a style repeats the same names
+    :param chord_name: e.g. Am7
+    :return: the ChordSymbol of chord_name, the same one each time so not to be changed or put in a stream (see get_chord_symbol),
+             or None if music21 does not parse chord_name
+    """
+    if chord_name not in chord_symbols:
+        try:
+            chord_symbols[chord_name] = harmony.ChordSymbol(chord_name)
+        except (music21.Music21Exception, ValueError):
+            chord_symbols[chord_name] = None
+    return chord_symbols[chord_name]
+
+
+def get_chord_symbol(chord_name):
+    """
+    :param chord_name: e.g. Am7 or NC
+    :return: a new ChordSymbol of chord_name copied from parse_chord_symbol, or a NoChord if chord_name is NC or not valid
+    """
+    chord_symbol = parse_chord_symbol(chord_name) if chord_name != 'NC' else None
+    if chord_symbol is None:
+        return harmony.NoChord()
+    return copy.deepcopy(chord_symbol)
+
+
+def get_chord_symbol_cache_filename(fully_qualified_filename):
+    """
+    :param fully_qualified_filename: the style json e.g. input/style/jazz-_-ptc.json
+    :return: e.g. cache/style/jazz-_-ptc-3f2a9c1d0b7e-m21-9.1.0.chords.p.gz, see get_style_cache_filename
+    """
+    return get_style_cache_filename(fully_qualified_filename) + '-m21-' + music21.VERSION_STR + CHORD_SYMBOL_CACHE_EXTENSION
+
+
+def read_chord_symbols(fully_qualified_filename):
+    """
+    add the chord symbols of a style parsed in earlier runs, see save_chord_symbols, to chord_symbols
+    :param fully_qualified_filename: the style json e.g. input/style/jazz-_-ptc.json
+    :return: void
+    """
+    cached_filename = get_chord_symbol_cache_filename(fully_qualified_filename)
+    if not os.path.exists(cached_filename):
+        return
+    try:
+        with gzip.open(cached_filename, 'rb') as openfile:
+            style_chord_symbols = pickle.load(openfile)
+    except Exception as e:
+        # e.g. a truncated or unreadable pickle, parse again and overwrite it
+        print('Warning: could not read cached chord symbols', cached_filename, e)
+        return
+    for chord_name, chord_symbol in style_chord_symbols.items():
+        chord_symbols.setdefault(chord_name, chord_symbol)
+    saved_chord_symbols[fully_qualified_filename] = len(style_chord_symbols)
+
+
+def save_chord_symbols():
+    """
+    save the chord names of each loaded style parsed so far, with the chord symbols read before,
+    so read_chord_symbols fills chord_symbols when the style is next loaded, and they are not parsed again
+    :return: void
+    """
+    for fully_qualified_filename, (mtime, pitch_to_chord) in loaded_styles.items():
+        style_chord_symbols = {chord_name: chord_symbols[chord_name] for chord_name in pitch_to_chord.chord_names if chord_name in chord_symbols}
+        if len(style_chord_symbols) <= saved_chord_symbols.get(fully_qualified_filename, 0):
+            continue
+        cached_filename = get_chord_symbol_cache_filename(fully_qualified_filename)
+        # write to a temporary file and rename, so a reader never sees a partly written file
+        try:
+            os.makedirs(os.path.dirname(cached_filename), exist_ok=True)
+            temporary_filename = cached_filename + '.' + str(os.getpid()) + '.tmp'
+            with gzip.open(temporary_filename, 'wb') as openfile:
+                pickle.dump(style_chord_symbols, openfile, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary_filename, cached_filename)
+            saved_chord_symbols[fully_qualified_filename] = len(style_chord_symbols)
+        except Exception as e:
+            print('Warning: could not write cached chord symbols', cached_filename, e)
+
+def parse_score(fully_qualified_filename):
+    """
+    parse a music file, thawing the score from SCORE_CACHE_PATH if the same file contents have been parsed before.
+    A cached score is named by the sha1 of the file contents and the music21 version, so an unchanged file (even if touched,
+    renamed or copied) skips the XML parsing, and a changed file or a new music21 parses again
+    :param fully_qualified_filename: e.g. input/music/music.mxl
+    :return: music21 score
+    """
+    with open(fully_qualified_filename, 'rb') as openfile:
+        file_sha1 = hashlib.sha1(openfile.read()).hexdigest()
+    # absolute, as music21 reads and writes a relative pickle path in its own scratch directory
+    cached_filename = os.path.abspath(SCORE_CACHE_PATH + file_sha1 + '-m21-' + music21.VERSION_STR + SCORE_CACHE_EXTENSION)
+
+    if os.path.exists(cached_filename):
+        try:
+            a_score = music21.converter.thaw(cached_filename, zipType='zlib')
+            # mark as recently used, see evict_score_cache
+            os.utime(cached_filename)
+            print('parse_score', fully_qualified_filename, 'from', cached_filename)
+            return a_score
+        except Exception as e:
+            # e.g. a truncated or unreadable pickle, parse again and overwrite it
+            print('Warning: could not read cached score', cached_filename, e)
+
+    a_score = music21.converter.parse(fully_qualified_filename, forceSource=True)
+
+    # write to a temporary file and rename, so a reader never sees a partly written file,
+    # then use the thawed score (as music21 does for its own pickles) so a cached or uncached parse gives the same score
+    try:
+        os.makedirs(os.path.dirname(cached_filename), exist_ok=True)
+        temporary_filename = cached_filename + '.' + str(os.getpid()) + '.tmp'
+        music21.freezeThaw.StreamFreezer(a_score, fastButUnsafe=True).write(fp=temporary_filename, zipType='zlib')
+        os.replace(temporary_filename, cached_filename)
+        a_score = music21.converter.thaw(cached_filename, zipType='zlib')
+        print('parse_score', fully_qualified_filename, 'cached to', cached_filename)
+    except Exception as e:
+        # freezing may have taken the score apart, so parse it again
+        print('Warning: could not write cached score', cached_filename, e)
+        return music21.converter.parse(fully_qualified_filename, forceSource=True)
+
+    evict_score_cache()
+    return a_score
+
+
+def evict_score_cache(max_bytes=SCORE_CACHE_MAX_BYTES, max_age=SCORE_CACHE_MAX_AGE):
+    """
+    remove the cached scores of parse_score unused for more than max_age seconds,
+    then the least recently used until the cache is no more than max_bytes
+    :param max_bytes: e.g. 268435456
+    :param max_age: seconds e.g. 2592000 (30 days)
+    :return: void
+    """
+    cached_scores = []  # (last used, size, path)
+    try:
+        filenames = os.listdir(SCORE_CACHE_PATH)
+    except OSError:
+        return
+    for filename in filenames:
+        if filename.endswith(SCORE_CACHE_EXTENSION):
+            cached_filename = os.path.join(SCORE_CACHE_PATH, filename)
+            try:
+                cached_stat = os.stat(cached_filename)
+            except OSError:
+                continue
+            cached_scores.append((cached_stat.st_mtime, cached_stat.st_size, cached_filename))
+
+    # oldest first
+    cached_scores.sort()
+    now = time.time()
+    total_bytes = sum(size for last_used, size, cached_filename in cached_scores)
+    for last_used, size, cached_filename in cached_scores:
+        if now - last_used <= max_age and total_bytes <= max_bytes:
+            break
+        try:
+            os.remove(cached_filename)
+            print('evicted cached score', cached_filename)
+        except OSError:
+            pass
+        total_bytes -= size
+
+
+harmony_xml = {}  # MusicXML <harmony> text by chord figure, see get_harmony_xml
+
+
+def get_harmony_xml(chord_symbol):
+    """
+    :param chord_symbol: music21 ChordSymbol or NoChord
+    :return: its MusicXML <harmony> element, exported by music21 once for each chord figure
+             e.g. '<harmony><root><root-step>C</root-step></root><kind>major</kind></harmony>'
+    """
+    figure = 'NC' if isinstance(chord_symbol, harmony.NoChord) else chord_symbol.figure
+    if figure not in harmony_xml:
+        measure_exporter = music21.musicxml.m21ToXml.MeasureExporter()
+        if isinstance(chord_symbol, harmony.NoChord):
+            mx_harmony = measure_exporter.noChordToXml(chord_symbol)
+        else:
+            mx_harmony = measure_exporter.chordSymbolToXml(chord_symbol)
+        harmony_xml[figure] = xml.etree.ElementTree.tostring(mx_harmony, encoding='unicode')
+    return harmony_xml[figure]
+
+
+def get_musicxml_header(title, composer, instrument_name):
+    """
+    :param title: e.g. Cairo
+    :param composer: e.g. VeeHarmGen 3.1.0
+    :param instrument_name: e.g. Piano
+    :return: the MusicXML of a one part score up to its first measure
+    """
+    return ('<?xml version="1.0" encoding="utf-8"?>\n'
+            '<!DOCTYPE score-partwise  PUBLIC "-//Recordare//DTD MusicXML 4.0 Partwise//EN" '
+            '"http://www.musicxml.org/dtds/partwise.dtd">\n'
+            '<score-partwise version="4.0">\n'
+            '  <work>\n    <work-title>' + escape(title) + '</work-title>\n  </work>\n'
+            '  <movement-title>' + escape(title) + '</movement-title>\n'
+            '  <identification>\n'
+            '    <creator type="composer">' + escape(composer) + '</creator>\n'
+            '    <encoding>\n'
+            '      <encoding-date>' + time.strftime('%Y-%m-%d') + '</encoding-date>\n'
+            '      <software>' + escape(composer.split('\n')[0]) + '</software>\n'
+            '    </encoding>\n'
+            '  </identification>\n'
+            '  <part-list>\n'
+            '    <score-part id="P1">\n'
+            '      <part-name>' + escape(instrument_name) + '</part-name>\n'
+            '      <score-instrument id="P1-I1">\n'
+            '        <instrument-name>' + escape(instrument_name) + '</instrument-name>\n'
+            '      </score-instrument>\n'
+            '    </score-part>\n'
+            '  </part-list>\n'
+            '  <part id="P1">\n')
+
+
+class MelodyXMLWriter:
+    """
+    write a melody with chord symbols straight to MusicXML, one measure at a time, from the music21 elements a writer
+    would otherwise append to a Part for music21 to export (which makes notation and copies the whole score first).
+    Measures are made from the time signatures as music21 does for an appended Part.
+    add raises ValueError for notation this does not write e.g. chords, grace notes or a note across a barline,
+    see write_melody_musicxml which then uses music21
+    """
+
+    def __init__(self, outfile, harmony_slots=False):
+        """
+        :param outfile: open text file, written after the header, see get_musicxml_header
+        :param harmony_slots: True to write MUSICXML_HARMONY_SLOT before each note or rest, see get_melody_xml_template
+        """
+        self.outfile = outfile
+        self.harmony_slots = harmony_slots
+        self.offset = Fraction(0)  # offset of the next element, as if appended to a Part
+        self.measure_number = 0  # 0 until the first measure is started
+        self.measure_start = Fraction(0)
+        self.measure_length = Fraction(4)  # 4/4 until a time signature
+        self.time_signature = meter.TimeSignature('4/4')
+        self.has_time_signature = False
+        self.has_clef = False
+        self.key_alters = {}  # alter by step in the key signature e.g. {'F': 1}
+        self.measure_alters = {}  # alter by (step, octave) of the last note in the measure, for accidentals
+        self.tuplet_remaining = None  # quarterLength left in the current tuplet bracket
+        self.previous_measure = None  # [measure text, right barline] written when the next measure has a note or rest
+        self.start_measure_items()
+
+    def start_measure_items(self):
+        """
+        clear what has been added to the current measure
+        """
+        self.measure_print = ''
+        self.left_barline = ''
+        self.right_barline = ''
+        self.measure_attributes = {}  # attribute text by name e.g. {'clef': '<clef>...'}
+        self.measure_items = []  # text, or a note or rest to be written when the beams of the measure are known
+        self.measure_notes = []  # notes and rests in the measure
+
+    def move_to(self, offset):
+        """
+        finish measures until offset is in the current measure, starting the first measure if need be
+        :param offset: e.g. Fraction(8)
+        """
+        if self.measure_number == 0:
+            self.measure_number = 1
+        while offset >= self.measure_start + self.measure_length:
+            self.finish_measure()
+            self.measure_start += self.measure_length
+            self.measure_number += 1
+
+    def is_measure_start(self, offset):
+        """
+        :return: True if offset is the start of the current measure and it has no notes or rests yet
+        """
+        return offset == self.measure_start and self.measure_notes == []
+
+    def add(self, element):
+        """
+        add the next music21 element of the melody
+        :param element: e.g. a Note, Rest, ChordSymbol, NoChord, TimeSignature, KeySignature, Clef, Barline,
+                        TextExpression, RehearsalMark, MetronomeMark, SystemLayout or PageLayout
+        """
+        offset = self.offset
+        if type(element) in (note.Note, note.Rest):
+            self.add_note(element)
+        elif isinstance(element, harmony.ChordSymbol):
+            self.move_to(offset)
+            self.measure_items.append(get_harmony_xml(element))
+        elif isinstance(element, bar.Barline):
+            self.add_barline(element)
+        elif isinstance(element, meter.TimeSignature):
+            self.move_to(offset)
+            if not self.is_measure_start(offset) or '+' in element.ratioString:
+                raise ValueError('time signature ' + element.ratioString + ' at ' + str(offset))
+            self.time_signature = element
+            self.has_time_signature = True
+            self.measure_length = Fraction(element.barDuration.quarterLength)
+            self.measure_attributes['time'] = ('<time' + (' symbol="' + element.symbol + '"' if element.symbol else '') + '><beats>'
+                                               + str(element.numerator) + '</beats><beat-type>' + str(element.denominator) + '</beat-type></time>')
+        elif isinstance(element, key.KeySignature):
+            self.move_to(offset)
+            if not self.is_measure_start(offset):
+                raise ValueError('key signature at ' + str(offset))
+            self.key_alters = {p.step: p.accidental.alter for p in element.alteredPitches}
+            self.measure_alters = {}
+            mode = element.mode if isinstance(element, key.Key) else None
+            self.measure_attributes['key'] = ('<key><fifths>' + str(element.sharps) + '</fifths>'
+                                              + ('<mode>' + mode + '</mode>' if mode else '') + '</key>')
+        elif isinstance(element, clef.Clef):
+            self.move_to(offset)
+            if element.sign is None:
+                raise ValueError('clef ' + str(element))
+            clef_xml = ('<clef><sign>' + element.sign + '</sign>'
+                        + ('<line>' + str(element.line) + '</line>' if element.line is not None else '')
+                        + ('<clef-octave-change>' + str(element.octaveChange) + '</clef-octave-change>' if element.octaveChange else '')
+                        + '</clef>')
+            self.has_clef = True
+            if self.is_measure_start(offset):
+                self.measure_attributes['clef'] = clef_xml
+            else:
+                self.measure_items.append('<attributes>' + clef_xml + '</attributes>')
+        elif isinstance(element, (expressions.TextExpression, expressions.RehearsalMark, tempo.MetronomeMark)):
+            self.move_to(offset)
+            self.measure_items.append(self.get_direction_xml(element))
+        elif isinstance(element, (layout.SystemLayout, layout.PageLayout)):
+            self.move_to(offset)
+            if element.isNew and self.is_measure_start(offset):
+                self.measure_print = '<print new-page="yes"/>' if isinstance(element, layout.PageLayout) else '<print new-system="yes"/>'
+        elif isinstance(element, (layout.ScoreLayout, metadata.Metadata)):
+            pass
+        else:
+            raise ValueError('element ' + str(element))
+
+    def add_note(self, n):
+        """
+        add a note or rest at the current offset
+        :param n: music21 Note or Rest
+        """
+        offset = self.offset
+        duration = Fraction(n.duration.quarterLength)
+        if n.duration.isGrace or n.duration.type in ('complex', 'inexpressible', 'zero') or len(n.duration.tuplets) > 1:
+            raise ValueError('duration ' + str(n.duration) + ' at ' + str(offset))
+        if n.expressions or n.articulations or any(lyric.components is not None for lyric in n.lyrics):
+            raise ValueError('notation of ' + str(n) + ' at ' + str(offset))
+        if not self.has_clef:
+            raise ValueError('no clef before the first note')
+        self.move_to(offset)
+        if offset + duration > self.measure_start + self.measure_length:
+            raise ValueError(str(n) + ' at ' + str(offset) + ' across a barline')
+        if self.right_barline:
+            raise ValueError(str(n) + ' at ' + str(offset) + ' after a barline')
+        if self.previous_measure is not None:
+            self.write_previous_measure()
+        if self.harmony_slots:
+            self.measure_items.append(MUSICXML_HARMONY_SLOT)
+        self.measure_items.append(n)
+        self.measure_notes.append(n)
+        self.offset += duration
+
+    def add_barline(self, barline):
+        """
+        add a barline, on the left of a measure for a start repeat, else on the right of the measure it ends
+        :param barline: music21 Barline or Repeat
+        """
+        offset = self.offset
+        bar_style = '<bar-style>' + bar.typeToMusicXMLBarStyle(barline.type) + '</bar-style>'
+        if isinstance(barline, bar.Repeat) and barline.direction == 'start':
+            self.move_to(offset)
+            if not self.is_measure_start(offset):
+                raise ValueError('start repeat at ' + str(offset))
+            self.left_barline = '<barline location="left">' + bar_style + '<repeat direction="forward"/></barline>'
+            return
+        repeat = ''
+        if isinstance(barline, bar.Repeat):
+            repeat = '<repeat direction="backward"' + (' times="' + str(barline.times) + '"' if barline.times is not None else '') + '/>'
+        right_barline = '<barline location="right">' + bar_style + repeat + '</barline>'
+        if self.previous_measure is not None and self.is_measure_start(offset):
+            # the barline ends the previous measure, after the layout or clef of the next one
+            self.previous_measure[1] = right_barline
+        elif self.measure_number == 0:
+            raise ValueError('barline before the first note')
+        else:
+            # end of the current measure, or of a shorter last measure
+            self.right_barline = right_barline
+
+    def get_direction_xml(self, element):
+        """
+        :param element: TextExpression, RehearsalMark or MetronomeMark
+        :return: MusicXML <direction> e.g. '<direction placement="above"><direction-type><words>VERSE 1</words></direction-type></direction>'
+        """
+        if isinstance(element, expressions.RehearsalMark):
+            direction_type = '<rehearsal>' + escape(str(element.content)) + '</rehearsal>'
+            sound = ''
+        elif isinstance(element, expressions.TextExpression):
+            direction_type = '<words>' + escape(str(element.content)) + '</words>'
+            sound = ''
+        else:
+            direction_type = ''
+            if element.text is not None and not element.textImplicit:
+                direction_type += '<words>' + escape(element.text) + '</words>'
+            if element.number is not None and not element.numberImplicit:
+                direction_type += ('<metronome><beat-unit>' + music21.musicxml.m21ToXml.typeToMusicXMLType(element.referent.type) + '</beat-unit>'
+                                   + '<beat-unit-dot/>' * element.referent.dots
+                                   + '<per-minute>' + str(common.numToIntOrFloat(element.number)) + '</per-minute></metronome>')
+            if direction_type == '':
+                raise ValueError('metronome mark ' + str(element))
+            sound = '<sound tempo="' + str(common.numToIntOrFloat(round(element.getQuarterBPM(), 2))) + '"/>' if element.number is not None else ''
+        return '<direction placement="above"><direction-type>' + direction_type + '</direction-type>' + sound + '</direction>'
+
+    def get_note_xml(self, n, beams):
+        """
+        :param n: music21 Note or Rest
+        :param beams: music21 Beams of n, or None
+        :return: MusicXML <note>
+        """
+        duration = Fraction(n.duration.quarterLength) * MUSICXML_DIVISIONS
+        if duration.denominator != 1:
+            raise ValueError('duration ' + str(n.duration) + ' in divisions')
+        tie = n.tie.type if n.tie is not None else None
+        if n.isRest:
+            note_xml = '<note><rest/>'
+        else:
+            step, octave = n.pitch.step, n.pitch.implicitOctave
+            alter = n.pitch.accidental.alter if n.pitch.accidental is not None else 0
+            if alter != int(alter):
+                raise ValueError('microtone ' + n.pitch.nameWithOctave)
+            alter = int(alter)
+            note_xml = ('<note><pitch><step>' + step + '</step>' + ('<alter>' + str(alter) + '</alter>' if n.pitch.accidental is not None else '')
+                        + '<octave>' + str(octave) + '</octave></pitch>')
+        note_xml += '<duration>' + str(duration.numerator) + '</duration>'
+        if tie in ('stop', 'continue'):
+            note_xml += '<tie type="stop"/>'
+        if tie in ('start', 'continue'):
+            note_xml += '<tie type="start"/>'
+        note_xml += '<type>' + music21.musicxml.m21ToXml.typeToMusicXMLType(n.duration.type) + '</type>' + '<dot/>' * n.duration.dots
+        if not n.isRest:
+            # as makeAccidentals: keep an accidental shown or hidden in the input,
+            # else show it where it differs from the key signature or an earlier note in the measure
+            expected_alter = self.measure_alters.get((step, octave), self.key_alters.get(step, 0))
+            display_status = n.pitch.accidental.displayStatus if n.pitch.accidental is not None else None
+            if display_status is None:
+                display_status = alter != expected_alter and tie not in ('stop', 'continue')
+            if display_status:
+                note_xml += '<accidental>' + MUSICXML_ACCIDENTALS.get(alter, 'natural') + '</accidental>'
+            self.measure_alters[(step, octave)] = alter
+
+        notations = ''
+        if n.duration.tuplets:
+            tuplet = n.duration.tuplets[0]
+            note_xml += ('<time-modification><actual-notes>' + str(tuplet.numberNotesActual) + '</actual-notes>'
+                         + '<normal-notes>' + str(tuplet.numberNotesNormal) + '</normal-notes>'
+                         + ('<normal-type>' + music21.musicxml.m21ToXml.typeToMusicXMLType(tuplet.durationNormal.type) + '</normal-type>'
+                            if tuplet.durationNormal.type != n.duration.type else '')
+                         + '</time-modification>')
+            if self.tuplet_remaining is None:
+                self.tuplet_remaining = Fraction(tuplet.totalTupletLength())
+                notations += '<tuplet type="start" bracket="yes"/>'
+            self.tuplet_remaining -= Fraction(n.duration.quarterLength)
+            if self.tuplet_remaining <= 0:
+                self.tuplet_remaining = None
+                notations += '<tuplet type="stop"/>'
+        else:
+            self.tuplet_remaining = None
+        if beams is not None:
+            for beam in beams:
+                beam_type = beam.type if beam.type != 'partial' else beam.direction
+                note_xml += '<beam number="' + str(beam.number) + '">' + MUSICXML_BEAM_TYPES[beam_type] + '</beam>'
+        if tie in ('stop', 'continue'):
+            notations = '<tied type="stop"/>' + notations
+        if tie in ('start', 'continue'):
+            notations = '<tied type="start"/>' + notations
+        if notations:
+            note_xml += '<notations>' + notations + '</notations>'
+        for lyric in n.lyrics:
+            note_xml += ('<lyric number="' + str(lyric.number) + '">'
+                         + ('<syllabic>' + lyric.syllabic + '</syllabic>' if lyric.syllabic else '')
+                         + '<text>' + escape(lyric.text) + '</text></lyric>')
+        return note_xml + '</note>'
+
+    def finish_measure(self):
+        """
+        render the current measure, to be written when the next measure has a note or rest (in case a barline ends it)
+        """
+        try:
+            beams_list = self.time_signature.getBeams(self.measure_notes, measureStartOffset=0.0) if self.measure_notes else []
+        except (music21.exceptions21.Music21Exception, ZeroDivisionError):
+            # as makeBeams, leave a measure that cannot be beamed without beams
+            beams_list = [None] * len(self.measure_notes)
+        if self.measure_number == 1:
+            self.measure_attributes['divisions'] = '<divisions>' + str(MUSICXML_DIVISIONS) + '</divisions>'
+            if not self.has_time_signature:
+                self.measure_attributes['time'] = '<time><beats>4</beats><beat-type>4</beat-type></time>'
+        measure_xml = '    <measure number="' + str(self.measure_number) + '">\n' + self.measure_print + self.left_barline
+        if self.measure_attributes:
+            measure_xml += '<attributes>' + ''.join(self.measure_attributes.get(name, '') for name in ('divisions', 'key', 'time', 'clef')) + '</attributes>'
+        self.measure_alters = {}
+        beams = iter(beams_list)
+        for item in self.measure_items:
+            if item == MUSICXML_HARMONY_SLOT:
+                # the <harmony> put here brings its own new line
+                measure_xml += item
+                continue
+            if isinstance(item, str):
+                measure_xml += item
+            else:
+                measure_xml += self.get_note_xml(item, next(beams))
+            measure_xml += '\n'
+        if self.previous_measure is not None:
+            self.write_previous_measure()
+        self.previous_measure = [measure_xml, self.right_barline]
+        self.start_measure_items()
+
+    def write_previous_measure(self):
+        """
+        write the measure rendered by finish_measure
+        """
+        measure_xml, right_barline = self.previous_measure
+        self.outfile.write(measure_xml + right_barline + '    </measure>\n')
+        self.previous_measure = None
+
+    def finish(self):
+        """
+        write the last measures and close the score
+        """
+        if self.measure_number == 0:
+            raise ValueError('no notes or rests')
+        if self.measure_notes == [] and self.previous_measure is not None:
+            # only layout or directions after the last note, so no measure for them
+            if self.right_barline:
+                self.previous_measure[1] = self.right_barline
+        else:
+            self.finish_measure()
+        self.write_previous_measure()
+        self.outfile.write('  </part>\n</score-partwise>\n')
+
+
+melody_xml_templates = {}  # (melody, template) by the ids of the melody elements, see get_melody_xml_template, cleared by harmonise
+
+
+def get_melody_xml_template(melody):
+    """
+    A sweep writes the same melody with different chord symbols, so render it once and splice the <harmony> in
+    :param melody: the music21 elements of a melody without chord symbols, in order
+    :return: template: the MusicXML of the melody after the header, split where a <harmony> may go before each note or rest,
+             so template[i + 1] follows the <harmony> of note or rest i,
+             or None if the melody has notation MelodyXMLWriter does not write
+    """
+    melody_key = tuple(id(element) for element in melody)
+    if melody_key not in melody_xml_templates:
+        outfile = io.StringIO()
+        try:
+            melody_xml_writer = MelodyXMLWriter(outfile, harmony_slots=True)
+            for element in melody:
+                melody_xml_writer.add(element)
+            melody_xml_writer.finish()
+            template = outfile.getvalue().split(MUSICXML_HARMONY_SLOT)
+        except ValueError as e:
+            print('get_melody_xml_template: MelodyXMLWriter does not write the melody', e)
+            template = None
+        # keep the melody so the ids of its elements are not reused
+        melody_xml_templates[melody_key] = (melody, template)
+    return melody_xml_templates[melody_key][1]
+
+
+def write_melody_musicxml(elements, fully_qualified_filename, title, composer, instrument_name, output_format):
+    """
+    write a melody with chord symbols, compressed as music21 does if output_format is mxl.
+    Chord symbols just before a note or rest are spliced into the template of the melody, see get_melody_xml_template,
+    else the elements are written with MelodyXMLWriter
+    :param elements: the music21 elements in the order a writer would append them to a Part
+    :param fully_qualified_filename: e.g. output/Cairo-BAR1.musicxml
+    :param title: e.g. Cairo
+    :param composer: e.g. VeeHarmGen 3.1.0
+    :param instrument_name: e.g. Piano
+    :param output_format: mxl or musicxml
+    :return: True if written, False if the melody has notation MelodyXMLWriter does not write, to be written by music21
+    """
+    melody = []
+    harmonies = {}  # <harmony> by the index of the note or rest it is before
+    note_count = 0
+    for element, next_element in zip(elements, elements[1:] + [None]):
+        if isinstance(element, harmony.ChordSymbol) and type(next_element) in (note.Note, note.Rest):
+            harmonies[note_count] = harmonies.get(note_count, '') + get_harmony_xml(element) + '\n'
+        elif isinstance(element, harmony.ChordSymbol):
+            # not just before a note or rest, so not where the template has a slot
+            melody = None
+            break
+        else:
+            melody.append(element)
+            if type(element) in (note.Note, note.Rest):
+                note_count += 1
+    template = None
+    if melody is not None:
+        template = get_melody_xml_template(melody)
+        if template is None:
+            print('write_melody_musicxml: using music21 for', fully_qualified_filename)
+            return False
+
+    musicxml_filename = os.path.splitext(fully_qualified_filename)[0] + '.musicxml'
+    output_filename = os.path.splitext(fully_qualified_filename)[0] + '.' + output_format
+    temporary_filename = musicxml_filename + '.' + str(os.getpid()) + '.tmp'
+    temporary_mxl_filename = temporary_filename + '.mxl'
+    try:
+        with open(temporary_filename, 'w', encoding='utf-8') as outfile:
+            outfile.write(get_musicxml_header(title, composer, instrument_name))
+            if template is not None:
+                outfile.write(template[0])
+                for i in range(1, len(template)):
+                    outfile.write(harmonies.get(i - 1, ''))
+                    outfile.write(template[i])
+            else:
+                melody_xml_writer = MelodyXMLWriter(outfile)
+                for element in elements:
+                    melody_xml_writer.add(element)
+                melody_xml_writer.finish()
+        if output_format == 'mxl':
+            # as music21.musicxml.archiveTools.compressXML, without writing or deleting musicxml_filename
+            with zipfile.ZipFile(temporary_mxl_filename, 'w', compression=zipfile.ZIP_DEFLATED) as mxl_file:
+                mxl_file.write(temporary_filename, os.path.basename(musicxml_filename))
+                mxl_file.writestr('META-INF/container.xml', MXL_CONTAINER.format(os.path.basename(musicxml_filename)))
+            os.replace(temporary_mxl_filename, output_filename)
+        else:
+            os.replace(temporary_filename, output_filename)
+    except ValueError as e:
+        print('write_melody_musicxml: using music21 for', fully_qualified_filename, e)
+        return False
+    finally:
+        for filename in (temporary_filename, temporary_mxl_filename):
+            if os.path.exists(filename):
+                os.remove(filename)
+    return True
+
+
 #
 # def filter_output_stream_for_MuseScore(a_stream, ts, *,
 #             inPlace=False,
@@ -19,6 +19,9 @@
 # standard libraries
 import argparse
 import bisect
+import concurrent.futures
+import contextlib
+import io
 import json
 import math
 import music21
@@ -314,41 +317,6 @@ def show_histograms(score, label):
     p.run()  # with defaults and proper configuration, will open graph
 
 
-def get_stream(stream1, start_note_offset, end_note_offset):
-        """
-        gets a subset of stream1 (the whole song)
-        :param start_note_offset: song offsets >= this included in stream
-        :param end_note_offset: song offsets < this included in stream
-        :return: stream
-        """
-
-        print('     get_stream(...start_note_offset, end_note_offset)',start_note_offset, end_note_offset,'----get_stream----')
-        sub_stream = stream.Stream()
-        for n in stream1.flatten():
-            if type(n) == music21.note.Note or type(n) == music21.note.Rest:
-                if (n.offset >= start_note_offset) and (n.offset < end_note_offset):
-                    sub_stream.append(n)
-                    if type(n) == music21.note.Note:
-                        print('get_stream append',n.offset, n.nameWithOctave, n.duration.quarterLength)
-                    else:
-                        print('rest offset and duration', n.offset, n.duration.quarterLength)
-
-        return sub_stream
-
-def stream_has_a_note(a_stream):
-    """
-    return True if stream has a note
-    :param a_stream:
-    :return: True if stream has a note
-    """
-    stream_has_note = False
-
-    for n in a_stream.flatten():
-        if type(n) == music21.note.Note:
-            stream_has_note = True
-
-    return stream_has_note
-
 def short_chord(chord_in):
     """
     given a long chord name e.g. A minor or C major
@@ -376,44 +344,225 @@ def short_chord(chord_in):
 
     return chord
 
+def create_chord_map(mxlfile, outdir, transpose):
+    """
+    normalise a chorded melody to C major / A minor (or transpose it), write the normalised .mxl next to it,
+    and write the pitch_to_chord mapping of its chords to outdir
+    :param mxlfile: e.g. private/input/music/placeholder_chords/blues_1/song.mxl
+    :param outdir: e.g. input/style/
+    :param transpose: semitones to transpose, or None to normalise to C major / A minor
+    :return: the pitch_to_chord json written e.g. input/style/song-_-ptc.json, or None if the melody has no chords
+    """
+    print('file to process', os.path.basename(mxlfile))
+    a_song = parse_score(mxlfile)
+    # a_song.show('text')
+    # input('Press Enter to continue...')
+
+    # if transpose arg supplied then transpose as requested
+    if transpose != None:
+        a_song = a_song.transpose(transpose)
+        # analyze the key of the transposed input song
+        song_key = a_song.analyze('key')  # music21 generic algorithm for key finding
+        print('transpose, song_key.tonic.name, song_key.mode = ',
+              transpose, song_key.tonic.name,
+              song_key.mode)  # # e.g. song_key.tonic.name, song_key.mode =  C major or A minor
+
+    else:    # else auto transpose
+        # normalise stream
+        # analyze the key of the input song
+        song_key = a_song.analyze('key')  # music21 generic algorithm for key finding
+        print('Input song raw song_key.tonic.name, song_key.mode = ', song_key.tonic.name,
+              song_key.mode)  # # e.g. song_key.tonic.name, song_key.mode =  B major or D minor
+
+        if (song_key.tonic.name == 'C' and song_key.mode == 'major') or (
+                song_key.tonic.name == 'A' and song_key.mode == 'minor'):
+            print('No need to normalise as already normal C major or A minor.')
+            song_transpose_interval = 0
+        else:
+            print('Need to normalise to C major or A minor.')
+            # if minor find interval to A
+            if song_key.mode == 'minor':
+                song_transpose_interval = interval.Interval(song_key.tonic, pitch.Pitch('A'))
+            else:  # song is major, find interval to C
+                song_transpose_interval = interval.Interval(song_key.tonic, pitch.Pitch('C'))
+            a_song = a_song.transpose(song_transpose_interval)
+
+        # analyze the key of the transposed input song
+        song_key = a_song.analyze('key')  # music21 generic algorithm for key finding
+        print('Transposed (if required) input song interval song_key.tonic.name, song_key.mode = ',
+              song_transpose_interval, song_key.tonic.name,
+              song_key.mode)  # # e.g. song_key.tonic.name, song_key.mode =  C major or A minor
+
+    # a_song.show('text')
+
+    # remove file extension from filename, normalise filename and add file extension
+    mxlfile_basename = os.path.basename(mxlfile)
+    mxlfile_normalised_name = os.path.splitext(mxlfile_basename)[0] + '_normalised.mxl'
+
+    # get path without filename e.g.
+    # 1. blank if no path (file in cwd) mxlfile_path               :
+    # 2. if has path                    mxlfile_path               : private/input/music/sectioned
+    mxlfile_path = os.path.dirname(mxlfile)
+    # print("mxlfile_path                 :", mxlfile_path)
+    mxlfile_normalised_name_path = os.curdir + os.sep + mxlfile_path + os.sep + mxlfile_normalised_name
+    print("mxlfile_normalised_output      :", mxlfile_normalised_name_path)
+
+    # write normalised stream
+    a_song.write(fp=mxlfile_normalised_name_path) # write normalised score to musicxml file
+
+    # process the normalised stream
+    # analyze_choice = 'Aarden' # my default and Music21 default is Aarden same as key
+    analyze_choice = 'Krumhansl' # my default as least errors on GSTQ 1 bar (Music21 default is Aarden same as key)
+
+    looking_for_first_chord = True
+    next_note_is_first_chord_offset = False
+    next_note_is_chord_offset = False
+    start_note_offset = 0.0
+    last_note_duration = 0.0
+    pitch_to_chord = {} # chord frequencies by pitch class mask e.g. {0b100000000000: {'C': 2}}
+    # the notes and rests of the song indexed once by offset, so each chord span is a bisect, not a scan of the song
+    note_index = NoteIndex(get_melody_events(a_song))
+
+    # for each stream element in a_song
+    for n in a_song.flatten():
+        if type(n) == music21.harmony.ChordSymbol or type(n) == music21.harmony.NoChord:
+            #     if chord and chord not 'NC' and looking_for_first_chord:
+            if looking_for_first_chord and type(n) != music21.harmony.NoChord:
+                looking_for_first_chord = False
+                next_note_is_first_chord_offset = True
+                chord_1 = n.figure
+                map_chord = chord_1
+            else: # found a later chord
+                # if type(n) != music21.harmony.NoChord:
+                next_note_is_chord_offset = True
+                chord_2 = n.figure
+
+
+        if type(n) == music21.note.Note:
+            last_note_duration = n.duration.quarterLength
+            if next_note_is_first_chord_offset:
+                #         get next note
+                #         start_note_offset = note_offset
+                #         looking_for_first_chord = False
+                start_note_offset = n.offset
+                looking_for_first_chord = False
+                next_note_is_first_chord_offset = False
+            if next_note_is_chord_offset:
+                next_note_is_chord_offset = False
+                end_note_offset = n.offset
+                # pitch class mask of the notes of the chord span (0 if only rests)
+                key = note_index.get_pitch_class_mask(start_note_offset, end_note_offset)
+
+                if key != NO_CHORD_PITCH_CLASS_MASK :
+                    # print('ANALYZE_CHOICE =', analyze_choice)
+                    if map_chord != 'N.C.' and map_chord != 'NC':
+                        print('     JSON start_note_offset', start_note_offset, 'end_note_offset', end_note_offset,'key_chord',mask_to_pitch_class(key),'map_chord',map_chord,'----JSON----')
+                        # add to json structure
+                        if key in pitch_to_chord:
+                            if map_chord in pitch_to_chord[key]:
+                                pitch_to_chord[key][map_chord] += 1
+                            else:
+                                pitch_to_chord[key][map_chord] = 1
+                        else:
+                            pitch_to_chord[key] = {map_chord: 1}
+                    map_chord = chord_2
+                    start_note_offset = end_note_offset
+
+    # if no chords then ignore and continue with next file
+    if looking_for_first_chord == True:
+        print('NO CHORD FOUND IN', mxlfile,'...CONTINUE')
+        # input('Press Enter to continue...')
+        return None
+
+    # handle last chord / note(s)
+    if map_chord != 'N.C.' and map_chord != 'NC':
+        end_note_offset = start_note_offset + last_note_duration
+        key = note_index.get_pitch_class_mask(start_note_offset, end_note_offset)
+        if key != NO_CHORD_PITCH_CLASS_MASK :
+            print('     JSON start_note_offset', start_note_offset, 'end_note_offset', end_note_offset,'key_chord',mask_to_pitch_class(key),'map_chord',map_chord,'----JSON----')
+            # add to json structure
+            if key in pitch_to_chord:
+                if map_chord in pitch_to_chord[key]:
+                    pitch_to_chord[key][map_chord] += 1
+                else:
+                    pitch_to_chord[key][map_chord] = 1
+            else:
+                pitch_to_chord[key] = {map_chord: 1}
+
+    # pitch class masks to json keys e.g. 0b100000000000 to '1000 0000 0000'
+    pitch_to_chord = {mask_to_pitch_class(key): chords for key, chords in pitch_to_chord.items()}
+    print('pitch_to_chord with frequency=', pitch_to_chord)  # e.g.
+
+    # Serializing json
+    json_object = json.dumps(pitch_to_chord, indent=4)
+
+    # Writing to sample.json
+    # with open("pitch_to_chord.json", "w") as outfile:
+    # output_path = 'input' + os.sep + 'style' + os.sep + 'pitch_to_chord' + os.sep
+    # outdir
+    output_path = outdir
+
+    # Check whether the specified path exists or not
+    isExist = os.path.exists(output_path)
+    if not isExist:
+        # Create a new directory because it does not exist
+        os.makedirs(output_path, exist_ok=True)
+        print("The new directory is created!", output_path)
+
+    output_filename = os.path.splitext(mxlfile_basename)[0] + PITCH_TO_CHORD_PRE_EXTENSION + '.json'
+
+    # write to a temporary file and rename, so a reader (or another worker) never sees a partly written file
+    temporary_filename = output_path + output_filename + '.' + str(os.getpid()) + '.tmp'
+    with open(temporary_filename, "w") as outfile:
+        outfile.write(json_object)
+    os.replace(temporary_filename, output_path + output_filename)
+    print('')
+    print('Output written to',output_path + output_filename)
+    print('create_chord_map.py', CREATE_CHORD_MAP_VERSION)
+
+    return output_path + output_filename
+
+
+def create_chord_map_logged(mxlfile, outdir, transpose):
+    """
+    create_chord_map in a worker process, with its printed output kept to be printed in order by main
+    :return: (the pitch_to_chord json written or None, printed output)
+    """
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        output_filename = create_chord_map(mxlfile, outdir, transpose)
+    return output_filename, log.getvalue()
+
+
 def main():
     """
     parse command line arguments
-    read mxl
-    normalise stream
-    write normalised stream
+    for each mxl in mxldir, create_chord_map (in worker processes if jobs > 1):
+        read mxl
+        normalise stream
+        write normalised stream
+        write the pitch_to_chord mapping of its chords
 
     # does a ChordSymbol have an offset ? see https://web.mit.edu/music21/doc/moduleReference/moduleHarmony.html#chordsymbol
     # ChordSymbols, unlike chords, by default appear as chord symbols in a score and have duration of 0.
     # see VeeHarmGen.py def write_chords the ChordSymbol takes the offset of the following note/rest
 
-    looking_for_first_chord = True
+    create_chord_map indexes the notes and rests of the song once by offset (NoteIndex), then in one pass through a_song:
 
     for each stream element in a_song
-        if chord and chord not 'NC' and looking_for_first_chord:
+        if chord and looking_for_first_chord:
             get next note
             start_note_offset = note_offset
-            looking_for_first_chord = False
-            chord_1 = chord
-            map_chord = chord_1
-        if chord and chord not 'NC' and not looking_for_first_chord:
+            map_chord = chord
+        else if chord:
             get next note
             end_note_offset = note_offset
-            chord_2 = chord
-            shorter_stream = get_stream(a_song, start_note_offset, end_note_offset )
-
-            if stream_has_a_note(shorter_stream):
-                # print('ANALYZE_CHOICE =', analyze_choice)
-                key_chord = shorter_stream.analyze(analyze_choice)
-                print('key_chord',key_chord,'map_chord',map_chord)
-                # TBD add to json structure
-            map_chord = chord_2
+            pitch class mask of the notes from start_note_offset to end_note_offset, a bisect of the NoteIndex
+            if there are notes and map_chord is not 'NC': count map_chord for the pitch class mask
+            map_chord = chord
             start_note_offset = end_note_offset
 
-    if looking_for_first_chord: exit error no chord found ensure input file has chord symbols
-
-
-
+    if looking_for_first_chord: no chord found, the melody is skipped
     """
 
     # Specify command line arguments.
@@ -427,6 +576,11 @@ def main():
                         default='input/style/',
                         type=str)
 
+    parser.add_argument('-j', '--jobs',
+                        help='number of melodies to process at once in worker processes e.g. the number of cores (default 1)',
+                        default=1,
+                        type=positive_int)
+
     parser.add_argument('-t','--transpose',
                         help='transpose input file down or up t semitones (to override default "analyze" transpose to C / a minor)',
                         default= None,
@@ -447,214 +601,31 @@ def main():
     print("mxldir fully qualified      :", args.mxldir)
     print('args.outdir', args.outdir)
     print('args.transpose', args.transpose)
+    print('args.jobs', args.jobs)
 
     # need to remove *_normalised.mxl and *_transposed.mxl from mxldir
     remove_files_ending_with_from_dir('_normalised.mxl', args.mxldir)
     remove_files_ending_with_from_dir('_transposed.mxl', args.mxldir)
 
-    # for each file ending in .mxl
+    # for each file ending in .mxl, in name order so the output is the same however many jobs
     # list the files in the directory
-    for filename in os.listdir(args.mxldir):
+    mxlfiles = []
+    for filename in sorted(os.listdir(args.mxldir)):
         # if the filename is a file and ending with ends_with
         if os.path.isfile(os.path.join(args.mxldir, filename)):
             if filename.endswith(".mxl"):
-                mxlfile = os.path.join(args.mxldir, filename)
-                print('file to process', filename)
-                a_song = music21.converter.parse(mxlfile)
-                # a_song.show('text')
-                # input('Press Enter to continue...')
-
-                # if transpose arg supplied then transpose as requested
-                if args.transpose != None:
-                    a_song = a_song.transpose(args.transpose)
-                    # analyze the key of the transposed input song
-                    song_key = a_song.analyze('key')  # music21 generic algorithm for key finding
-                    print('args.transpose, song_key.tonic.name, song_key.mode = ',
-                          args.transpose, song_key.tonic.name,
-                          song_key.mode)  # # e.g. song_key.tonic.name, song_key.mode =  C major or A minor
-
-                else:    # else auto transpose
-                    # normalise stream
-                    # analyze the key of the input song
-                    song_key = a_song.analyze('key')  # music21 generic algorithm for key finding
-                    print('Input song raw song_key.tonic.name, song_key.mode = ', song_key.tonic.name,
-                          song_key.mode)  # # e.g. song_key.tonic.name, song_key.mode =  B major or D minor
-
-                    if (song_key.tonic.name == 'C' and song_key.mode == 'major') or (
-                            song_key.tonic.name == 'A' and song_key.mode == 'minor'):
-                        print('No need to normalise as already normal C major or A minor.')
-                        song_transpose_interval = 0
-                    else:
-                        print('Need to normalise to C major or A minor.')
-                        # if minor find interval to A
-                        if song_key.mode == 'minor':
-                            song_transpose_interval = interval.Interval(song_key.tonic, pitch.Pitch('A'))
-                        else:  # song is major, find interval to C
-                            song_transpose_interval = interval.Interval(song_key.tonic, pitch.Pitch('C'))
-                        a_song = a_song.transpose(song_transpose_interval)
-
-                    # analyze the key of the transposed input song
-                    song_key = a_song.analyze('key')  # music21 generic algorithm for key finding
-                    print('Transposed (if required) input song interval song_key.tonic.name, song_key.mode = ',
-                          song_transpose_interval, song_key.tonic.name,
-                          song_key.mode)  # # e.g. song_key.tonic.name, song_key.mode =  C major or A minor
-
-                # a_song.show('text')
-
-                # remove file extension from filename, normalise filename and add file extension
-                mxlfile_basename = os.path.basename(mxlfile)
-                mxlfile_normalised_name = os.path.splitext(mxlfile_basename)[0] + '_normalised.mxl'
-
-                # get path without filename e.g.
-                # 1. blank if no path (file in cwd) mxlfile_path               :
-                # 2. if has path                    mxlfile_path               : private/input/music/sectioned
-                mxlfile_path = os.path.dirname(mxlfile)
-                # print("mxlfile_path                 :", mxlfile_path)
-                mxlfile_normalised_name_path = os.curdir + os.sep + mxlfile_path + os.sep + mxlfile_normalised_name
-                print("mxlfile_normalised_output      :", mxlfile_normalised_name_path)
-
-                # write normalised stream
-                a_song.write(fp=mxlfile_normalised_name_path) # write normalised score to musicxml file
-
-                # process the normalised stream
-                # analyze_choice = 'Aarden' # my default and Music21 default is Aarden same as key
-                analyze_choice = 'Krumhansl' # my default as least errors on GSTQ 1 bar (Music21 default is Aarden same as key)
-
-                looking_for_first_chord = True
-                next_note_is_first_chord_offset = False
-                next_note_is_chord_offset = False
-                start_note_offset = 0.0
-                last_note_duration = 0.0
-                pitch_to_chord = {}
-
-                # for each stream element in a_song
-                for n in a_song.flatten():
-                    print('type(n)',type(n))
-                    if type(n) == music21.harmony.ChordSymbol or type(n) == music21.harmony.NoChord:
-                        if type(n) == music21.harmony.NoChord:
-                            print('NoChord', n.figure, n)
-                        else:
-                            # print('ChordSymbol ', n, n.figure, n.key, 'If writeAsChord False the harmony symbol is written',n.writeAsChord, n.romanNumeral )
-                            print('ChordSymbol ', n.figure, n )
-                        #     if chord and chord not 'NC' and looking_for_first_chord:
-                        if looking_for_first_chord and type(n) != music21.harmony.NoChord:
-                            looking_for_first_chord = False
-                            next_note_is_first_chord_offset = True
-                            chord_1 = n.figure
-                            map_chord = chord_1
-                        else: # found a later chord
-                            # if type(n) != music21.harmony.NoChord:
-                            next_note_is_chord_offset = True
-                            chord_2 = n.figure
-
-
-                    # if type(n) == music21.harmony.NoChord:
-                    #     print('NoChord', n.figure, n)
-
-                    if type(n) == music21.note.Note:
-                        last_note_duration = n.duration.quarterLength
-                        print('note offset, name and duration', n.offset, n.nameWithOctave, n.duration.quarterLength)
-                        if next_note_is_first_chord_offset:
-                            #         get next note
-                            #         start_note_offset = note_offset
-                            #         looking_for_first_chord = False
-                            start_note_offset = n.offset
-                            looking_for_first_chord = False
-                            next_note_is_first_chord_offset = False
-                        if next_note_is_chord_offset:
-                            next_note_is_chord_offset = False
-                            end_note_offset = n.offset
-                            shorter_stream = get_stream(a_song, start_note_offset, end_note_offset)
-
-                            if stream_has_a_note(shorter_stream) :
-                                # print('ANALYZE_CHOICE =', analyze_choice)
-                                if map_chord != 'N.C.' and map_chord != 'NC':
-                                    key_chord = get_pitch_classes_in_stream(shorter_stream)
-                                    print('     JSON start_note_offset', start_note_offset, 'end_note_offset', end_note_offset,'key_chord',key_chord,'map_chord',map_chord,'----JSON----')
-                                    # add to json structure
-                                    key = (display_pitch_classes(key_chord))
-                                    print('key', key) # e.g. ('C')
-                                    if key in pitch_to_chord:
-                                        if map_chord in pitch_to_chord[key]:
-                                            pitch_to_chord[key][map_chord] += 1
-                                        else:
-                                            pitch_to_chord[key][map_chord] = 1
-                                    else:
-                                        pitch_to_chord[key] = {map_chord: 1}
-                                map_chord = chord_2
-                                start_note_offset = end_note_offset
-
-                    if type(n) == music21.note.Rest:
-                        print('rest offset and duration', n.offset, n.duration.quarterLength)
-
-                # if no chords then ignore and continue with next file
-                if looking_for_first_chord == True:
-                    print('NO CHORD FOUND IN', mxlfile,'...CONTINUE')
-                    # input('Press Enter to continue...')
-                    continue
-                                   
-                # handle last chord / note(s)
-                if map_chord != 'N.C.' and map_chord != 'NC':
-                    end_note_offset = start_note_offset + last_note_duration
-                    shorter_stream = get_stream(a_song, start_note_offset, end_note_offset)
-                    if stream_has_a_note(shorter_stream) :
-                        key_chord = get_pitch_classes_in_stream(shorter_stream)
-                        print('     JSON start_note_offset', start_note_offset, 'end_note_offset', end_note_offset,'key_chord',key_chord,'map_chord',map_chord,'----JSON----')
-                        # add to json structure
-                        key = (display_pitch_classes(key_chord))
-                        print('key', key)  # e.g. '1000 0000 0000'
-                        if key in pitch_to_chord:
-                            if map_chord in pitch_to_chord[key]:
-                                pitch_to_chord[key][map_chord] += 1
-                            else:
-                                pitch_to_chord[key][map_chord] = 1
-                        else:
-                            pitch_to_chord[key] = {map_chord: 1}
-
-                print('pitch_to_chord with frequency=', pitch_to_chord)  # e.g.
-
-                # Serializing json
-                json_object = json.dumps(pitch_to_chord, indent=4)
-
-                # Writing to sample.json
-                # with open("pitch_to_chord.json", "w") as outfile:
-                # output_path = 'input' + os.sep + 'style' + os.sep + 'pitch_to_chord' + os.sep
-                # args.outdir
-                output_path = args.outdir
-
-                # Check whether the specified path exists or not
-                isExist = os.path.exists(output_path)
-                if not isExist:
-                    # Create a new directory because it does not exist
-                    os.makedirs(output_path)
-                    print("The new directory is created!", output_path)
-
-                output_filename = os.path.splitext(mxlfile_basename)[0] + PITCH_TO_CHORD_PRE_EXTENSION + '.json'
-
-                with open(output_path + output_filename, "w") as outfile:
-                    outfile.write(json_object)
-                print('')
-                print('Output written to',output_path + output_filename)
-                print('create_chord_map.py', CREATE_CHORD_MAP_VERSION)
-
-                #     if chord and chord not 'NC' and not looking_for_first_chord:
-                #         get next note
-                #         end_note_offset = note_offset
-                #         chord_2 = chord
-                #         shorter_stream = get_stream(a_song, start_note_offset, end_note_offset )
-                #         if stream_has_a_note(shorter_stream):
-                #             # print('ANALYZE_CHOICE =', analyze_choice)
-                #             key_chord = shorter_stream.analyze(analyze_choice)
-                #             print('key_chord',key_chord,'map_chord',map_chord)
-                #             # TBD add to json structure
-                #         map_chord = chord_2
-                #         start_note_offset = end_note_offset
-                #
-                # if looking_for_first_chord: exit error no chord found ensure input file has chord symbols
-
-                # show graphs
-                # label = 'Input ' + mxlfile_normalised_name
-                # show_histograms(a_song, label)
+                mxlfiles.append(os.path.join(args.mxldir, filename))
+
+    if args.jobs == 1:
+        for mxlfile in mxlfiles:
+            create_chord_map(mxlfile, args.outdir, args.transpose)
+    else:
+        # each melody is independent until its json is written, so process them in a pool of worker processes
+        print('processing', len(mxlfiles), 'files with', args.jobs, 'jobs')
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            for output_filename, log in executor.map(create_chord_map_logged, mxlfiles,
+                                                     [args.outdir] * len(mxlfiles), [args.transpose] * len(mxlfiles)):
+                print(log, end='')
 
 if __name__ == '__main__':
 
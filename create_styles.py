@@ -17,18 +17,22 @@
 #
 # free and open-source software, Paul Wardley Davies, see license.txt
 
-# usage: create_styles.py [-h] [-i INPUTDIR]
+# Styles are merged incrementally: a manifest per style in cache/style_manifest/ keeps the fingerprint of
+# each file, so a later run only reads new or changed files and skips styles where nothing has changed.
+#
+# usage: create_styles.py [-h] [-i INPUTDIR] [-r]
 #
 # optional arguments:
 #   -h, --help            show this help message and exit
 #   -i INPUTDIR, --inputdir INPUTDIR
 #                         input file path, relative to current working directory. Default is input/styles
+#   -r, --rebuild         ignore the manifests of the previous run and read every .json file again
 
 
 # standard libraries
 import argparse
-import ast
 import bisect
+import hashlib
 import json
 import math
 import music21
@@ -44,6 +48,7 @@ from music21.harmony import ChordSymbol, NoChord
 from VeeHarmGen_utilities import *
 
 CREATE_STYLES_VERSION = '1.0.0'
+STYLE_MANIFEST_PATH = 'cache/style_manifest/'
 
 def get_immediate_subdirectories(a_dir):
     """
@@ -54,6 +59,175 @@ def get_immediate_subdirectories(a_dir):
     return [name for name in os.listdir(a_dir)
             if os.path.isdir(os.path.join(a_dir, name))]
 
+def get_file_fingerprint(fully_qualified_filename, file_bytes=None):
+    """
+    :param fully_qualified_filename: e.g. input/style/blues_1/song-_-ptc.json
+    :param file_bytes: the contents of the file if already read, else it is read
+    :return: fingerprint e.g. {'mtime_ns': 1700000000000000000, 'size': 1234, 'sha1': '5d41...'}
+    """
+    file_stat = os.stat(fully_qualified_filename)
+    if file_bytes is None:
+        with open(fully_qualified_filename, 'rb') as openfile:
+            file_bytes = openfile.read()
+    return {'mtime_ns': file_stat.st_mtime_ns, 'size': file_stat.st_size, 'sha1': hashlib.sha1(file_bytes).hexdigest()}
+
+
+def is_unchanged(fully_qualified_filename, fingerprint):
+    """
+    :param fully_qualified_filename: e.g. input/style/blues_1/song-_-ptc.json
+    :param fingerprint: from get_file_fingerprint on a previous run, or None
+    :return: True if the file is unchanged: the same modification time and size, else the same sha1
+    """
+    if fingerprint is None or not os.path.isfile(fully_qualified_filename):
+        return False
+    file_stat = os.stat(fully_qualified_filename)
+    if file_stat.st_mtime_ns == fingerprint['mtime_ns'] and file_stat.st_size == fingerprint['size']:
+        return True
+    return get_file_fingerprint(fully_qualified_filename)['sha1'] == fingerprint['sha1']
+
+
+def get_manifest_filename(input_style_dir):
+    """
+    :param input_style_dir: e.g. input/style/blues_1
+    :return: manifest of the style directory in STYLE_MANIFEST_PATH e.g. cache/style_manifest/blues_1-3f2a9c1d0b7e.json
+    """
+    directory_sha1 = hashlib.sha1(os.path.abspath(input_style_dir).encode('utf-8')).hexdigest()
+    return STYLE_MANIFEST_PATH + os.path.basename(os.path.normpath(input_style_dir)) + '-' + directory_sha1[:12] + JSON_EXTENSION
+
+
+def write_file(fully_qualified_filename, text):
+    """
+    write to a temporary file and rename, so a reader never sees a partly written file
+    :param fully_qualified_filename: e.g. input/style/blues_1-_-ptc.json
+    :param text: e.g. json
+    :return: void
+    """
+    temporary_filename = fully_qualified_filename + '.' + str(os.getpid()) + '.tmp'
+    with open(temporary_filename, "w") as outfile:
+        outfile.write(text)
+    os.replace(temporary_filename, fully_qualified_filename)
+
+
+def add_contribution(merged, file, pitch_to_chord):
+    """
+    add the chord frequencies of one file to the merged contributions, with where each pitch class and chord is in the file
+    :param merged: {pitch class: {chord: {file: [pitch class index, chord index, frequency]}}}
+    :param file: e.g. song-_-ptc.json
+    :param pitch_to_chord: of the file e.g. {'1000 0000 0000': {'Am': 1, 'C': 1}}
+    :return: void
+    """
+    for pitch_class_index, (k, map_chord) in enumerate(pitch_to_chord.items()):
+        merged_map_chord = merged.setdefault(k, {})
+        for chord_index, (mpk, mpv) in enumerate(map_chord.items()):
+            merged_map_chord.setdefault(mpk, {})[file] = [pitch_class_index, chord_index, mpv]
+
+
+def remove_contribution(merged, file, pitch_classes):
+    """
+    subtract the chord frequencies of one file from the merged contributions, dropping chords and pitch classes left empty
+    :param merged: {pitch class: {chord: {file: [pitch class index, chord index, frequency]}}}
+    :param file: e.g. song-_-ptc.json
+    :param pitch_classes: of the file e.g. ['1000 0000 0000']
+    :return: void
+    """
+    for k in pitch_classes:
+        merged_map_chord = merged.get(k, {})
+        for mpk in list(merged_map_chord):
+            merged_map_chord[mpk].pop(file, None)
+            if not merged_map_chord[mpk]:
+                del merged_map_chord[mpk]
+        if not merged_map_chord:
+            merged.pop(k, None)
+
+
+def get_merged_pitch_to_chord(merged):
+    """
+    add up the frequencies of the same chord for the same pitch class.
+    Pitch classes and chords keep the order they are first found in, reading the files in name order,
+    which breaks frequency ties when choosing chords
+    :param merged: {pitch class: {chord: {file: [pitch class index, chord index, frequency]}}}
+    :return: merged_pitch_to_chord e.g. {'1000 0000 0000': {'C': 3, 'Am': 1}}
+    """
+    def first_found(contributions, index):
+        return min((file, contribution[index]) for file, contribution in contributions.items())
+
+    merged_pitch_to_chord = {}
+    for k in sorted(merged, key=lambda k: min(first_found(contributions, 0) for contributions in merged[k].values())):
+        merged_map_chord = merged[k]
+        merged_pitch_to_chord[k] = {mpk: sum(contribution[2] for contribution in merged_map_chord[mpk].values())
+                                    for mpk in sorted(merged_map_chord, key=lambda mpk: first_found(merged_map_chord[mpk], 1))}
+    return merged_pitch_to_chord
+
+
+def create_style(input_style_dir, output_pitch_to_chord_fully_qualified, rebuild=False):
+    """
+    merge the -_-ptc.json files in input_style_dir to output_pitch_to_chord_fully_qualified.
+    A manifest of the previous run (see get_manifest_filename) keeps the fingerprint of each file and the merged
+    frequencies with what each file contributed, so only new or changed files are read, the old contribution of a
+    changed or removed file is subtracted and the new one added, and nothing is written if no file has changed
+    :param input_style_dir: e.g. input/style/blues_1
+    :param output_pitch_to_chord_fully_qualified: e.g. input/style/blues_1-_-ptc.json
+    :param rebuild: True to ignore the manifest and read every file
+    :return: void
+    """
+    manifest_filename = get_manifest_filename(input_style_dir)
+    manifest = {'files': {}, 'merged': {}, 'output': None}
+    if not rebuild and os.path.isfile(manifest_filename):
+        try:
+            previous_manifest = load_json(manifest_filename)
+            if 'merged' in previous_manifest:
+                manifest = previous_manifest
+        except (OSError, ValueError) as e:
+            print('    Warning: could not read manifest', manifest_filename, e)
+    merged = manifest['merged']
+
+    # for each file in subdir, in the order they are merged
+    files = sorted(file for file in os.listdir(input_style_dir) if file.endswith(PITCH_TO_CHORD_FILENAME_ENDING))
+    changed = False
+    for file in list(manifest['files']):
+        if file not in files:
+            print('    file', file, 'removed')
+            remove_contribution(merged, file, manifest['files'].pop(file)['pitch_classes'])
+            changed = True
+    for file in files:
+        input_pitch_to_chord_fully_qualified = os.path.join(input_style_dir, file)
+        file_manifest = manifest['files'].get(file)
+        if file_manifest is not None and is_unchanged(input_pitch_to_chord_fully_qualified, file_manifest['fingerprint']):
+            print('    file', file, 'unchanged')
+            continue
+        #       read file
+        with open(input_pitch_to_chord_fully_qualified, 'rb') as openfile:
+            file_bytes = openfile.read()
+        pitch_to_chord = json.loads(file_bytes.decode('utf-8'))
+        print('    file', file, 'new' if file_manifest is None else 'changed', len(pitch_to_chord), 'pitch classes')
+        if file_manifest is not None:
+            remove_contribution(merged, file, file_manifest['pitch_classes'])
+        add_contribution(merged, file, pitch_to_chord)
+        manifest['files'][file] = {'fingerprint': get_file_fingerprint(input_pitch_to_chord_fully_qualified, file_bytes),
+                                   'pitch_classes': list(pitch_to_chord)}
+        changed = True
+
+    if not changed and is_unchanged(output_pitch_to_chord_fully_qualified, manifest['output']):
+        print('    style unchanged', output_pitch_to_chord_fully_qualified)
+        return
+
+    #       merge files to merged_pitch_to_chord
+    merged_pitch_to_chord = get_merged_pitch_to_chord(merged)
+
+    print('Writing ',output_pitch_to_chord_fully_qualified)
+    print('merged_pitch_to_chord', len(merged_pitch_to_chord), 'pitch classes from', len(files), 'files')
+    # Serializing json
+    json_object = json.dumps(merged_pitch_to_chord, indent=4)
+    write_file(output_pitch_to_chord_fully_qualified, json_object)
+
+    manifest['output'] = get_file_fingerprint(output_pitch_to_chord_fully_qualified)
+    try:
+        os.makedirs(STYLE_MANIFEST_PATH, exist_ok=True)
+        write_file(manifest_filename, json.dumps(manifest))
+    except OSError as e:
+        print('    Warning: could not write manifest', manifest_filename, e)
+
+
 def main():
     """
     get command line arguments
@@ -71,6 +245,9 @@ def main():
                             'This merges the .json files in each sub-directory and outputs to the parent directory.',
                         default='input/style',
                         type=str)
+    parser.add_argument('-r', '--rebuild',
+                        help='ignore the manifests of the previous run and read every .json file again',
+                        action='store_true')
 
     # Parse command line arguments.
     args = parser.parse_args()
@@ -80,6 +257,7 @@ def main():
     print('vars(args)', vars(args))
     # show particular args
     print('args.inputdir', args.inputdir)
+    print('args.rebuild', args.rebuild)
     # input('Press Enter to continue...')
 
     # for each sub-directory in input/styles
@@ -91,84 +269,14 @@ def main():
     print('')
     # input('Press Enter to continue...')
 
-    pitch_to_chord = {}
-
     for style in style_dirs:
-        merged_pitch_to_chord = {}
         print('style', style)
-        # merge the .json files in sub-directory
-
-        # for each file in subdir
         input_style_dir = input_path + os.sep + style
-        for file in os.listdir(input_style_dir):
-            if file.endswith(PITCH_TO_CHORD_FILENAME_ENDING):
-
-                print('    file', file)
-                input_pitch_to_chord_fully_qualified = os.path.join(input_style_dir, file)
-                # print('input_pitch_to_chord_fully_qualified', input_pitch_to_chord_fully_qualified)
-
-                #       read file
-                pitch_to_chord = load_json(input_pitch_to_chord_fully_qualified)
-                print('    pitch_to_chord', pitch_to_chord)
-
-                #       merge file to merged_pitch_to_chord
-                for k, map_chord in pitch_to_chord.items():
-                    print(' type(k), k, type(map_chord), map_chord', type(k), k, type(map_chord), map_chord)
-                    if k in merged_pitch_to_chord:
-                        # print('     k in merged_pitch_to_chord')
-                        print('     k, type(merged_pitch_to_chord[k]), merged_pitch_to_chord[k]', k, type(merged_pitch_to_chord[k]), merged_pitch_to_chord[k])    # e.g. 0000 0000 0100 {'A9': 1}
-                        # print('     merged_pitch_to_chord', merged_pitch_to_chord)    # e.g.  {'1010 1001 0101': {'A9': 1, 'D9': 1}, '0000 1001 0100': {'A9': 1}, '0000 1000 0000': {'E9': 3, 'C#m7': 2}, '1010 0000 0100': {'D9': 2}, '0000 0000 0100': {'A9': 1}, '0000 1000 0100': {'A9': 2}, '0100 0000 0000': {'F#m7': 2}, '1000 0000 0101': {'Am7': 1}, '0000 0000 0101': {'D9': 1}, '0010 0000 0001': {'Bm7': 1}, '0101 1010 0000': {'C#m7': 1, 'D-m7': 1}, '1010 1010 0000': {'C': 2}, '0000 0000 0001': {'B': 1, 'Em': 8}, '0101 0000 1010': {'A-m': 1}, '0010 1101 0000': {'Dm7': 1}, '0000 0001 0101': {'G7': 1}, '1000 0000 0000': {'C': 9, 'Fm': 1}, '0010 0000 0000': {'Dm': 6, 'Dm7': 2, 'G': 1}}
-
-                        # for each key value in map_chord
-                        for mpk, mpv in map_chord.items():
-                            # print('         mpk, mpv in map_chord.items()', mpk, mpv, map_chord.items())
-                            # if k in merged_pitch_to_chord[k]:
-                            if mpk in merged_pitch_to_chord[k]:
-                                print('             mpk in merged_pitch_to_chord[k]:', mpk, 'in', merged_pitch_to_chord[k] )
-                                # add value to merged_pitch_to_chord[k].value
-                                # print('             merged_pitch_to_chord[k][mpk] + mpv', merged_pitch_to_chord[k][mpk],  ' + ',  mpv)
-                                merged_pitch_to_chord[k][mpk] = merged_pitch_to_chord[k][mpk] + mpv
-                                # print('             = merged_pitch_to_chord[k][mpk] ',merged_pitch_to_chord[k][mpk] )
-
-                            else:
-                                print('             mpk not in merged_pitch_to_chord[k]:', mpk, 'NOT in', merged_pitch_to_chord[k]  )
-                                # add new mpk, mpv to merged_pitch_to_chord[k]
-                                # print('             add ', mpk, mpv, ' to ', merged_pitch_to_chord[k])
-                                # print('             merged_pitch_to_chord[k] [mpk] = mpv', merged_pitch_to_chord[k], mpk, ' = ', mpv)
-                                merged_pitch_to_chord[k][mpk] = mpv
-                        print('     new merged_pitch_to_chord[k]', merged_pitch_to_chord[k])
-
-                        # if map_chord in merged_pitch_to_chord[k]:   # TypeError: unhashable type: 'dict'
-                        #     # e.g. 0000 0000 0100 already in merged_pitch_to_chord
-                        #     # merge map_chords
-                        #     print('merged_pitch_to_chord[k]', merged_pitch_to_chord[k])
-                        #     pass
-                        #     merged_pitch_to_chord[k][str(map_chord)] += 1
-                        # else:
-                        #     merged_pitch_to_chord[k][str(map_chord)] = 1
-
-                    else:
-                        # print('k not in merged_pitch_to_chord.')
-                        # key = frozenset(pitch_to_chord.items())
-                        # merged_pitch_to_chord[k] = {dumps(map_chord)}
-                        s = '{ '
-                        for k2, v2 in map_chord.items():
-                            s = s + "'" + k2 + "'" +  ' : ' + str(v2) + ', '
-                        s = s.rstrip(', ')
-                        s = s + ' }'
-                        # print('s',s)
-                        merged_pitch_to_chord[k] = ast.literal_eval(s)
-
         # write the style data in parent including the name of sub-directory in the output file name. e.g. traditional-1-_-ptc.json
         output_pitch_to_chord_fully_qualified = output_path + os.sep + style + PITCH_TO_CHORD_FILENAME_ENDING
+        create_style(input_style_dir, output_pitch_to_chord_fully_qualified, args.rebuild)
+        print('')
 
-        print('Writing ',output_pitch_to_chord_fully_qualified)
-
-        # Serializing json
-        print('merged_pitch_to_chord', merged_pitch_to_chord)
-        json_object = json.dumps(merged_pitch_to_chord, indent=4)
-        with open(output_pitch_to_chord_fully_qualified, "w") as outfile:
-            outfile.write(json_object)
 
 if __name__ == '__main__':
 
@@ -12,15 +12,5 @@ then
   exit 1
 else 
   python3 VeeHarmGen.py -m input/music/$1.mxl
-  python3 VeeHarmGen.py -m output/$1-BAR1.mxl -s $2
-  python3 VeeHarmGen.py -m output/$1-BAR1.mxl -s $2 -c nth_outcome -n 0 -i Clarinet
-  python3 VeeHarmGen.py -m output/$1-BAR1.mxl -s $2 -c nth_outcome -n 1 -i Flute
-  python3 VeeHarmGen.py -m output/$1-BAR1.mxl -s $2 -c nth_outcome -n 2 -i Guitar
-  python3 VeeHarmGen.py -m output/$1-BAR1.mxl -s $2 -c nth_outcome -n 3 -i Harmonica
-  python3 VeeHarmGen.py -m output/$1-BAR1.mxl -s $2 -c nth_outcome -n 4 -i Oboe
-  python3 VeeHarmGen.py -m output/$1-BAR1.mxl -s $2 -c nth_outcome -n 5 -i Saxophone
-  python3 VeeHarmGen.py -m output/$1-BAR1.mxl -s $2 -c nth_outcome -n 6 -i Trumpet
-  python3 VeeHarmGen.py -m output/$1-BAR1.mxl -s $2 -c nth_outcome -n 7 -i Violin
-  python3 VeeHarmGen.py -m output/$1-BAR1.mxl -s $2 -c nth_outcome -n 8 -i Violoncello
-  python3 VeeHarmGen.py -m output/$1-BAR1.mxl -s $2 -c nth_outcome -n 9 -i Voice
+  python3 VeeHarmGen.py -m output/$1-BAR1.mxl -s $2 --sweep rank:100 nth_outcome:0-9:Clarinet,Flute,Guitar,Harmonica,Oboe,Saxophone,Trumpet,Violin,Violoncello,Voice
 fi
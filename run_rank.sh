@@ -12,15 +12,5 @@ then
   exit 1
 else 
   python3 VeeHarmGen.py -m input/music/$1.mxl
-  python3 VeeHarmGen.py -m output/$1-BAR1.mxl -s all-_-ptc
-  python3 VeeHarmGen.py -m output/$1-BAR1.mxl -s all-_-ptc -c rank -n 90 -i Clarinet
-  python3 VeeHarmGen.py -m output/$1-BAR1.mxl -s all-_-ptc -c rank -n 80 -i Flute
-  python3 VeeHarmGen.py -m output/$1-BAR1.mxl -s all-_-ptc -c rank -n 70 -i Guitar
-  python3 VeeHarmGen.py -m output/$1-BAR1.mxl -s all-_-ptc -c rank -n 60 -i Harmonica
-  python3 VeeHarmGen.py -m output/$1-BAR1.mxl -s all-_-ptc -c rank -n 50 -i Oboe
-  python3 VeeHarmGen.py -m output/$1-BAR1.mxl -s all-_-ptc -c rank -n 40 -i Saxophone
-  python3 VeeHarmGen.py -m output/$1-BAR1.mxl -s all-_-ptc -c rank -n 30 -i Trumpet
-  python3 VeeHarmGen.py -m output/$1-BAR1.mxl -s all-_-ptc -c rank -n 20 -i Violin
-  python3 VeeHarmGen.py -m output/$1-BAR1.mxl -s all-_-ptc -c rank -n 10 -i Violoncello
-  python3 VeeHarmGen.py -m output/$1-BAR1.mxl -s all-_-ptc -c rank -n 1  -i Voice
+  python3 VeeHarmGen.py -m output/$1-BAR1.mxl -s all-_-ptc --sweep rank:100,90,80,70,60,50,40,30,20,10,1:Piano,Clarinet,Flute,Guitar,Harmonica,Oboe,Saxophone,Trumpet,Violin,Violoncello,Voice
 fi
@@ -1,10 +1,13 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-# run_tests.py which runs the VeeHarmGen tests with parameters in the line_parameters variable and searches the output for errors
+# run_tests.py which runs the VeeHarmGen tests with parameters in the line_parameters variable and searches the output for errors,
+# then checks VeeHarmGen_server.py writes the same files as VeeHarmGen.py
 # free and open-source software, Paul Wardley Davies, see license.txt
 
 # usage: run_tests.py [-h]
 #   This runs the VeeHarmGen program appending the line_parameters variables and searches the output for errors.
+#   Then it starts VeeHarmGen_server.py on port 8062, posts server_test_request to /harmonise, gets /status,
+#   runs VeeHarmGen.py with server_test_parameters and compares the files written.
 
 
 # usage examples:
@@ -15,12 +18,18 @@
 
 # standard libraries
 import argparse
+import base64
 import glob
+import io
+import json
 import os
 import platform
 import subprocess
 from time import strftime
 import time
+import urllib.error
+import urllib.request
+import zipfile
 # from datetime import datetime
 
 
@@ -31,6 +40,112 @@ line_parameters = ['-m input/music/God_Save_The_Queen.xml',
                     '-m input/music/music.mxl '
                    ]
 
+SERVER_TEST_PORT = 8062  # not the server's default 8061, so a server already running is not used instead
+SERVER_TEST_START_SECONDS = 120  # how long to wait for the server to load the styles and answer /status
+# the server request and the VeeHarmGen.py parameters that should write the same files
+server_test_request = {'mxlfile': 'input/music/music.mxl', 'return_scores': True}
+server_test_parameters = ' -m input/music/music.mxl'
+
+
+def get_server_json(url, request=None):
+    """
+    :param url: e.g. http://127.0.0.1:8062/status
+    :param request: dict to POST as JSON, or None to GET
+    :return: the response dict
+    """
+    data = json.dumps(request).encode('utf-8') if request is not None else None
+    http_request = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(http_request) as http_response:
+            return json.loads(http_response.read().decode('utf-8'))
+    except urllib.error.HTTPError as e:
+        return json.loads(e.read().decode('utf-8'))
+
+
+def get_score_contents(output_file, content):
+    """
+    :param output_file: e.g. output/music-BAR1.mxl
+    :param content: bytes of the file
+    :return: content, or for .mxl the content of each file in the archive, as the archive records when it was written
+    """
+    if output_file.endswith('.mxl'):
+        with zipfile.ZipFile(io.BytesIO(content)) as mxl_file:
+            return {name: mxl_file.read(name) for name in mxl_file.namelist()}
+    return content
+
+
+def run_server_test(python_name, redirection_base_str, redirection_end_str):
+    """
+    start VeeHarmGen_server.py on SERVER_TEST_PORT, post server_test_request and get /status,
+    then run VeeHarmGen.py with server_test_parameters and compare its files with those the server returned
+    :param python_name: e.g. python3
+    :param redirection_base_str: e.g. ' > '
+    :param redirection_end_str: e.g. ' 2>&1'
+    :return: True if the server and VeeHarmGen.py wrote the same files
+    """
+    server_url = 'http://127.0.0.1:' + str(SERVER_TEST_PORT)
+    dt_string = strftime("%Y%m%d-%H_%M_%S")
+    server_log_path_file = 'output' + os.sep + 'run_tests-server-' + dt_string + '.log'
+    print(dt_string, 'Starting: VeeHarmGen_server.py on', server_url, '...')
+    with open(server_log_path_file, 'w') as server_log:
+        server = subprocess.Popen([python_name, 'VeeHarmGen_server.py', '--port', str(SERVER_TEST_PORT)],
+                                  stdout=server_log, stderr=subprocess.STDOUT)
+    try:
+        # wait until the server has loaded the styles and answers
+        status = None
+        for second in range(SERVER_TEST_START_SECONDS):
+            if server.poll() is not None:
+                break
+            try:
+                status = get_server_json(server_url + '/status')
+                break
+            except urllib.error.URLError:
+                time.sleep(1)
+        if status is None:
+            print('Error VeeHarmGen_server.py did not start, see', server_log_path_file)
+            return False
+        print('Posting:', server_test_request, 'to', server_url + '/harmonise ...')
+        response = get_server_json(server_url + '/harmonise', server_test_request)
+        status = get_server_json(server_url + '/status')
+    finally:
+        server.terminate()
+        server.wait()
+    if response.get('status') != 'ok':
+        print('Error VeeHarmGen_server.py response', response.get('error'))
+        return False
+    if status.get('requests') != 1:
+        print('Error VeeHarmGen_server.py /status requests', status.get('requests'), 'expected 1')
+        return False
+
+    # keep the files the server wrote and remove them, so VeeHarmGen.py has to write them again
+    server_scores = {}
+    for score in response['scores']:
+        if score['encoding'] == 'base64':
+            content = base64.b64decode(score['content'])
+        else:
+            content = score['content'].encode('utf-8')
+        server_scores[score['file']] = get_score_contents(score['file'], content)
+        os.remove(score['file'])
+
+    log_path_file = 'output' + os.sep + 'run_tests-' + dt_string + '-cli.log'
+    call_str = python_name + ' VeeHarmGen.py' + server_test_parameters + redirection_base_str + log_path_file + redirection_end_str
+    print(strftime("%Y%m%d-%H_%M_%S"), 'Running: ', call_str, '...')
+    subprocess.call(call_str, shell=True)
+
+    same = len(server_scores) > 0
+    for output_file, server_contents in server_scores.items():
+        if not os.path.isfile(output_file):
+            print('Error not written by VeeHarmGen.py', output_file)
+            same = False
+            continue
+        with open(output_file, 'rb') as openfile:
+            contents = get_score_contents(output_file, openfile.read())
+        if contents != server_contents:
+            print('Error VeeHarmGen_server.py and VeeHarmGen.py differ in', output_file)
+            same = False
+    print('Server test:', len(server_scores), 'files from VeeHarmGen_server.py', 'same as' if same else 'NOT the same as', 'VeeHarmGen.py')
+    return same
+
 def main():
 
     # get platform
@@ -57,10 +172,11 @@ def main():
     program_arguments = ' '
 
 
-    program_fully_qualified = "python VeeHarmGen.py" + program_arguments
+    python_name = "python"
     if platform.system() == 'Linux':
         # print('Linux')
-        program_fully_qualified = "python3 VeeHarmGen.py" + program_arguments
+        python_name = "python3"
+    program_fully_qualified = python_name + " VeeHarmGen.py" + program_arguments
         
     # print('program_fully_qualified', program_fully_qualified)
 
@@ -111,6 +227,8 @@ def main():
             if any(word in line for word in search_words):
                 print(line)
 
+    run_server_test(python_name, redirection_base_str, redirection_end_str)
+
     print('\nrun_tests.py line_parameters:', line_parameters, '\n')
 
 